@@ -4,12 +4,21 @@
 Главный класс голосового помощника банка Бакай
 """
 
-from typing import Dict, List, Optional, Any
-from config import BANK_CONFIG, BANK_LINKS
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import BANK_CONFIG, BANK_LINKS, MATERIALIZE_CONFIG, SCHEDULER_CONFIG, TTS_CONFIG
 from tts_system import BakaiTTS
+from tts_queue import BakaiTTSQueue
 from content_manager import BakaiContentManager
 from rag_system import BakaiRAG
 from link_manager import BakaiLinkManager
+from request_context import BakaiRequestContext, BakaiStats
+from single_flight import BakaiFlightTimeout, BakaiSingleFlight
+from query_analysis import BakaiQueryAnalyzer
+from query_log import BakaiQueryLog
+from materializer import BakaiAnswerStore
 
 class BakaiAssistant:
     """Главный класс голосового помощника банка Бакай"""
@@ -22,102 +31,330 @@ class BakaiAssistant:
         self.content_manager = BakaiContentManager()
         self.rag = BakaiRAG()
         self.link_manager = BakaiLinkManager()
+        self.link_manager.index_urls(self.rag.document_urls)
+        
+        # Запрос разбирается один раз, результат используют все этапы
+        self.query_analyzer = BakaiQueryAnalyzer(self.content_manager, self.link_manager)
+        
+        # Озвучивание выполняется в очереди, вне пути обработки запроса
+        # С пулом процессов синтеза очередь обслуживает столько же заданий одновременно
+        engine = getattr(self.tts, 'engine', None)
+        self.tts_queue = BakaiTTSQueue(self.tts, workers=engine.workers if engine else None)
         
         # Настройки
         self.tts_enabled = True
+        self.tts_background = TTS_CONFIG.get("background", True)  # Не ждать синтеза речи
+        self.play_audio = True  # Воспроизведение на этом компьютере (в режиме сервера - нет)
         self.debug_mode = False
-        self.session_stats = {
-            'queries_processed': 0,
-            'services_detected': {},
-            'errors_count': 0
-        }
+        self.offline = False  # Служебная обработка: без бюджетов этапов
+        self.stats = BakaiStats(
+            counters=['queries_processed', 'errors_count', 'materialized_answers'],
+            groups=['services_detected']
+        )
+        
+        # Одинаковые запросы, пришедшие одновременно, ждут одно вычисление
+        self.single_flight = BakaiSingleFlight() if SCHEDULER_CONFIG.get("single_flight", True) else None
+        
+        # Журнал запросов (источник частых запросов) и готовые ответы на FAQ и частые запросы
+        self.query_log = BakaiQueryLog(MATERIALIZE_CONFIG["query_log_path"]) \
+            if MATERIALIZE_CONFIG.get("log_queries", True) else None
+        self.answer_store = None
+        if MATERIALIZE_CONFIG.get("enabled", True):
+            self.answer_store = BakaiAnswerStore()
+            self.answer_store.load()
         
         print("✅ Помощник готов к работе!")
     
-    def process_query(self, query: str) -> Dict[str, Any]:
-        """Обработка пользовательского запроса"""
+    @property
+    def session_stats(self) -> Dict[str, Any]:
+        """Снимок статистики сессии"""
+        return self.stats.snapshot()
+    
+    def process_query(self, query: str, on_token: Optional[Callable[[str], None]] = None,
+                      deadline: Optional[float] = None, priority: Optional[int] = None,
+                      log_query: bool = True) -> Dict[str, Any]:
+        """Обработка пользовательского запроса
+        
+        on_token получает фрагменты ответа LLM по мере генерации (для потоковой выдачи),
+        deadline - секунд на весь запрос (по умолчанию DEADLINE_CONFIG["total"]),
+        priority - приоритет в очереди генерации, log_query=False - не записывать в журнал
+        (служебные запросы, например прогрев)
+        """
+        ctx = self._new_context(query, priority, deadline)
         try:
             print(f"\n🤖 Обработка запроса: '{query}'")
-            self.session_stats['queries_processed'] += 1
+            self.stats.increment('queries_processed')
+            self._analyze_query(query, ctx, log_query)
             
-            # 1. Озвучиваем вопрос
-            if self.tts_enabled and self.tts.is_initialized:
-                voice = self.tts.select_voice_for_query(query)
-                self.tts.speak(f"Ваш вопрос: {query}", voice="kseniya")
+            # Готовый ответ - без поиска, генерации и синтеза
+            materialized = self.answer_store.lookup(query) if self.answer_store is not None else None
+            if materialized is not None:
+                return self._materialized_result(materialized, ctx)
             
-            # 2. Поиск документов
-            print("🔍 Поиск релевантных документов...")
-            documents = self.rag.search_documents(query)
+            # 1. Озвучиваем вопрос
+            if self._tts_active():
+                self.tts_queue.submit(f"Ваш вопрос: {query}", "kseniya", self.play_audio)
             
-            # 3. Генерация или создание ответа
-            if not documents:
-                answer = "К сожалению, не найдено информации по вашему запросу."
-                link = BANK_LINKS["support"]
-                service_type = None
+            # 2-3. Поиск и ответ: одинаковые запросы в работе вычисляются один раз
+            if self.single_flight is not None:
+                with ctx.stage('single_flight'):
+                    try:
+                        shared, is_shared = self.single_flight.run(
+                            ctx.analysis.normalized,
+                            lambda publish: self._answer_query(query, ctx, publish),
+                            on_token, priority=ctx.priority, timeout=ctx.stage_remaining('single_flight')
+                        )
+                    except BakaiFlightTimeout:
+                        # Одинаковый запрос не успел к нашему сроку - отвечаем сами в упрощенном режиме
+                        ctx.degrade('single_flight')
+                        shared, is_shared = self._answer_query(query, ctx, on_token), False
+                answer, link, documents = self._apply_shared(shared, is_shared, ctx)
             else:
-                # Генерация ответа
-                print("📝 Генерация ответа...")
-                raw_answer = self.rag.generate_answer(query, documents)
-                
-                # Улучшение ответа (фильтрация, вежливость, предложения)
-                print("✨ Улучшение ответа...")
-                enhanced_answer = self.content_manager.enhance_response(raw_answer, query)
-                
-                # Определение типа услуги
-                service_type = self.content_manager.detect_service_type(query)
-                if service_type:
-                    self.session_stats['services_detected'][service_type] = \
-                        self.session_stats['services_detected'].get(service_type, 0) + 1
-                
-                # Получение релевантной ссылки
-                link = self.link_manager.get_relevant_link(query, documents)
-                
-                answer = enhanced_answer
+                answer, link, documents, _ = self._answer_query(query, ctx, on_token)
             
-            # 4. Финальный ответ с ссылкой
-            full_answer = f"{answer}\n\nПодробности: {link}"
-            
-            # 5. Озвучиваем ответ
-            if self.tts_enabled and self.tts.is_initialized:
-                voice = self.tts.select_voice_for_query(query)
-                print(f"🔊 Озвучивание ответа голосом {voice}...")
-                self.tts.speak(answer, voice=voice)
-            
-            # 6. Формируем результат
-            result = {
-                "answer": full_answer,
-                "raw_answer": answer,
-                "documents": documents,
-                "link": link,
-                "service_type": service_type,
-                "voice_used": voice if self.tts_enabled else None,
-                "documents_found": len(documents),
-                "processing_success": True
-            }
+            # 4. Озвучиваем ответ
+            if self._tts_active():
+                ctx.voice = ctx.analysis.voice
+                print(f"🔊 Озвучивание ответа голосом {ctx.voice}...")
+                self._queue_answer_audio(answer, ctx)
+                if not self.tts_background:
+                    with ctx.stage('tts'):
+                        try:
+                            ctx.audio_file = ctx.audio_job.result(timeout=ctx.stage_remaining('tts'))
+                        except FutureTimeoutError:
+                            # Не успели - отдаем текст, аудио доступно позже по audio_job_id
+                            ctx.degrade('tts')
             
+            # 5. Формируем результат
             print(f"✅ Запрос обработан успешно")
-            return result
+            return self._build_result(answer, link, documents, ctx)
             
         except Exception as e:
-            self.session_stats['errors_count'] += 1
-            error_msg = f"Произошла ошибка при обработке запроса: {str(e)}"
-            print(f"❌ {error_msg}")
+            return self._handle_error(e, ctx)
+    
+    def _answer_query(self, query: str, ctx: BakaiRequestContext,
+                      on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, str, List, BakaiRequestContext]:
+        """Общая для одинаковых запросов часть: поиск, генерация, ссылка и улучшение ответа"""
+        # Поиск документов
+        print("🔍 Поиск релевантных документов...")
+        documents = self.rag.search_documents(query, ctx=ctx)
+        
+        # Генерация или создание ответа
+        if not documents:
+            answer, link = self._no_documents_answer()
+            return answer, link, documents, ctx
+        
+        # Генерация ответа
+        print("📝 Генерация ответа...")
+        raw_answer = self.rag.generate_answer(query, documents, on_token=on_token, ctx=ctx)
+        
+        # Определение типа услуги и релевантной ссылки
+        with ctx.stage('enhancement'):
+            link = self.link_manager.get_relevant_link(query, documents, ctx.analysis.link_category)
+            
+            # Улучшение ответа (фильтрация, вежливость, предложения)
+            print("✨ Улучшение ответа...")
+            answer = self.content_manager.enhance_response(raw_answer, query, ctx)
+        
+        return answer, link, documents, ctx
+    
+    def _apply_shared(self, shared: Tuple, is_shared: bool, ctx: BakaiRequestContext) -> Tuple[str, str, List]:
+        """Результат общего вычисления для конкретного запроса"""
+        answer, link, documents, source_ctx = shared
+        if is_shared:
+            print(f"🔁 Ответ получен от одинакового запроса {source_ctx.request_id}")
+            ctx.adopt(source_ctx)
+        return answer, link, documents
+    
+    async def aprocess_query(self, query: str, deadline: Optional[float] = None,
+                             priority: Optional[int] = None, log_query: bool = True) -> Dict[str, Any]:
+        """Асинхронная обработка запроса: независимые этапы выполняются параллельно"""
+        ctx = self._new_context(query, priority, deadline)
+        try:
+            print(f"\n🤖 Обработка запроса: '{query}'")
+            self.stats.increment('queries_processed')
+            self._analyze_query(query, ctx, log_query)
             
-            # Озвучиваем ошибку
-            if self.tts_enabled and self.tts.is_initialized:
-                self.tts.speak("Извините, произошла техническая ошибка.")
+            # Готовый ответ - без поиска, генерации и синтеза
+            materialized = self.answer_store.lookup(query) if self.answer_store is not None else None
+            if materialized is not None:
+                return self._materialized_result(materialized, ctx)
             
-            return {
-                "answer": f"{error_msg}\n\nПодробности: {BANK_LINKS['support']}",
-                "raw_answer": error_msg,
-                "documents": [],
-                "link": BANK_LINKS["support"],
-                "service_type": None,
-                "voice_used": None,
-                "documents_found": 0,
-                "processing_success": False,
-                "error": str(e)
-            }
+            # 1. Озвучивание вопроса идет параллельно с поиском
+            if self._tts_active():
+                self.tts_queue.submit(f"Ваш вопрос: {query}", "kseniya", self.play_audio)
+            
+            # 2-3. Поиск и ответ (одинаковые запросы в работе - один раз)
+            if self.single_flight is not None:
+                with ctx.stage('single_flight'):
+                    try:
+                        shared, is_shared = await self.single_flight.arun(
+                            ctx.analysis.normalized,
+                            lambda: self._aanswer_query(query, ctx),
+                            priority=ctx.priority, timeout=ctx.stage_remaining('single_flight')
+                        )
+                    except BakaiFlightTimeout:
+                        ctx.degrade('single_flight')
+                        shared, is_shared = await self._aanswer_query(query, ctx), False
+                answer, link, documents = self._apply_shared(shared, is_shared, ctx)
+            else:
+                answer, link, documents, _ = await self._aanswer_query(query, ctx)
+            
+            # 4. Озвучиваем ответ
+            if self._tts_active():
+                ctx.voice = ctx.analysis.voice
+                print(f"🔊 Озвучивание ответа голосом {ctx.voice}...")
+                self._queue_answer_audio(answer, ctx)
+                if not self.tts_background:
+                    with ctx.stage('tts'):
+                        try:
+                            ctx.audio_file = await asyncio.wait_for(
+                                asyncio.shield(asyncio.wrap_future(ctx.audio_job)),
+                                timeout=ctx.stage_remaining('tts')
+                            )
+                        except asyncio.TimeoutError:
+                            ctx.degrade('tts')
+            
+            print(f"✅ Запрос обработан успешно")
+            return self._build_result(answer, link, documents, ctx)
+            
+        except Exception as e:
+            return self._handle_error(e, ctx)
+    
+    async def _aanswer_query(self, query: str, ctx: BakaiRequestContext) -> Tuple[str, str, List, BakaiRequestContext]:
+        """Асинхронная общая часть: ссылка определяется, пока ждем LLM"""
+        print("🔍 Поиск релевантных документов...")
+        documents, search_type = await self.rag.asearch_documents_with_type(query, ctx=ctx)
+        
+        if not documents:
+            answer, link = self._no_documents_answer()
+            return answer, link, documents, ctx
+        
+        print("📝 Генерация ответа...")
+        raw_answer, link = await asyncio.gather(
+            self.rag.agenerate_answer(query, documents, search_type, ctx=ctx),
+            asyncio.to_thread(self.link_manager.get_relevant_link, query, documents, ctx.analysis.link_category)
+        )
+        
+        print("✨ Улучшение ответа...")
+        with ctx.stage('enhancement'):
+            answer = self.content_manager.enhance_response(raw_answer, query, ctx)
+        
+        return answer, link, documents, ctx
+    
+    def _new_context(self, query: str, priority: Optional[int],
+                     deadline: Optional[float]) -> BakaiRequestContext:
+        """Контекст запроса; при служебной обработке этапы не ограничены своими бюджетами"""
+        return BakaiRequestContext(query, priority=priority, deadline=deadline,
+                                   stage_budgets={} if self.offline else None)
+    
+    def _tts_active(self) -> bool:
+        """Озвучивание включено и доступно"""
+        return self.tts_enabled and self.tts.is_initialized
+    
+    def _queue_answer_audio(self, answer: str, ctx: BakaiRequestContext) -> None:
+        """Постановка ответа в очередь озвучивания с записью задания в контекст"""
+        ctx.audio_job_id, ctx.audio_job = self.tts_queue.submit(answer, ctx.voice, self.play_audio)
+    
+    def _no_documents_answer(self) -> Tuple[str, str]:
+        """Ответ и ссылка, когда ничего не найдено"""
+        return "К сожалению, не найдено информации по вашему запросу.", BANK_LINKS["support"]
+    
+    def _analyze_query(self, query: str, ctx: BakaiRequestContext, log_query: bool = True) -> None:
+        """Однократный разбор запроса: тип услуги - в контекст и статистику сессии, запрос - в журнал"""
+        ctx.analysis = self.query_analyzer.analyze(query)
+        ctx.service_type = ctx.analysis.service_type
+        ctx.service_confidence = ctx.analysis.service_confidence
+        if ctx.service_type:
+            self.stats.increment_in('services_detected', ctx.service_type)
+        if log_query and self.query_log is not None:
+            self.query_log.append(query, service_type=ctx.service_type, request_id=ctx.request_id)
+    
+    def _materialized_result(self, entry: Dict[str, Any], ctx: BakaiRequestContext) -> Dict[str, Any]:
+        """Результат из хранилища готовых ответов; озвучка - готовый файл или очередь TTS"""
+        print("📦 Готовый ответ из хранилища")
+        self.stats.increment('materialized_answers')
+        ctx.search_type = 'materialized'
+        ctx.service_type = entry['service_type'] or ctx.service_type
+        
+        if self._tts_active():
+            ctx.voice = entry['voice'] or ctx.analysis.voice
+            if entry['audio_file']:
+                ctx.audio_file = entry['audio_file']
+                ctx.audio_job_id, ctx.audio_job = self.tts_queue.submit_file(ctx.audio_file, self.play_audio)
+            else:
+                self._queue_answer_audio(entry['answer'], ctx)
+        
+        print(f"✅ Запрос обработан успешно")
+        return self._build_result(entry['answer'], entry['link'], [], ctx)
+    
+    @contextmanager
+    def offline_mode(self):
+        """Служебная обработка (материализация ответов): без озвучивания, журнала, готовых ответов
+        и бюджетов этапов - медленная генерация не должна деградировать
+        """
+        saved = (self.tts_enabled, self.query_log, self.answer_store, self.offline)
+        self.tts_enabled, self.query_log, self.answer_store, self.offline = False, None, None, True
+        try:
+            yield
+        finally:
+            self.tts_enabled, self.query_log, self.answer_store, self.offline = saved
+    
+    def _build_result(self, answer: str, link: str, documents: List,
+                      ctx: BakaiRequestContext) -> Dict[str, Any]:
+        """Формирование результата обработки запроса"""
+        return {
+            "answer": f"{answer}\n\nПодробности: {link}",
+            "raw_answer": answer,
+            "documents": documents,
+            "link": link,
+            "service_type": ctx.service_type,
+            "voice_used": ctx.voice,
+            "audio_file": ctx.audio_file,
+            "audio_job_id": ctx.audio_job_id,
+            "audio_job": ctx.audio_job,
+            "documents_found": len(documents),
+            "request_id": ctx.request_id,
+            "shared_from": ctx.shared_from,
+            "search_type": ctx.search_type,
+            "retrieved_ids": list(ctx.retrieved_ids),
+            "query_analysis": ctx.analysis.to_dict() if ctx.analysis else {},
+            "retrieval_plan": dict(ctx.retrieval_plan),
+            "answer_mode": ctx.answer_mode,
+            "context_stats": ctx.compression_stats,
+            "prompt_stats": ctx.prompt_stats,
+            "generation_stats": ctx.generation_stats,
+            "degraded_stages": list(ctx.degraded_stages),
+            "failed_stages": list(ctx.failed_stages),
+            "timings": ctx.to_dict()["timings"],
+            "processing_success": True
+        }
+    
+    def _handle_error(self, e: Exception, ctx: BakaiRequestContext) -> Dict[str, Any]:
+        """Результат при ошибке обработки запроса"""
+        self.stats.increment('errors_count')
+        error_msg = f"Произошла ошибка при обработке запроса: {str(e)}"
+        print(f"❌ {error_msg}")
+        
+        # Озвучиваем ошибку
+        if self._tts_active():
+            self.tts_queue.submit("Извините, произошла техническая ошибка.", play_audio=self.play_audio)
+        
+        return {
+            "answer": f"{error_msg}\n\nПодробности: {BANK_LINKS['support']}",
+            "raw_answer": error_msg,
+            "documents": [],
+            "link": BANK_LINKS["support"],
+            "service_type": None,
+            "voice_used": None,
+            "documents_found": 0,
+            "request_id": ctx.request_id,
+            "degraded_stages": list(ctx.degraded_stages),
+            "failed_stages": list(ctx.failed_stages),
+            "timings": ctx.to_dict()["timings"],
+            "processing_success": False,
+            "error": str(e)
+        }
     
     def set_tts_enabled(self, enabled: bool) -> None:
         """Включение/выключение озвучивания"""
@@ -126,7 +363,7 @@ class BakaiAssistant:
         print(f"🔊 Озвучивание {status}")
         
         if enabled and self.tts.is_initialized:
-            self.tts.speak(f"Озвучивание {status}")
+            self.tts_queue.submit(f"Озвучивание {status}", play_audio=self.play_audio)
     
     def set_debug_mode(self, enabled: bool) -> None:
         """Включение/выключение режима отладки"""
@@ -140,6 +377,8 @@ class BakaiAssistant:
             # Основные компоненты
             "tts_available": self.tts.is_initialized,
             "tts_enabled": self.tts_enabled,
+            "tts_background": self.tts_background,
+            "tts_queue": self.tts_queue.get_stats(),
             "database_ready": self.rag.vectorstore is not None,
             "llm_ready": self.rag.llm is not None,
             
@@ -149,6 +388,15 @@ class BakaiAssistant:
             
             # Статистика базы данных
             "database_stats": self.rag.get_database_stats(),
+            "routing_stats": self.rag.get_routing_stats(),
+            "scheduler_stats": self.rag.get_scheduler_stats(),
+            "retrieval_planner_stats": self.rag.get_retrieval_planner_stats(),
+            "vector_search_stats": self.rag.get_vector_search_stats(),
+            "pattern_engine_stats": self.content_manager.patterns.get_stats(),
+            "query_analysis_stats": self.query_analyzer.get_stats(),
+            "enhanced_cache_stats": self.content_manager.get_enhanced_cache_stats(),
+            "single_flight_stats": self.single_flight.get_stats() if self.single_flight else {},
+            "materialized_stats": self.answer_store.get_stats() if self.answer_store is not None else {},
             
             # Конфигурация контента
             "content_filters_enabled": True,
@@ -182,12 +430,14 @@ class BakaiAssistant:
     
     def analyze_query(self, query: str) -> Dict[str, Any]:
         """Подробный анализ запроса без генерации ответа"""
+        query_analysis = self.query_analyzer.analyze(query)
         analysis = {
             "query": query,
             "query_length": len(query),
-            "detected_service": self.content_manager.detect_service_type(query),
+            "detected_service": query_analysis.service_type,
             "link_categories": self.link_manager.analyze_query_categories(query),
-            "suggested_voice": self.tts.select_voice_for_query(query) if self.tts.is_initialized else None
+            "suggested_voice": query_analysis.voice if self.tts.is_initialized else None,
+            "query_analysis": query_analysis.to_dict()
         }
         
         # Поиск документов для анализа
@@ -204,11 +454,7 @@ class BakaiAssistant:
     
     def reset_session_stats(self) -> None:
         """Сброс статистики сессии"""
-        self.session_stats = {
-            'queries_processed': 0,
-            'services_detected': {},
-            'errors_count': 0
-        }
+        self.stats.reset()
         print("📊 Статистика сессии сброшена")
     
     def validate_system(self) -> Dict[str, Any]:
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmarks.py
+Замеры производительности компонентов помощника банка Бакай
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from config import TTS_CONFIG
+
+DEFAULT_TTS_TEXT = (
+    "Бакай Банк предлагает депозиты, кредиты и платежные карты. "
+    "Открыть карту можно в мобильном приложении или в любом филиале банка. "
+    "Для оформления кредита понадобится паспорт и подтверждение дохода. "
+    "Курсы валют обновляются ежедневно на официальном сайте. "
+    "Служба поддержки работает круглосуточно и ответит на ваши вопросы."
+)
+
+
+def _measure_tts(synthesize, text: str, voice: str, concurrency: int) -> Dict[str, float]:
+    """Замер синтеза: время, длительность аудио и коэффициент реального времени (RTF)"""
+    sample_rate = TTS_CONFIG["sample_rate"]
+    synthesize(text, voice)  # Прогрев
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        audios = list(pool.map(lambda _: synthesize(text, voice), range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    audio_seconds = sum(len(audio) for audio in audios) / sample_rate
+    return {
+        'synthesis_time': round(elapsed, 3),
+        'audio_seconds': round(audio_seconds, 2),
+        'rtf': round(elapsed / audio_seconds, 3) if audio_seconds else 0.0
+    }
+
+
+def run_tts_benchmark(worker_counts: List[int], thread_counts: List[int], concurrency: int = 1,
+                      text: str = None, voice: str = None) -> List[Dict[str, Any]]:
+    """Сравнение RTF синтеза речи для разных чисел процессов и потоков torch
+
+    workers = 0 означает синтез в основном процессе с заданным числом потоков torch
+    """
+    from tts_system import configure_torch_threads, load_silero_model
+    from tts_engine import BakaiSynthesisEngine
+
+    text = text or DEFAULT_TTS_TEXT
+    voice = voice or TTS_CONFIG["default_voice"]
+    results = []
+
+    print(f"⏱️ Бенчмарк TTS: {len(text)} символов, одновременных запросов: {concurrency}")
+    print(f"{'процессы':>9} {'потоки':>7} {'время, с':>9} {'аудио, с':>9} {'RTF':>7}")
+
+    model = None
+    model_lock = threading.Lock()  # Модель в основном процессе не потокобезопасна
+    for workers in worker_counts:
+        for threads in thread_counts:
+            if workers == 0:
+                configure_torch_threads(threads)
+                if model is None:
+                    model = load_silero_model(TTS_CONFIG["cache_dir"], TTS_CONFIG["language"],
+                                              TTS_CONFIG["model_name"])
+
+                def synthesize(t, v):
+                    with model_lock:
+                        return model.apply_tts(text=t, speaker=v, sample_rate=TTS_CONFIG["sample_rate"])
+
+                measurement = _measure_tts(synthesize, text, voice, concurrency)
+            else:
+                engine = BakaiSynthesisEngine(workers=workers, threads_per_worker=threads)
+                try:
+                    measurement = _measure_tts(engine.synthesize, text, voice, concurrency)
+                finally:
+                    engine.shutdown()
+
+            row = {'workers': workers, 'threads': threads, 'concurrency': concurrency, **measurement}
+            results.append(row)
+            print(f"{workers:>9} {threads:>7} {row['synthesis_time']:>9} {row['audio_seconds']:>9} {row['rtf']:>7}")
+
+    best = min(results, key=lambda row: row['rtf'])
+    print(f"🏁 Лучший RTF {best['rtf']}: процессов {best['workers']}, потоков {best['threads']} "
+          f"(ядер: {os.cpu_count()})")
+    return results
+
+
+def run_tts_batch_benchmark(text: str = None, voice: str = None) -> Dict[str, Any]:
+    """Сравнение пакетного синтеза предложений с синтезом по одному"""
+    from tts_system import BakaiTTS, split_for_synthesis
+
+    tts = BakaiTTS()
+    if not tts.is_initialized:
+        print("⚠️ TTS недоступен - бенчмарк пропущен")
+        return {}
+
+    voice = voice or TTS_CONFIG["default_voice"]
+    sentences = split_for_synthesis(text or DEFAULT_TTS_TEXT, min_chars=1)
+    tts.synthesize_many(sentences[:1], voice)  # Прогрев
+
+    start_time = time.perf_counter()
+    for sentence in sentences:
+        tts.model.apply_tts(text=sentence, speaker=voice, sample_rate=tts.sample_rate)
+    sequential_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    tts.synthesize_many(sentences, voice)
+    batched_time = time.perf_counter() - start_time
+
+    result = {
+        'sentences': len(sentences),
+        'batch_supported': hasattr(tts.model, 'apply_tts_batch'),
+        'sequential_time': round(sequential_time, 3),
+        'batched_time': round(batched_time, 3),
+        'speedup': round(sequential_time / batched_time, 2) if batched_time else 0.0
+    }
+    print(f"⏱️ Предложений: {result['sentences']}, по одному: {result['sequential_time']} с, "
+          f"пакетом: {result['batched_time']} с (ускорение x{result['speedup']})")
+    if not result['batch_supported']:
+        print(f"ℹ️ Модель {TTS_CONFIG['model_name']} не имеет пакетного пути - синтез идет по одному")
+    return result
+
+
+DEFAULT_RETRIEVAL_QUERIES = [
+    "подскажите, как оформить кредитную карту",
+    "где ближайший банкомат в Бишкеке",
+    "какие проценты по вкладам для физлиц",
+    "как отправить деньги за границу",
+    "сколько стоит обслуживание зарплатной карты",
+    "можно ли оплатить телефоном без карты",
+    "какие документы нужны для ипотеки",
+    "как открыть счет для ИП",
+    "что делать если карта заблокирована",
+    "есть ли у банка сейфовые ячейки"
+]
+
+
+def run_retrieval_benchmark(gap_ratios: List[float], queries: List[str] = None,
+                            k: int = None) -> List[Dict[str, Any]]:
+    """Подбор правила ранней остановки векторного поиска
+
+    Для каждого порога отрыва лидера: время, доля ранних остановок и совпадение
+    топ-k с полным поиском по всем вариантам запроса (без пробы)
+    """
+    from config import RAG_CONFIG
+    from rag_system import BakaiRAG
+
+    rag = BakaiRAG()
+    k = k or RAG_CONFIG["search_k"]
+    queries = queries or DEFAULT_RETRIEVAL_QUERIES
+    vector_only = {'tiers': ['vector'], 'variants': RAG_CONFIG.get("planner_max_variants", 8)}
+    saved = {key: RAG_CONFIG.get(key) for key in ("adaptive_vector_search", "adaptive_gap_ratio")}
+
+    def measure() -> Tuple[List[List[str]], float]:
+        start_time = time.perf_counter()
+        tops = [[doc.page_content for doc in rag._enhanced_vector_search(query, k, plan=vector_only)]
+                for query in queries]
+        return tops, time.perf_counter() - start_time
+
+    try:
+        RAG_CONFIG["adaptive_vector_search"] = False
+        baseline, baseline_time = measure()
+
+        print(f"⏱️ Бенчмарк векторного поиска: {len(queries)} запросов, k={k}, "
+              f"полный поиск {baseline_time:.3f} с")
+        print(f"{'отрыв':>6} {'время, с':>9} {'ускорение':>10} {'остановки':>10} {'топ-1':>6} {'топ-k':>6}")
+
+        results = []
+        RAG_CONFIG["adaptive_vector_search"] = True
+        for ratio in gap_ratios:
+            RAG_CONFIG["adaptive_gap_ratio"] = ratio
+            before = rag.get_vector_search_stats()
+            tops, elapsed = measure()
+            after = rag.get_vector_search_stats()
+
+            top1 = sum(bool(top) and bool(full) and top[0] == full[0] for top, full in zip(tops, baseline))
+            overlap = sum(len(set(top) & set(full)) / max(len(full), 1) for top, full in zip(tops, baseline))
+            row = {
+                'gap_ratio': ratio,
+                'time': round(elapsed, 3),
+                'speedup': round(baseline_time / elapsed, 2) if elapsed else 0.0,
+                'early_exit_rate': round((after['early_exits'] - before['early_exits']) / len(queries), 3),
+                'top1_agreement': round(top1 / len(queries), 3),
+                'topk_overlap': round(overlap / len(queries), 3)
+            }
+            results.append(row)
+            print(f"{ratio:>6} {row['time']:>9} {row['speedup']:>10} {row['early_exit_rate']:>10} "
+                  f"{row['top1_agreement']:>6} {row['topk_overlap']:>6}")
+    finally:
+        RAG_CONFIG.update(saved)
+
+    print("ℹ️ Порог задается в RAG_CONFIG['adaptive_gap_ratio']: меньше - чаще ранняя остановка")
+    return results
@@ -43,7 +43,7 @@ class BakaiCLI:
             welcome_text = "Добро пожаловать! Я голосовой помощник банка Бакай. Чем могу помочь?"
             print(f"\n🔊 {welcome_text}")
             if status['tts_enabled']:
-                self.assistant.tts.speak(welcome_text, voice="baya")
+                self.assistant.tts_queue.speak(welcome_text, voice="baya")
         
         self.show_commands()
     
@@ -185,7 +185,7 @@ class BakaiCLI:
             print(f"   Описание: {info.get('description', 'Описание недоступно')}")
             
             demo_text = f"Привет! Меня зовут {voice}. Добро пожаловать в банк Бакай!"
-            self.assistant.tts.speak(demo_text, voice=voice)
+            self.assistant.tts_queue.speak(demo_text, voice=voice)
             time.sleep(2)
     
     def show_detailed_status(self) -> None:
@@ -215,6 +215,13 @@ class BakaiCLI:
                 for doc_type, count in db_stats['document_types'].items():
                     print(f"   - {doc_type}: {count}")
         
+        # Задержки генерации по моделям
+        if status.get('routing_stats'):
+            print(f"\n🧭 МАРШРУТЫ МОДЕЛЕЙ:")
+            for route, stats in status['routing_stats'].items():
+                print(f"   {route}: {stats['requests']} запросов, "
+                      f"среднее {stats['avg_time']:.2f} с, максимум {stats['max_time']:.2f} с")
+        
         # Статистика сессии
         session = status['session_stats']
         print(f"\n📈 СТАТИСТИКА СЕССИИ:")
@@ -313,7 +320,7 @@ class BakaiCLI:
         print(f"\n👋 {goodbye_msg}")
         
         if self.assistant.tts_enabled and self.assistant.tts.is_initialized:
-            self.assistant.tts.speak(goodbye_msg, voice="baya")
+            self.assistant.tts_queue.speak(goodbye_msg, voice="baya")
             time.sleep(2)  # Даем время для воспроизведения
         
         self.running = False
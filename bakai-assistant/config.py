@@ -4,6 +4,12 @@
 Конфигурация голосового помощника банка Бакай
 """
 
+import os
+
+# Каталог файлов, создаваемых при работе (кэши, журналы, готовые ответы): рядом с пакетом,
+# а не в текущем каталоге; переопределяется переменной окружения BAKAI_DATA_DIR
+DATA_DIR = os.environ.get("BAKAI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
 # =============================================================================
 # ОСНОВНЫЕ НАСТРОЙКИ БАНКА
 # =============================================================================
@@ -39,6 +45,7 @@ BANK_LINKS = {
 # =============================================================================
 
 RAG_CONFIG = {
+    "ollama_base_url": "http://localhost:11434",
     "chroma_db_path": "/Users/zarinamacbook/rag_system/chroma_db",
     "embedding_model": "llama3",
     "llm_model": "llama3",
@@ -46,7 +53,138 @@ RAG_CONFIG = {
     "temperature": 0.1,
     "max_tokens": 600,
     "top_p": 0.9,
-    "repeat_penalty": 1.1
+    "repeat_penalty": 1.1,
+    
+    # Семантический уровень FAQ (эмбеддинги вопросов)
+    "faq_semantic_enabled": True,
+    "faq_semantic_threshold": 0.92,   # Минимальный косинус для прямого ответа
+    "faq_semantic_margin": 0.02,      # Отрыв лучшего вопроса от второго
+    "faq_semantic_calibration_quantile": 0.9,  # Квантиль сходства между разными FAQ
+    "faq_embeddings_cache_path": os.path.join(DATA_DIR, "faq_question_embeddings.npz"),  # None - без кэша
+    
+    # Разделы FAQ по типам услуг: нечеткое сравнение только внутри раздела запроса
+    "faq_partitions_enabled": True,
+    "faq_partition_min_confidence": 0.6,  # Доля баллов лучшей услуги; ниже - сравнение со всеми FAQ
+    "faq_partition_rules": {              # Фрагменты url / parent_id, по которым FAQ относится к разделу
+        'cards': ['/cards', 'card', 'sticker', 'google_pay', 'nfc', 'tumar', 'salary', 'visa', 'elkart', 'cashback'],
+        'credits': ['/loans', 'credit', 'mortgage', 'grace_period', 'overdue'],
+        'deposits': ['/deposits', 'deposit'],
+        'business': ['/business/', 'business', 'acquiring'],
+        'insurance': ['insurance', 'strahov'],
+        'transfers': ['/transfers', 'transfer', 'swift'],
+        'exchange': ['exchange', 'currency', 'valyut']
+    },
+    
+    # Сжатие контекста перед генерацией
+    "context_compression_enabled": True,
+    "context_token_budget": 700,      # Максимум токенов контекста в промпте
+    "chars_per_token": 3.0,           # Оценка длины токена для русского текста
+    
+    # Бюджет промпта и кэширование модели в Ollama
+    "prompt_token_budget": 1500,      # Весь промпт: правила + контекст + вопрос
+    "question_token_budget": 100,     # Максимум токенов на вопрос пользователя
+    "num_ctx": 2048,                  # Окно контекста модели
+    "keep_alive": "30m",              # Сколько Ollama держит модель в памяти
+    
+    # Планировщик ответа: прямой / извлекающий / генерация
+    "answer_planner_enabled": True,
+    "direct_answer_threshold": 0.85,      # Сходство лучшего FAQ для прямого ответа
+    "extractive_answer_threshold": 0.75,  # Сходство FAQ для сборки извлекающего ответа
+    "keyword_dominance_coverage": 0.8,    # Доля ключевых слов запроса в лучшем документе
+    "keyword_dominance_ratio": 2.0,       # Отрыв лучшего документа от второго по ключевым словам
+    "extractive_max_answers": 2,          # Сколько FAQ-ответов объединять
+    
+    # Профили генерации по типу запроса (см. BakaiRAG._analyze_query_type)
+    "generation_profiles": {
+        "инструкция": {"num_predict": 320, "temperature": 0.1, "stop": []},
+        "адрес":      {"num_predict": 120, "temperature": 0.0, "stop": ["\n\n"]},
+        "документы":  {"num_predict": 220, "temperature": 0.1, "stop": []},
+        "лимиты":     {"num_predict": 150, "temperature": 0.0, "stop": ["\n\n"]},
+        "объяснение": {"num_predict": 350, "temperature": 0.2, "stop": []},
+        "общий":      {"num_predict": 250, "temperature": 0.1, "stop": []}
+    },
+    "early_stop_enabled": True,       # Остановка, когда ответ покрыл факты лучшего документа
+    "early_stop_max_facts": 6,        # Больше фактов - остановка только по num_predict
+    "early_stop_min_fact_digits": 2,  # Числа короче не считаются фактами ("3" есть в "30" и телефонах)
+    
+    # Маршрутизация между малой и основной моделью
+    "small_llm_model": "llama3.2:3b",
+    "model_routing": "auto",          # auto / small / large
+    "small_model_retry_after": 300,   # Секунд без малой модели после ее сбоя (ответ - основной моделью)
+    "routing_small_query_types": ["адрес", "лимиты", "документы", "общий"],
+    "routing_small_max_query_words": 12,
+    "routing_small_max_documents": 1,     # Документов с оценкой, сопоставимой с лучшей
+    "routing_relevant_score_ratio": 0.9,  # Сопоставимая оценка: не ниже этой доли от лучшей
+    "routing_small_max_context_tokens": 350,
+    "routing_small_min_confidence": 0.5,  # Уверенность лучшего результата поиска
+    
+    # Параллельный поиск: после промаха точного FAQ уровни запускаются одновременно
+    "parallel_retrieval": True,
+    "retrieval_workers": 8,               # Потоков пула поиска (общий для всех запросов)
+    
+    # Адаптивный векторный поиск: проба по исходному запросу, варианты - только без явного лидера
+    "adaptive_vector_search": True,
+    "adaptive_probe_k": 3,                # Кандидатов в пробе
+    "adaptive_gap_ratio": 0.25,           # Относительный отрыв лидера от второго результата
+    "adaptive_max_distance": None,        # Максимальное расстояние лидера (None - без ограничения)
+    
+    # Планировщик поиска по статистике попаданий уровней
+    "retrieval_planner_enabled": True,
+    "planner_min_samples": 20,            # Запусков в корзине до первых решений
+    "planner_explore_every": 25,          # Каждый N-й запрос - полный план для обновления статистики
+    "planner_skip_hit_rate": 0.05,        # Уровень с меньшей долей попаданий пропускается
+    "planner_min_gain_per_second": 0.2,   # Уровень с меньшим числом попаданий на секунду работы пропускается
+    "planner_latency_weight": 4.0,        # Секунд работы за секунду задержки (выбор staged / fan_out)
+    "planner_variant_gain_rate": 0.15,    # Ниже - векторный поиск только по исходному запросу
+    "planner_long_query_words": 8,        # Граница "длинного" запроса в словах
+    "planner_max_variants": 8,            # Вариантов запроса в полном плане
+    
+    "query_analysis_cache_size": 512      # Разборов запросов в кэше
+}
+
+# =============================================================================
+# НАСТРОЙКИ ПЛАНИРОВЩИКА ОБРАЩЕНИЙ К OLLAMA
+# =============================================================================
+
+SCHEDULER_CONFIG = {
+    "enabled": True,
+    "embedding_batch_window_ms": 5,    # Окно сбора эмбеддингов запросов в пакет
+    "embedding_max_batch": 32,         # Максимум текстов в пакете
+    "embedding_batch_api": False,      # /api/embed одним вызовом (нормированные векторы!)
+    "embedding_timeout": 30.0,
+    "embedding_concurrency": 8,        # Параллельных embed_query без пакетного API
+    "generation_slots": 1,             # Одновременных генераций = OLLAMA_NUM_PARALLEL
+    "generation_queue_timeout": 30.0,  # Секунд ожидания слота, дальше - ошибка генерации
+    "default_priority": 1,             # Меньше - раньше (0 - интерактивные, 2 - фоновые)
+    "single_flight": True              # Одинаковые запросы в работе вычисляются один раз
+}
+
+# =============================================================================
+# НАСТРОЙКИ СРОКОВ ОБРАБОТКИ ЗАПРОСА
+# =============================================================================
+
+DEADLINE_CONFIG = {
+    "enabled": True,
+    "total": 10.0,        # Секунд на весь запрос (SLA голосового меню)
+    "stage_budgets": {    # Секунд на этап; при превышении этап деградирует
+        "retrieval": 2.0,     # Остаток вариантов векторного поиска пропускается
+        "generation": 6.0,    # Генерация прерывается, ответ собирается из FAQ
+        "tts": 3.0            # Ответ возвращается без аудио
+    }
+}
+
+# =============================================================================
+# НАСТРОЙКИ HTTP-СЕРВЕРА
+# =============================================================================
+
+SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "workers": 4,             # Потоков обработки запросов (состояние запроса - в BakaiRequestContext)
+    "max_concurrent": 4,      # Запросов в работе и в очереди, дальше - 503
+    "request_timeout": 30.0,  # Секунд на запрос, дальше - 504
+    "response_margin": 1.0,   # Секунд до таймаута, за которые обработка должна вернуть упрощенный ответ
+    "play_audio": False       # Воспроизводить озвучку на сервере
 }
 
 # =============================================================================
@@ -58,7 +196,23 @@ TTS_CONFIG = {
     "sample_rate": 48000,
     "default_voice": "baya",
     "language": "ru",
-    "model_name": "v3_1_ru"
+    "model_name": "v3_1_ru",
+    
+    # Потоки и процессы синтеза
+    "torch_threads": None,               # Потоков torch в основном процессе (None - по умолчанию)
+    "synthesis_workers": 0,              # Процессов синтеза (0 - синтез в основном процессе)
+    "synthesis_threads_per_worker": 1,   # Потоков torch на процесс синтеза
+    "synthesis_min_chunk_chars": 40,     # Короткие предложения склеиваются до этой длины
+    "batch_max_items": 8,                # Текстов в одном пакете синтеза (jit-модели Silero)
+    "batch_max_chars": 1000,             # Суммарная длина текстов в пакете
+    
+    # Фоновая очередь озвучивания
+    "background": True,       # Текстовый ответ не ждет синтеза речи
+    "queue_workers": 1,       # Потоков очереди (при synthesis_workers > 0 можно увеличить)
+    "queue_max_jobs": 256,    # Сколько последних заданий хранить для запросов статуса
+    
+    # Повторный текст тем же голосом не синтезируется заново, пока файл на месте
+    "audio_cache_size": 256   # 0 - без кэша аудио
 }
 
 # =============================================================================
@@ -70,7 +224,39 @@ CONTENT_CONFIG = {
     "min_answer_length": 10,  # Минимальная длина ответа
     "enable_politeness": True,  # Включить систему вежливости
     "enable_filtering": True,   # Включить фильтрацию
-    "enable_offers": True       # Включить предложения услуг
+    "enable_offers": True,      # Включить предложения услуг
+    
+    # Выбор вежливых фраз и предложений: 'deterministic' - по хэшу (запрос, ответ),
+    # одинаковый вопрос дает побайтно одинаковый ответ; 'random' - случайно
+    "phrase_selection": "deterministic",
+    "phrase_rotation": None,    # None - без смены; 'daily' / 'hourly' - фразы меняются по периодам
+    "enhanced_cache_size": 1024  # Готовых ответов на точные совпадения FAQ в кэше (0 - без кэша)
+}
+
+# =============================================================================
+# НАСТРОЙКИ ГОТОВЫХ ОТВЕТОВ И ЖУРНАЛА ЗАПРОСОВ
+# =============================================================================
+
+MATERIALIZE_CONFIG = {
+    "enabled": True,                        # Отвечать готовыми ответами из хранилища
+    "store_path": os.path.join(DATA_DIR, "materialized_answers.sqlite3"),
+    "max_age": None,                        # Секунд жизни готового ответа (None - до пересборки)
+    "query_log_path": os.path.join(DATA_DIR, "query_log.jsonl"),  # Журнал запросов (JSONL, поле "query")
+    "log_queries": True,                    # Записывать запросы пользователей в журнал
+    "top_clusters": 200,                    # Частых групп запросов журнала для материализации
+    "min_cluster_count": 2,                 # Более редкие группы не материализуются
+    "with_audio": True,                     # Синтезировать и сохранять озвучку ответов
+    "deadline": 60.0                        # Секунд на запрос при офлайн-сборке
+}
+
+# Прогрев кэшей при запуске сервера: частые запросы журнала до отметки о готовности.
+# Прогреваются только слои с состоянием - разбор запроса, ответ FAQ и его озвучка (без LLM)
+WARMUP_CONFIG = {
+    "enabled": True,
+    "top_queries": 50,     # Самых частых групп запросов журнала
+    "concurrency": 2,      # Одновременных запросов прогрева
+    "budget": 120.0,       # Секунд на прогрев; по истечении сервер готов без остатка
+    "with_audio": True     # Озвучка ответов FAQ в кэш TTS (ожидается до готовности)
 }
 
 # =============================================================================
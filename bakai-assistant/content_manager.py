@@ -4,20 +4,37 @@
 Система управления контентом: вежливость, фильтрация, предложения услуг
 """
 
-import re
+import time
 import random
-from typing import Dict, List, Optional, Set
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 from config import CONTENT_CONFIG
+from request_context import BakaiRequestContext
+from pattern_engine import BakaiPatternEngine, PatternMatch, get_pattern_engine
 
 class BakaiContentManager:
     """Система управления контентом: вежливость, фильтрация, предложения услуг"""
     
-    def __init__(self):
+    def __init__(self, pattern_engine: BakaiPatternEngine = None):
         self.forbidden_words = self._init_forbidden_words()
         self.polite_phrases = self._init_polite_phrases()
         self.service_patterns = self._init_service_patterns()
         self.service_offers = self._init_service_offers()
         self.replacements = self._init_replacements()
+        
+        # Готовые ответы на точные совпадения FAQ: (ключ выбора фраз, услуга) -> текст
+        self._enhanced_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        
+        # Запрещенные слова и паттерны услуг ищутся общим автоматом за один проход
+        self.patterns = pattern_engine or get_pattern_engine()
+        self.patterns.add_lexicon('forbidden', {'forbidden': self.forbidden_words}, whole_word=True)
+        # Длинные фразы получают больше баллов
+        self.patterns.add_lexicon('services', self.service_patterns,
+                                  weight=lambda pattern, _: len(pattern.split()) * 2 + 1)
     
     def _init_forbidden_words(self) -> Set[str]:
         """Инициализация списка запрещенных слов"""
@@ -203,19 +220,52 @@ class BakaiContentManager:
         if not CONTENT_CONFIG.get("enable_filtering", True):
             return text
         
-        text_lower = text.lower()
+        matches = self._select_replacements(self.patterns.find(text, ['forbidden']))
+        if not matches:
+            return text
         
-        for forbidden in self.forbidden_words:
-            if forbidden in text_lower:
-                replacement = self.replacements.get(forbidden, 'информация')
-                # Заменяем с учетом регистра
-                text = re.sub(re.escape(forbidden), replacement, text, flags=re.IGNORECASE)
-                print(f"🚫 Заменено: '{forbidden}' → '{replacement}'")
+        parts = []
+        position = 0
+        for match in matches:
+            replacement = self.replacements.get(match.pattern, 'информация')
+            parts.append(text[position:match.start])
+            parts.append(replacement)
+            position = match.end
+        parts.append(text[position:])
         
-        return text
+        for forbidden in dict.fromkeys(match.pattern for match in matches):
+            print(f"🚫 Заменено: '{forbidden}' → '{self.replacements.get(forbidden, 'информация')}'")
+        return ''.join(parts)
+    
+    def _select_replacements(self, matches: List[PatternMatch]) -> List[PatternMatch]:
+        """Непересекающиеся вхождения для замены: левое, при равном начале - самое длинное"""
+        selected = []
+        last_end = 0
+        for match in sorted(matches, key=lambda m: (m.start, m.start - m.end)):
+            if match.start >= last_end:
+                selected.append(match)
+                last_end = match.end
+        return selected
     
-    def add_politeness(self, text: str) -> str:
-        """Добавление вежливых фраз"""
+    def _choose(self, options: List[str], slot: str, key: Optional[str]) -> str:
+        """Выбор фразы: детерминированно по хэшу ключа (запрос, ответ) или случайно
+        
+        slot различает места выбора (приветствие, окончание, предложение), чтобы
+        они не были связаны одним индексом; ротация добавляет к ключу период
+        """
+        if key is None or CONTENT_CONFIG.get("phrase_selection", "deterministic") == "random":
+            return random.choice(options)
+        
+        digest = hashlib.sha1(f"{slot}|{self._rotation_period()}|{key}".encode('utf-8')).digest()
+        return options[int.from_bytes(digest[:8], 'big') % len(options)]
+    
+    def _rotation_period(self) -> int:
+        """Номер текущего периода ротации фраз (0 - без ротации)"""
+        period = {'hourly': 3600, 'daily': 86400}.get(CONTENT_CONFIG.get("phrase_rotation"))
+        return int(time.time() // period) if period else 0
+    
+    def add_politeness(self, text: str, key: Optional[str] = None) -> str:
+        """Добавление вежливых фраз (key - ключ детерминированного выбора, по умолчанию текст)"""
         if not CONTENT_CONFIG.get("enable_politeness", True):
             return text
         
@@ -230,65 +280,109 @@ class BakaiContentManager:
         
         # Добавляем приветствие
         if not has_greeting:
-            greeting = random.choice(self.polite_phrases['greetings'])
+            greeting = self._choose(self.polite_phrases['greetings'], 'greeting', key or text)
             text = greeting + text
         
         # Добавляем окончание
         if not has_ending:
             if not text.endswith(('.', '!', '?')):
                 text += '.'
-            ending = random.choice(self.polite_phrases['endings'])
+            ending = self._choose(self.polite_phrases['endings'], 'ending', key or text)
             text += ending
         
         return text
     
     def detect_service_type(self, query: str) -> Optional[str]:
         """Определение типа банковской услуги по запросу"""
-        query_lower = query.lower()
+        return self.classify_service(query)[0]
+    
+    def classify_service(self, query: str) -> Tuple[Optional[str], float]:
+        """Тип услуги и уверенность в нем (доля баллов лучшей услуги среди всех найденных)"""
         service_scores = {}
         
-        for service_type, patterns in self.service_patterns.items():
-            score = 0
-            for pattern in patterns:
-                if pattern in query_lower:
-                    # Длинные фразы получают больше баллов
-                    score += len(pattern.split()) * 2 + 1
-            
-            if score > 0:
-                service_scores[service_type] = score
+        # Каждый паттерн учитывается один раз, сколько бы раз он ни встретился
+        matched = {(match.category, match.pattern): match.weight
+                   for match in self.patterns.find(query, ['services'])}
+        for (service_type, _), weight in matched.items():
+            service_scores[service_type] = service_scores.get(service_type, 0) + weight
+        # При равных баллах побеждает услуга, объявленная раньше
+        service_scores = {service_type: service_scores[service_type]
+                          for service_type in self.service_patterns if service_type in service_scores}
         
         if service_scores:
             best_service = max(service_scores, key=service_scores.get)
-            print(f"🎯 Определен тип услуги: {best_service} (балл: {service_scores[best_service]})")
-            return best_service
+            confidence = service_scores[best_service] / sum(service_scores.values())
+            print(f"🎯 Определен тип услуги: {best_service} (балл: {service_scores[best_service]}, "
+                  f"уверенность: {confidence:.2f})")
+            return best_service, confidence
         
-        return None
+        return None, 0.0
     
-    def get_service_offer(self, service_type: str) -> Optional[str]:
-        """Получение предложения услуги"""
+    def get_service_offer(self, service_type: str, key: Optional[str] = None) -> Optional[str]:
+        """Получение предложения услуги (key - ключ детерминированного выбора)"""
         offers = self.service_offers.get(service_type, [])
-        return random.choice(offers) if offers else None
+        return self._choose(offers, f"offer:{service_type}", key) if offers else None
     
-    def enhance_response(self, text: str, query: str) -> str:
-        """Полное улучшение ответа: фильтрация + вежливость + предложения"""
+    def enhance_response(self, text: str, query: str, ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Полное улучшение ответа: фильтрация + вежливость + предложения
+        
+        Если запрос уже разобран (тип услуги в контексте), повторно он не вычисляется.
+        Фразы выбираются по ключу (нормализованный запрос, исходный ответ), поэтому
+        одинаковый вопрос дает одинаковый ответ; ответы на точные совпадения FAQ кэшируются
+        """
+        normalized = ctx.analysis.normalized if ctx is not None and ctx.analysis is not None \
+            else ' '.join(query.lower().split())
+        key = f"{normalized}\n{text}"
+        
+        service_type = None
+        if CONTENT_CONFIG.get("enable_offers", True):
+            if ctx is not None and (ctx.service_type or ctx.analysis is not None):
+                service_type = ctx.service_type
+            else:
+                service_type = self.detect_service_type(query)
+        
+        cache_key = None
+        if ctx is not None and ctx.search_type == 'exact_match' and self._enhanced_cache_enabled():
+            cache_key = (key, service_type, self._rotation_period())
+            with self._cache_lock:
+                cached = self._enhanced_cache.get(cache_key)
+                if cached is not None:
+                    self._enhanced_cache.move_to_end(cache_key)
+                    self._cache_hits += 1
+                    print("♻️ Готовый ответ на FAQ из кэша")
+                    return cached
+        
         # 1. Фильтруем запрещенный контент
         text = self.filter_content(text)
         
         # 2. Добавляем вежливость
-        text = self.add_politeness(text)
+        text = self.add_politeness(text, key)
         
-        # 3. Определяем тип услуги и добавляем предложение
-        if CONTENT_CONFIG.get("enable_offers", True):
-            service_type = self.detect_service_type(query)
-            if service_type:
-                offer = self.get_service_offer(service_type)
-                if offer:
-                    if not text.endswith(('.', '!', '?')):
-                        text += '.'
-                    text += f"\n\n💡 {offer}"
+        # 3. Добавляем предложение по типу услуги
+        if service_type:
+            offer = self.get_service_offer(service_type, key)
+            if offer:
+                if not text.endswith(('.', '!', '?')):
+                    text += '.'
+                text += f"\n\n💡 {offer}"
         
+        if cache_key is not None:
+            with self._cache_lock:
+                self._enhanced_cache[cache_key] = text
+                while len(self._enhanced_cache) > CONTENT_CONFIG.get("enhanced_cache_size", 1024):
+                    self._enhanced_cache.popitem(last=False)
         return text
     
+    def _enhanced_cache_enabled(self) -> bool:
+        """Кэш готовых ответов имеет смысл только при детерминированном выборе фраз"""
+        return (CONTENT_CONFIG.get("phrase_selection", "deterministic") == "deterministic"
+                and CONTENT_CONFIG.get("enhanced_cache_size", 1024) > 0)
+    
+    def get_enhanced_cache_stats(self) -> Dict[str, int]:
+        """Размер и попадания кэша готовых ответов"""
+        with self._cache_lock:
+            return {'cached': len(self._enhanced_cache), 'hits': self._cache_hits}
+    
     def validate_response_length(self, text: str) -> bool:
         """Проверка длины ответа"""
         min_length = CONTENT_CONFIG.get("min_answer_length", 10)
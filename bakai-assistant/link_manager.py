@@ -4,16 +4,27 @@
 Система управления ссылками на страницы банка
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
 from langchain.docstore.document import Document
 from config import BANK_LINKS
+from pattern_engine import BakaiPatternEngine, get_pattern_engine
 
 class BakaiLinkManager:
     """Управление ссылками на страницы банка"""
     
-    def __init__(self):
+    def __init__(self, pattern_engine: BakaiPatternEngine = None):
         self.link_patterns = self._init_link_patterns()
         self.category_priorities = self._init_category_priorities()
+        self.url_keywords = self._init_url_keywords()
+        
+        # Таблица весов (категория, паттерн) -> вес считается один раз
+        self.pattern_weights = self._init_pattern_weights()
+        # URL документа -> сегменты URL, по которым он может подходить запросу
+        self.url_segments: Dict[str, FrozenSet[str]] = {}
+        
+        # Паттерны категорий ищутся общим с контент-менеджером автоматом
+        self.patterns = pattern_engine or get_pattern_engine()
+        self.patterns.add_lexicon('links', self.link_patterns, weight=self._get_pattern_weight)
     
     def _init_link_patterns(self) -> Dict[str, List[str]]:
         """Инициализация паттернов для определения нужных ссылок"""
@@ -103,8 +114,21 @@ class BakaiLinkManager:
             "services": 50
         }
     
-    def _get_pattern_weight(self, pattern: str, category: str) -> float:
-        """Определение веса паттерна в зависимости от его важности"""
+    def _init_url_keywords(self) -> Dict[str, List[str]]:
+        """Соответствия сегментов URL и ключевых слов запроса"""
+        return {
+            'card': ['карт', 'visa', 'mastercard', 'элкарт'],
+            'credit': ['кредит', 'займ', 'ипотек'],
+            'deposit': ['депозит', 'вклад', 'накопитель'],
+            'business': ['бизнес', 'корпоратив', 'предпринимател'],
+            'office': ['офис', 'филиал', 'адрес'],
+            'insurance': ['страхов', 'полис'],
+            'transfer': ['перевод', 'платеж'],
+            'exchange': ['валют', 'курс', 'обмен']
+        }
+    
+    def _init_pattern_weights(self) -> Dict[tuple, float]:
+        """Веса паттернов в зависимости от их важности"""
         # Основные термины для каждой категории (получают максимальный вес)
         primary_terms = {
             "cards": ["карта", "карту", "карты", "банковская карта", "платежная карта", 
@@ -120,19 +144,48 @@ class BakaiLinkManager:
             "services": ["услуга", "услуги", "сервис"]
         }
         
-        # Если это основной термин - высокий вес
-        if pattern in primary_terms.get(category, []):
-            return 10.0
-        
-        # Если это составная фраза - средний вес
-        if len(pattern.split()) > 1:
-            return 3.0
-        
-        # Остальные термины - базовый вес
-        return 1.0
+        weights = {}
+        for category, patterns in self.link_patterns.items():
+            for pattern in patterns:
+                if pattern in primary_terms.get(category, []):
+                    # Если это основной термин - высокий вес
+                    weights[(category, pattern)] = 10.0
+                elif len(pattern.split()) > 1:
+                    # Если это составная фраза - средний вес
+                    weights[(category, pattern)] = 3.0
+                else:
+                    # Остальные термины - базовый вес
+                    weights[(category, pattern)] = 1.0
+        return weights
+    
+    def _get_pattern_weight(self, pattern: str, category: str) -> float:
+        """Вес паттерна из заранее построенной таблицы"""
+        return self.pattern_weights.get((category, pattern), 1.0)
+    
+    def index_urls(self, urls: Iterable[str]) -> None:
+        """Предварительная привязка URL документов базы к сегментам (по метаданным корпуса)"""
+        for url in urls:
+            self._segments_for_url(url)
+        print(f"🔗 Проиндексировано URL документов: {len(self.url_segments)}")
     
-    def get_relevant_link(self, query: str, documents: List[Document] = None) -> str:
-        """Получение наиболее подходящей ссылки"""
+    def _segments_for_url(self, url: str) -> FrozenSet[str]:
+        segments = self.url_segments.get(url)
+        if segments is None:
+            url_lower = url.lower()
+            segments = frozenset(segment for segment in self.url_keywords if segment in url_lower)
+            self.url_segments[url] = segments
+        return segments
+    
+    def _query_segments(self, query_lower: str) -> Set[str]:
+        """Сегменты URL, ключевые слова которых есть в запросе"""
+        return {
+            segment for segment, keywords in self.url_keywords.items()
+            if any(keyword in query_lower for keyword in keywords)
+        }
+    
+    def get_relevant_link(self, query: str, documents: List[Document] = None,
+                          category: Optional[str] = None) -> str:
+        """Получение наиболее подходящей ссылки (category - уже определенная при разборе запроса)"""
         query_lower = query.lower()
         
         # 1. Проверяем документы на наличие специфичных ссылок
@@ -142,7 +195,8 @@ class BakaiLinkManager:
                 return specific_link
         
         # 2. Определяем категорию по ключевым словам
-        category = self._determine_category(query_lower)
+        if category is None:
+            category = self._determine_category(query_lower)
         
         # 3. Возвращаем соответствующую ссылку
         link = BANK_LINKS.get(category, BANK_LINKS["general"])
@@ -152,13 +206,16 @@ class BakaiLinkManager:
     
     def _extract_link_from_documents(self, documents: List[Document], query_lower: str) -> Optional[str]:
         """Извлечение специфичной ссылки из документов"""
+        query_segments = None
         for doc in documents:
             if hasattr(doc, 'metadata') and doc.metadata:
                 doc_url = doc.metadata.get('url', '')
                 
                 if doc_url and doc_url.startswith('http'):
-                    # Проверяем релевантность URL к запросу
-                    if self._is_url_relevant(doc_url, query_lower):
+                    # Проверяем релевантность URL к запросу: сегменты запроса считаются один раз
+                    if query_segments is None:
+                        query_segments = self._query_segments(query_lower)
+                    if self._segments_for_url(doc_url) & query_segments:
                         print(f"🎯 Найдена специфичная ссылка в документах: {doc_url}")
                         return doc_url
         
@@ -166,57 +223,38 @@ class BakaiLinkManager:
     
     def _is_url_relevant(self, url: str, query_lower: str) -> bool:
         """Проверка релевантности URL к запросу"""
-        url_lower = url.lower()
+        return bool(self._segments_for_url(url) & self._query_segments(query_lower))
+    
+    def _score_categories(self, query_lower: str) -> Dict[str, Dict[str, any]]:
+        """Баллы категорий по вхождениям паттернов (каждый паттерн учитывается один раз)"""
+        category_scores = {}
+        seen = set()
         
-        # Словарь соответствий URL и ключевых слов
-        url_keywords = {
-            'card': ['карт', 'visa', 'mastercard', 'элкарт'],
-            'credit': ['кредит', 'займ', 'ипотек'],
-            'deposit': ['депозит', 'вклад', 'накопитель'],
-            'business': ['бизнес', 'корпоратив', 'предпринимател'],
-            'office': ['офис', 'филиал', 'адрес'],
-            'insurance': ['страхов', 'полис'],
-            'transfer': ['перевод', 'платеж'],
-            'exchange': ['валют', 'курс', 'обмен']
-        }
+        for match in self.patterns.find(query_lower, ['links']):
+            if (match.category, match.pattern) in seen:
+                continue
+            seen.add((match.category, match.pattern))
+            
+            # Точное совпадение получает дополнительные баллы
+            exact_bonus = 5 if match.pattern == query_lower.strip() else 0
+            pattern_score = match.weight + exact_bonus
+            
+            scores = category_scores.setdefault(match.category, {'raw_score': 0, 'patterns': []})
+            scores['raw_score'] += pattern_score
+            scores['patterns'].append((match.pattern, pattern_score))
         
-        for url_pattern, keywords in url_keywords.items():
-            if url_pattern in url_lower:
-                if any(keyword in query_lower for keyword in keywords):
-                    return True
+        # Применяем приоритет категории
+        for category, scores in category_scores.items():
+            scores['priority'] = self.category_priorities.get(category, 50)
+            scores['score'] = scores['raw_score'] * (scores['priority'] / 100)
         
-        return False
+        # Порядок категорий - как в словаре паттернов (при равных баллах побеждает первая)
+        return {category: category_scores[category]
+                for category in self.link_patterns if category in category_scores}
     
     def _determine_category(self, query_lower: str) -> str:
         """Определение категории по ключевым словам запроса"""
-        category_scores = {}
-        
-        # Подсчитываем совпадения для каждой категории
-        for category, patterns in self.link_patterns.items():
-            score = 0
-            matched_patterns = []
-            
-            for pattern in patterns:
-                if pattern in query_lower:
-                    # Используем вес паттерна вместо длины фразы
-                    pattern_weight = self._get_pattern_weight(pattern, category)
-                    
-                    # Точное совпадение получает дополнительные баллы
-                    exact_bonus = 5 if pattern == query_lower.strip() else 0
-                    
-                    pattern_score = pattern_weight + exact_bonus
-                    score += pattern_score
-                    matched_patterns.append((pattern, pattern_score))
-            
-            if score > 0:
-                # Применяем приоритет категории
-                priority = self.category_priorities.get(category, 50)
-                category_scores[category] = {
-                    'score': score * (priority / 100),
-                    'raw_score': score,
-                    'priority': priority,
-                    'patterns': matched_patterns
-                }
+        category_scores = self._score_categories(query_lower)
         
         # Возвращаем категорию с максимальным баллом
         if category_scores:
@@ -290,34 +328,16 @@ class BakaiLinkManager:
     
     def analyze_query_categories(self, query: str) -> Dict[str, float]:
         """Анализ запроса по всем категориям с баллами"""
-        query_lower = query.lower()
-        analysis = {}
-        
-        for category, patterns in self.link_patterns.items():
-            score = 0
-            matched_patterns = []
-            
-            for pattern in patterns:
-                if pattern in query_lower:
-                    pattern_weight = self._get_pattern_weight(pattern, category)
-                    exact_bonus = 5 if pattern == query_lower.strip() else 0
-                    pattern_score = pattern_weight + exact_bonus
-                    score += pattern_score
-                    matched_patterns.append(pattern)
-            
-            if score > 0:
-                priority = self.category_priorities.get(category, 50)
-                final_score = score * (priority / 100)
-                
-                analysis[category] = {
-                    "score": final_score,
-                    "raw_score": score,
-                    "priority": priority,
-                    "matched_patterns": matched_patterns,
-                    "link": BANK_LINKS.get(category, BANK_LINKS["general"])
-                }
-        
-        return analysis
+        return {
+            category: {
+                "score": scores['score'],
+                "raw_score": scores['raw_score'],
+                "priority": scores['priority'],
+                "matched_patterns": [pattern for pattern, _ in scores['patterns']],
+                "link": BANK_LINKS.get(category, BANK_LINKS["general"])
+            }
+            for category, scores in self._score_categories(query.lower()).items()
+        }
     
     def get_all_categories(self) -> List[str]:
         """Получение списка всех доступных категорий"""
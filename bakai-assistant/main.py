@@ -12,6 +12,10 @@ main.py
     python main.py --voice-demo    - демо голосов
     python main.py --info          - информация о системе
     python main.py --validate      - проверка системы
+    python main.py --serve         - локальный HTTP-сервер
+    python main.py --benchmark-tts - замер скорости синтеза речи
+    python main.py --benchmark-retrieval - замер ранней остановки векторного поиска
+    python main.py --materialize   - сборка готовых ответов для FAQ и частых запросов
 """
 
 import sys
@@ -329,6 +333,78 @@ def run_validation():
         if "--debug" in sys.argv:
             traceback.print_exc()
 
+def run_serve_mode(host: Optional[str] = None, port: Optional[int] = None,
+                   workers: Optional[int] = None, warmup: Optional[bool] = None,
+                   warmup_queries: Optional[int] = None, warmup_budget: Optional[float] = None):
+    """Запуск локального HTTP-сервера"""
+    print("🌐 РЕЖИМ СЕРВЕРА")
+    print("=" * 40)
+    
+    try:
+        from assistant import BakaiAssistant
+        from server import BakaiServer
+        
+        assistant = BakaiAssistant()
+        server = BakaiServer(assistant, host=host, port=port, workers=workers, warmup=warmup,
+                             warmup_queries=warmup_queries, warmup_budget=warmup_budget)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Сервер остановлен")
+    except Exception as e:
+        print(f"\n❌ Ошибка сервера: {e}")
+        if "--debug" in sys.argv:
+            traceback.print_exc()
+
+def run_tts_benchmark_mode(workers: str, threads: str, concurrency: int):
+    """Замер RTF синтеза речи для разных чисел процессов и потоков"""
+    print("⏱️ БЕНЧМАРК СИНТЕЗА РЕЧИ")
+    print("=" * 40)
+    
+    try:
+        from benchmarks import run_tts_benchmark, run_tts_batch_benchmark
+        
+        worker_counts = [int(value) for value in workers.split(',') if value.strip()]
+        thread_counts = [int(value) for value in threads.split(',') if value.strip()]
+        run_tts_benchmark(worker_counts, thread_counts, concurrency=concurrency)
+        
+        print()
+        run_tts_batch_benchmark()
+    except Exception as e:
+        print(f"\n❌ Ошибка бенчмарка: {e}")
+        if "--debug" in sys.argv:
+            traceback.print_exc()
+
+def run_retrieval_benchmark_mode(gap_ratios: str):
+    """Замер ранней остановки векторного поиска для разных порогов отрыва"""
+    print("⏱️ БЕНЧМАРК ВЕКТОРНОГО ПОИСКА")
+    print("=" * 40)
+    
+    try:
+        from benchmarks import run_retrieval_benchmark
+        
+        run_retrieval_benchmark([float(value) for value in gap_ratios.split(',') if value.strip()])
+    except Exception as e:
+        print(f"\n❌ Ошибка бенчмарка: {e}")
+        if "--debug" in sys.argv:
+            traceback.print_exc()
+
+def run_materialize_mode(query_log: Optional[str], top_queries: Optional[int], with_audio: bool):
+    """Офлайн-сборка готовых ответов для FAQ и частых запросов журнала"""
+    print("🏗️ МАТЕРИАЛИЗАЦИЯ ОТВЕТОВ")
+    print("=" * 40)
+    
+    try:
+        from assistant import BakaiAssistant
+        from materializer import BakaiMaterializer
+        
+        assistant = BakaiAssistant()
+        materializer = BakaiMaterializer(assistant, assistant.answer_store)
+        materializer.run(query_log=query_log, top_n=top_queries, with_audio=with_audio)
+    except Exception as e:
+        print(f"\n❌ Ошибка материализации: {e}")
+        if "--debug" in sys.argv:
+            traceback.print_exc()
+
 def main():
     """Главная функция"""
     parser = argparse.ArgumentParser(
@@ -341,6 +417,11 @@ def main():
   python main.py --voice-demo    # Демонстрация голосов
   python main.py --info          # Информация о системе
   python main.py --validate      # Проверка всех компонентов
+  python main.py --serve --port 8080  # HTTP-сервер
+  python main.py --serve --warmup-queries 100 --warmup-budget 60  # Сервер с прогревом кэшей
+  python main.py --benchmark-tts --tts-workers 0,2,4 --tts-threads 1,2  # Бенчмарк TTS
+  python main.py --benchmark-retrieval --gap-ratios 0.1,0.25,0.4  # Бенчмарк поиска
+  python main.py --materialize --query-log ./data/query_log.jsonl --top-queries 200  # Готовые ответы
   python main.py --minimal       # Упрощенный режим
   python main.py --debug --test  # Тест с подробной отладкой
         """
@@ -356,6 +437,40 @@ def main():
                        help='Комплексная проверка системы')
     parser.add_argument('--minimal', action='store_true',
                        help='Упрощенный режим без зависимостей')
+    parser.add_argument('--serve', action='store_true',
+                       help='Запуск локального HTTP-сервера')
+    parser.add_argument('--host', type=str, default=None,
+                       help='Адрес HTTP-сервера')
+    parser.add_argument('--port', type=int, default=None,
+                       help='Порт HTTP-сервера')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Количество потоков обработки запросов')
+    parser.add_argument('--no-warmup', action='store_true',
+                       help='Запуск сервера без прогрева кэшей')
+    parser.add_argument('--warmup-queries', type=int, default=None,
+                       help='Сколько частых запросов журнала прогревать при запуске')
+    parser.add_argument('--warmup-budget', type=float, default=None,
+                       help='Секунд на прогрев кэшей при запуске')
+    parser.add_argument('--benchmark-tts', action='store_true',
+                       help='Замер скорости синтеза речи (RTF)')
+    parser.add_argument('--tts-workers', type=str, default='0,1,2,4',
+                       help='Числа процессов синтеза для бенчмарка, через запятую')
+    parser.add_argument('--tts-threads', type=str, default='1,2',
+                       help='Числа потоков torch для бенчмарка, через запятую')
+    parser.add_argument('--tts-concurrency', type=int, default=1,
+                       help='Одновременных запросов синтеза в бенчмарке')
+    parser.add_argument('--benchmark-retrieval', action='store_true',
+                       help='Замер ранней остановки векторного поиска')
+    parser.add_argument('--gap-ratios', type=str, default='0.1,0.25,0.4',
+                       help='Пороги отрыва лидера для бенчмарка поиска, через запятую')
+    parser.add_argument('--materialize', action='store_true',
+                       help='Сборка готовых ответов для FAQ и частых запросов')
+    parser.add_argument('--query-log', type=str, default=None,
+                       help='JSONL-журнал запросов (по умолчанию - из настроек)')
+    parser.add_argument('--top-queries', type=int, default=None,
+                       help='Сколько самых частых групп запросов журнала использовать')
+    parser.add_argument('--no-audio', action='store_true',
+                       help='Собирать готовые ответы без озвучки')
     parser.add_argument('--debug', action='store_true',
                        help='Включить подробную отладку')
     
@@ -365,6 +480,15 @@ def main():
         # Выбираем режим работы
         if args.minimal:
             run_minimal_mode()
+        elif args.serve:
+            run_serve_mode(args.host, args.port, args.workers, False if args.no_warmup else None,
+                           args.warmup_queries, args.warmup_budget)
+        elif args.benchmark_tts:
+            run_tts_benchmark_mode(args.tts_workers, args.tts_threads, args.tts_concurrency)
+        elif args.benchmark_retrieval:
+            run_retrieval_benchmark_mode(args.gap_ratios)
+        elif args.materialize:
+            run_materialize_mode(args.query_log, args.top_queries, not args.no_audio)
         elif args.test:
             run_test_mode()
         elif args.voice_demo:
@@ -645,6 +769,11 @@ def main():
   python main.py --voice-demo    # Демонстрация голосов
   python main.py --info          # Информация о системе
   python main.py --validate      # Проверка всех компонентов
+  python main.py --serve --port 8080  # HTTP-сервер
+  python main.py --serve --warmup-queries 100 --warmup-budget 60  # Сервер с прогревом кэшей
+  python main.py --benchmark-tts --tts-workers 0,2,4 --tts-threads 1,2  # Бенчмарк TTS
+  python main.py --benchmark-retrieval --gap-ratios 0.1,0.25,0.4  # Бенчмарк поиска
+  python main.py --materialize --query-log ./data/query_log.jsonl --top-queries 200  # Готовые ответы
   python main.py --debug --test  # Тест с подробной отладкой
         """
     )
@@ -657,6 +786,40 @@ def main():
                        help='Показать информацию о системе')
     parser.add_argument('--validate', action='store_true',
                        help='Комплексная проверка системы')
+    parser.add_argument('--serve', action='store_true',
+                       help='Запуск локального HTTP-сервера')
+    parser.add_argument('--host', type=str, default=None,
+                       help='Адрес HTTP-сервера')
+    parser.add_argument('--port', type=int, default=None,
+                       help='Порт HTTP-сервера')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Количество потоков обработки запросов')
+    parser.add_argument('--no-warmup', action='store_true',
+                       help='Запуск сервера без прогрева кэшей')
+    parser.add_argument('--warmup-queries', type=int, default=None,
+                       help='Сколько частых запросов журнала прогревать при запуске')
+    parser.add_argument('--warmup-budget', type=float, default=None,
+                       help='Секунд на прогрев кэшей при запуске')
+    parser.add_argument('--benchmark-tts', action='store_true',
+                       help='Замер скорости синтеза речи (RTF)')
+    parser.add_argument('--tts-workers', type=str, default='0,1,2,4',
+                       help='Числа процессов синтеза для бенчмарка, через запятую')
+    parser.add_argument('--tts-threads', type=str, default='1,2',
+                       help='Числа потоков torch для бенчмарка, через запятую')
+    parser.add_argument('--tts-concurrency', type=int, default=1,
+                       help='Одновременных запросов синтеза в бенчмарке')
+    parser.add_argument('--benchmark-retrieval', action='store_true',
+                       help='Замер ранней остановки векторного поиска')
+    parser.add_argument('--gap-ratios', type=str, default='0.1,0.25,0.4',
+                       help='Пороги отрыва лидера для бенчмарка поиска, через запятую')
+    parser.add_argument('--materialize', action='store_true',
+                       help='Сборка готовых ответов для FAQ и частых запросов')
+    parser.add_argument('--query-log', type=str, default=None,
+                       help='JSONL-журнал запросов (по умолчанию - из настроек)')
+    parser.add_argument('--top-queries', type=int, default=None,
+                       help='Сколько самых частых групп запросов журнала использовать')
+    parser.add_argument('--no-audio', action='store_true',
+                       help='Собирать готовые ответы без озвучки')
     parser.add_argument('--debug', action='store_true',
                        help='Включить подробную отладку')
     
@@ -668,7 +831,16 @@ def main():
     
     try:
         # Выбираем режим работы
-        if args.test:
+        if args.serve:
+            run_serve_mode(args.host, args.port, args.workers, False if args.no_warmup else None,
+                           args.warmup_queries, args.warmup_budget)
+        elif args.benchmark_tts:
+            run_tts_benchmark_mode(args.tts_workers, args.tts_threads, args.tts_concurrency)
+        elif args.benchmark_retrieval:
+            run_retrieval_benchmark_mode(args.gap_ratios)
+        elif args.materialize:
+            run_materialize_mode(args.query_log, args.top_queries, not args.no_audio)
+        elif args.test:
             run_test_mode()
         elif args.voice_demo:
             run_voice_demo()
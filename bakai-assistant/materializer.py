@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+materializer.py
+Готовые ответы: заранее вычисленные ответ, ссылка и озвучка для FAQ и частых запросов
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+from config import MATERIALIZE_CONFIG
+from query_log import query_cluster_key, top_query_clusters
+from request_context import BakaiStats
+
+# Поля записи в порядке столбцов таблицы
+ANSWER_FIELDS = ('key', 'query', 'answer', 'link', 'service_type', 'voice',
+                 'audio_file', 'source', 'created_at')
+
+
+class BakaiAnswerStore:
+    """Хранилище готовых ответов в SQLite: ключ группы запроса -> ответ, ссылка, озвучка
+
+    При открытии хранилище целиком читается в память - ответ на запрос
+    сводится к поиску в словаре. Пересборка заменяет файл целиком
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or MATERIALIZE_CONFIG["store_path"]
+        self._lock = threading.Lock()
+        self._answers: Dict[str, Dict[str, Any]] = {}
+        self.stats = BakaiStats(counters=['hits', 'misses'])
+
+    def load(self) -> int:
+        """Чтение хранилища в память; возвращает число ответов"""
+        if not os.path.exists(self.path):
+            return 0
+
+        try:
+            with closing(sqlite3.connect(self.path)) as connection:
+                rows = connection.execute(f"SELECT {', '.join(ANSWER_FIELDS)} FROM answers").fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Не удалось прочитать готовые ответы: {e}")
+            return 0
+
+        max_age = MATERIALIZE_CONFIG.get("max_age")
+        answers = {}
+        for row in rows:
+            entry = dict(zip(ANSWER_FIELDS, row))
+            if max_age and time.time() - entry['created_at'] > max_age:
+                continue
+            # Удаленная озвучка будет синтезирована заново при ответе
+            if entry['audio_file'] and not os.path.exists(entry['audio_file']):
+                entry['audio_file'] = None
+            answers[entry['key']] = entry
+
+        with self._lock:
+            self._answers = answers
+        print(f"📦 Загружено готовых ответов: {len(answers)}")
+        return len(answers)
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Готовый ответ для запроса (без учета регистра и пунктуации)"""
+        with self._lock:
+            entry = self._answers.get(query_cluster_key(query))
+        self.stats.increment('hits' if entry is not None else 'misses')
+        return entry
+
+    def save(self, entries: List[Dict[str, Any]]) -> None:
+        """Запись нового набора ответов: файл собирается рядом и подменяет старый"""
+        temp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        with closing(sqlite3.connect(temp_path)) as connection:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE answers (key TEXT PRIMARY KEY, query TEXT, answer TEXT NOT NULL, "
+                    "link TEXT, service_type TEXT, voice TEXT, audio_file TEXT, source TEXT, created_at REAL)"
+                )
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO answers VALUES ({', '.join('?' * len(ANSWER_FIELDS))})",
+                    [tuple(entry[field] for field in ANSWER_FIELDS) for entry in entries]
+                )
+        os.replace(temp_path, self.path)
+
+        with self._lock:
+            self._answers = {entry['key']: dict(entry) for entry in entries}
+
+    def __contains__(self, query: str) -> bool:
+        """Есть ли готовый ответ (без учета в статистике попаданий)"""
+        with self._lock:
+            return query_cluster_key(query) in self._answers
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._answers)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'path': self.path, 'answers': len(self), **self.stats.snapshot()}
+
+
+class BakaiMaterializer:
+    """Офлайн-сборка готовых ответов через обычный конвейер помощника
+
+    Источники: все вопросы FAQ и самые частые группы запросов из журнала.
+    Ответы с деградацией, ошибкой (в том числе ошибкой генерации) или без найденных
+    документов не сохраняются
+    """
+
+    def __init__(self, assistant, store: BakaiAnswerStore = None):
+        self.assistant = assistant
+        self.store = store if store is not None else BakaiAnswerStore()
+
+    def collect_queries(self, query_log: str = None, top_n: int = None,
+                        min_count: int = None) -> List[Tuple[str, str]]:
+        """Запросы для материализации: (запрос, источник) без повторов по ключу группы"""
+        queries = [(faq['original_question'], 'faq') for faq in self.assistant.rag.faq_database.values()]
+
+        query_log = query_log or MATERIALIZE_CONFIG.get("query_log_path")
+        if query_log:
+            clusters = top_query_clusters(
+                query_log,
+                top_n or MATERIALIZE_CONFIG.get("top_clusters", 200),
+                min_count or MATERIALIZE_CONFIG.get("min_cluster_count", 2)
+            )
+            queries.extend((cluster['query'], 'query_log') for cluster in clusters)
+
+        unique = {}
+        for query, source in queries:
+            unique.setdefault(query_cluster_key(query), (query, source))
+        return [item for key, item in unique.items() if key]
+
+    def run(self, query_log: str = None, top_n: int = None, with_audio: bool = None) -> Dict[str, Any]:
+        """Сборка и запись хранилища; возвращает сводку"""
+        with_audio = MATERIALIZE_CONFIG.get("with_audio", True) if with_audio is None else with_audio
+        with_audio = with_audio and self.assistant.tts.is_initialized
+        queries = self.collect_queries(query_log, top_n)
+        print(f"🏗️ Материализация ответов: {len(queries)} запросов (озвучка: {'да' if with_audio else 'нет'})")
+
+        entries = []
+        skipped = 0
+        start_time = time.perf_counter()
+        with self.assistant.offline_mode():
+            for index, (query, source) in enumerate(queries, 1):
+                entry = self._materialize(query, source, with_audio)
+                if entry is None:
+                    skipped += 1
+                else:
+                    entries.append(entry)
+                print(f"   [{index}/{len(queries)}] {'✅' if entry else '⏭️'} {query[:60]}")
+
+        self.store.save(entries)
+        summary = {
+            'queries': len(queries),
+            'materialized': len(entries),
+            'skipped': skipped,
+            'with_audio': sum(1 for entry in entries if entry['audio_file']),
+            'elapsed': round(time.perf_counter() - start_time, 1),
+            'path': self.store.path
+        }
+        print(f"✅ Готовых ответов: {summary['materialized']} (пропущено: {skipped}, "
+              f"с озвучкой: {summary['with_audio']}) за {summary['elapsed']} с -> {self.store.path}")
+        return summary
+
+    def _materialize(self, query: str, source: str, with_audio: bool) -> Optional[Dict[str, Any]]:
+        """Готовый ответ на один запрос (None - ответ не годится для хранения)"""
+        result = self.assistant.process_query(query, deadline=MATERIALIZE_CONFIG.get("deadline"))
+        if not result.get("processing_success") or not result.get("documents_found") \
+                or result.get("degraded_stages") or result.get("failed_stages"):
+            return None
+
+        voice = result["query_analysis"].get("voice")
+        audio_file = None
+        if with_audio:
+            audio_file = self.assistant.tts.speak(result["raw_answer"], voice, save_file=True, play_audio=False)
+
+        return {
+            'key': query_cluster_key(query),
+            'query': query,
+            'answer': result["raw_answer"],
+            'link': result["link"],
+            'service_type': result["service_type"],
+            'voice': voice,
+            'audio_file': audio_file,
+            'source': source,
+            'created_at': time.time()
+        }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pattern_engine.py
+Поиск всех словарных паттернов за один проход по тексту (автомат Ахо-Корасик)
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Паттерны не длиннее этого числа символов ищутся только целым словом ('ип', 'рс', 'нал'),
+# более длинные - и как начало слова, чтобы ловить падежные формы ('кредит' -> 'кредитную')
+SHORT_PATTERN_LENGTH = 3
+
+
+class PatternMatch(NamedTuple):
+    """Вхождение паттерна в текст"""
+    start: int
+    end: int
+    pattern: str
+    lexicon: str
+    category: str
+    weight: float
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+class BakaiPatternEngine:
+    """Автомат Ахо-Корасик по всем словарям: каждое вхождение - с категорией и весом
+
+    Словари добавляются через add_lexicon; автомат перестраивается лениво при первом
+    поиске после изменений. Поиск учитывает границы слов: паттерн должен начинаться
+    с начала слова, а короткие паттерны - и заканчиваться на его конце
+    """
+
+    def __init__(self, cache_size: int = 256):
+        self._lock = threading.Lock()
+        self._lexicons: Dict[str, List[Tuple[str, str, float, bool]]] = {}
+        self._automaton = None  # (переходы, выходы, записи) - заменяется целиком
+        self._cache: "OrderedDict[str, List[PatternMatch]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._scans = 0
+        self._cache_hits = 0
+
+    def add_lexicon(self, lexicon: str, categories: Dict[str, Iterable[str]],
+                    weight: Callable[[str, str], float] = None, whole_word: bool = None) -> None:
+        """Регистрация словаря {категория: паттерны}; повторная регистрация заменяет словарь
+
+        weight(pattern, category) - вес паттерна (по умолчанию 1.0);
+        whole_word=True - все паттерны словаря ищутся только целыми словами
+        """
+        entries = []
+        for category, patterns in categories.items():
+            for pattern in patterns:
+                pattern = pattern.lower()
+                if not pattern:
+                    continue
+                entries.append((
+                    pattern, category,
+                    float(weight(pattern, category)) if weight else 1.0,
+                    whole_word if whole_word is not None else len(pattern) <= SHORT_PATTERN_LENGTH
+                ))
+
+        with self._lock:
+            self._lexicons[lexicon] = entries
+            self._automaton = None
+            self._cache.clear()
+
+    def _build(self):
+        """Построение бора с суффиксными ссылками; выходы состояний объединяются заранее"""
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        records = []
+
+        for lexicon, entries in self._lexicons.items():
+            for pattern, category, weight, whole_word in entries:
+                state = 0
+                for char in pattern:
+                    next_state = goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(goto)
+                        goto[state][char] = next_state
+                        goto.append({})
+                        outputs.append([])
+                    state = next_state
+                outputs[state].append(len(records))
+                records.append((pattern, lexicon, category, weight, whole_word))
+
+        # Обход в ширину: у детей корня суффиксная ссылка - корень, у остальных -
+        # самый длинный собственный суффикс, который тоже есть в боре
+        fail = [0] * len(goto)
+        order = list(goto[0].values())
+        for state in order:
+            for char, next_state in goto[state].items():
+                order.append(next_state)
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                fail[next_state] = goto[link].get(char, 0)
+                outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+
+        return goto, fail, outputs, records
+
+    def _get_automaton(self):
+        with self._lock:
+            if self._automaton is None:
+                self._automaton = self._build()
+            return self._automaton
+
+    def find(self, text: str, lexicons: Optional[Iterable[str]] = None) -> List[PatternMatch]:
+        """Все вхождения паттернов (по всем словарям или только по указанным) в порядке конца"""
+        if lexicons is not None:
+            lexicons = set(lexicons)
+            return [match for match in self._scan(text) if match.lexicon in lexicons]
+        return self._scan(text)
+
+    def _scan(self, text: str) -> List[PatternMatch]:
+        """Один проход по тексту; результаты последних текстов кэшируются"""
+        with self._lock:
+            self._scans += 1
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                self._cache_hits += 1
+                return cached
+
+        goto, fail, outputs, records = self._get_automaton()
+
+        # Регистр снимается посимвольно, чтобы позиции совпадали с исходным текстом
+        folded = text.lower()
+        if len(folded) != len(text):
+            folded = ''.join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+        matches = []
+        state = 0
+        for index, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for record_id in outputs[state]:
+                pattern, lexicon, category, weight, whole_word = records[record_id]
+                start = index - len(pattern) + 1
+                end = index + 1
+                if start > 0 and _is_word_char(folded[start - 1]):
+                    continue
+                if whole_word and end < len(folded) and _is_word_char(folded[end]):
+                    continue
+                matches.append(PatternMatch(start, end, pattern, lexicon, category, weight))
+
+        with self._lock:
+            self._cache[text] = matches
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return matches
+
+    def get_stats(self) -> Dict[str, int]:
+        """Размер автомата и использование кэша"""
+        goto = self._get_automaton()[0]
+        with self._lock:
+            return {
+                'lexicons': len(self._lexicons),
+                'patterns': sum(len(entries) for entries in self._lexicons.values()),
+                'states': len(goto),
+                'scans': self._scans,
+                'cache_hits': self._cache_hits
+            }
+
+
+_shared_engine = None
+_shared_lock = threading.Lock()
+
+
+def get_pattern_engine() -> BakaiPatternEngine:
+    """Общий автомат для фильтрации контента и классификации запросов"""
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            _shared_engine = BakaiPatternEngine()
+        return _shared_engine
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+prompt_builder.py
+Построение промптов с бюджетом токенов и стабильным префиксом
+"""
+
+import re
+from typing import Dict, List, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from config import RAG_CONFIG
+
+# Системные правила неизменны между запросами: побайтно одинаковый префикс
+# позволяет Ollama переиспользовать KV-кэш вместо повторного prefill
+SYSTEM_RULES = """Ты - консультант банка Бакай. Отвечай точно на основе предоставленной информации.
+
+ПРАВИЛА:
+- Используй только информацию из контекста
+- Будь конкретным и точным
+- Отвечай на русском языке
+- Если нет информации, честно скажи об этом"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительная оценка количества токенов"""
+    if not text:
+        return 0
+    return int(len(text) / RAG_CONFIG.get("chars_per_token", 3.0)) + 1
+
+
+class BakaiPromptBuilder:
+    """Сборка сообщений для LLM с распределением бюджета токенов"""
+
+    def __init__(self):
+        self.total_budget = RAG_CONFIG.get("prompt_token_budget", 1500)
+        self.question_budget = RAG_CONFIG.get("question_token_budget", 100)
+        self.instructions_tokens = estimate_tokens(SYSTEM_RULES)
+
+    def context_budget(self) -> int:
+        """Бюджет токенов, оставшийся на контекст"""
+        available = self.total_budget - self.instructions_tokens - self.question_budget
+        return max(0, min(available, RAG_CONFIG.get("context_token_budget", available)))
+
+    def build(self, context: str, query: str) -> Tuple[List[BaseMessage], Dict[str, int]]:
+        """Построение сообщений: фиксированный system + переменная часть"""
+        question = self._truncate(query.strip(), self.question_budget)
+        context = self._truncate(context.strip(), self.context_budget())
+
+        user_content = f"КОНТЕКСТ:\n{context}\n\nВОПРОС: {question}\n\nОТВЕТ:"
+        messages = [
+            SystemMessage(content=SYSTEM_RULES),
+            HumanMessage(content=user_content)
+        ]
+
+        stats = {
+            'instructions_tokens': self.instructions_tokens,
+            'context_tokens': estimate_tokens(context),
+            'question_tokens': estimate_tokens(question),
+            'total_tokens': self.instructions_tokens + estimate_tokens(user_content),
+            'budget': self.total_budget
+        }
+
+        return messages, stats
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до бюджета по границе предложения"""
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+        max_chars = int(max_tokens * RAG_CONFIG.get("chars_per_token", 3.0))
+        truncated = text[:max_chars]
+
+        # Стараемся не обрывать предложение на середине
+        boundary = max(truncated.rfind('. '), truncated.rfind('\n'))
+        if boundary > max_chars // 2:
+            truncated = truncated[:boundary + 1]
+
+        return re.sub(r'\s+$', '', truncated)
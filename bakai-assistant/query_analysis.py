@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+query_analysis.py
+Однократный разбор запроса: текст, слова, ключевые слова, тип, услуга, категория ссылки, голос
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+from config import RAG_CONFIG
+
+TOKEN_PATTERN = re.compile(r'\b\w+\b')
+
+# Слова, указывающие на поиск места (адрес, филиал, банкомат)
+LOCATION_PATTERN = re.compile(r'\b(где|адрес\w*|филиал\w*|банкомат\w*|терминал\w*|отделени\w*|находит\w*|ближайш\w*)\b')
+
+# Населенные пункты и улицы, упоминаемые в запросах об отделениях
+LOCATION_NAMES = re.compile(
+    r'\b(бишкек\w*|ош\w?|джалал-абад\w*|каракол\w*|нарын\w*|талас\w*|баткен\w*|токмок\w*|'
+    r'кара-балт\w*|чолпон-ат\w*|балыкчы|тыныстанов\w*|абдрахманов\w*)\b'
+)
+
+KEYWORD_STOP_WORDS = {
+    'ли', 'предоставляет', 'банк', 'бакай', 'услуги', 'ваш', 'наш', 'это', 'что', 'как',
+    'где', 'когда', 'почему', 'какой', 'какая', 'какие', 'или', 'и', 'в', 'на', 'с', 'для'
+}
+
+# Связанные слова для фраз о ячейках
+KEYWORD_COMBINATIONS = {
+    'сейфовых ячеек': ['сейфов', 'ячеек', 'сейфовых', 'депозитных'],
+    'депозитных ячеек': ['депозитных', 'ячеек', 'сейфовых'],
+    'банковских ячеек': ['банковских', 'ячеек', 'сейфовых']
+}
+
+# Расширенные синонимы для вариантов запроса
+VARIANT_REPLACEMENTS = {
+    'сейфовых ячеек': ['депозитных ячеек', 'банковских ячеек', 'сейфов', 'ячеек для хранения'],
+    'аренды': ['аренда', 'прокат', 'предоставление', 'услуг'],
+    'предоставляет': ['предлагает', 'есть', 'имеет', 'оказывает'],
+    'услуги': ['сервис', 'предложения', 'возможности'],
+    'перевести': ['отправить', 'переслать', 'сделать перевод'],
+    'карту': ['карточку', 'пластик'],
+    'SWIFT': ['свифт', 'swift перевод', 'международный перевод'],
+    'как': ['способ', 'каким образом'],
+    'где': ['адрес', 'местоположение'],
+    'документы': ['справки', 'бумаги', 'требования'],
+    'лимиты': ['ограничения', 'пределы', 'максимум'],
+    'валютные': ['валютных', 'обменных', 'currency']
+}
+
+
+def normalize_question(question: str) -> str:
+    """Нормализация вопроса для точного поиска"""
+    # Убираем лишние пробелы, знаки препинания
+    normalized = re.sub(r'\s+', ' ', question.strip())
+    normalized = re.sub(r'[^\w\s]', '', normalized)
+
+    # Приводим к нижнему регистру
+    return normalized.lower()
+
+
+def extract_keywords(tokens: List[str], text: str) -> List[str]:
+    """Ключевые слова: слова без стоп-слов и коротких + связанные слова фраз"""
+    keywords = [word for word in tokens if word not in KEYWORD_STOP_WORDS and len(word) > 2]
+
+    for phrase, related_words in KEYWORD_COMBINATIONS.items():
+        if any(word in text for word in phrase.split()):
+            keywords.extend(related_words)
+
+    return list(set(keywords))  # Убираем дубликаты
+
+
+def detect_query_type(text: str) -> str:
+    """Тип запроса (инструкция, адрес, документы, ...) по запросу в нижнем регистре"""
+    if any(word in text for word in ['как', 'каким образом', 'способ', 'процедура']):
+        return 'инструкция'
+    elif any(word in text for word in ['где', 'адрес', 'находится']):
+        return 'адрес'
+    elif any(word in text for word in ['документы', 'требуются', 'нужны']):
+        return 'документы'
+    elif any(word in text for word in ['лимит', 'ограничение', 'максимум']):
+        return 'лимиты'
+    elif any(word in text for word in ['что такое', 'расскажи']):
+        return 'объяснение'
+    return 'общий'
+
+
+def select_voice(text: str) -> str:
+    """Голос ответа по запросу в нижнем регистре"""
+    if any(word in text for word in ['где', 'адрес', 'находится', 'расположен']):
+        return 'aidar'  # Мужской голос для адресов
+    elif any(word in text for word in ['как', 'способ', 'инструкция', 'оформить']):
+        return 'baya'   # Женский голос для инструкций
+    elif any(word in text for word in ['важно', 'внимание', 'срочно']):
+        return 'xenia'  # Четкий голос для важной информации
+    return 'kseniya'  # Мягкий женский голос по умолчанию
+
+
+def generate_query_variants(query: str, text: str) -> List[str]:
+    """Варианты запроса для векторного поиска (исходный запрос - первым)"""
+    variants = [query, text]
+
+    # Убираем номера вопросов
+    clean_query = re.sub(r'^\d+\.\s*', '', query.strip())
+    variants.append(clean_query)
+    variants.append(clean_query.lower())
+
+    for original, alternatives in VARIANT_REPLACEMENTS.items():
+        if original in text:
+            for alt in alternatives:
+                variants.append(text.replace(original, alt))
+
+    # Добавляем простые ключевые слова
+    if 'сейф' in text:
+        variants.extend([
+            'сейфовые ячейки',
+            'банковские ячейки',
+            'индивидуальные сейфовые ячейки',
+            'хранение ценностей'
+        ])
+
+    return list(dict.fromkeys(variants))[:8]  # Уникальные варианты
+
+
+class QueryAnalysis:
+    """Разбор запроса, выполняемый один раз и общий для всех этапов обработки
+
+    Текстовые признаки считаются при создании; услугу и категорию ссылки
+    заполняет BakaiQueryAnalyzer (без него они остаются пустыми)
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.text = query.lower()
+        self.normalized = normalize_question(query)
+        self.tokens: List[str] = TOKEN_PATTERN.findall(self.text)
+        self.keywords = extract_keywords(self.tokens, self.text)
+        # Основы ключевых слов (устойчиво к падежным окончаниям)
+        self.stems: Set[str] = {word[:5] for word in self.keywords}
+        self.query_type = detect_query_type(self.text)
+        self.voice = select_voice(self.text)
+        self.location_intent = bool(LOCATION_PATTERN.search(self.text))
+        self.locations: List[str] = list(dict.fromkeys(LOCATION_NAMES.findall(self.text)))
+        self.variants = generate_query_variants(query, self.text)
+
+        self.service_type: Optional[str] = None
+        self.service_confidence = 0.0
+        self.link_category: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Сводка разбора для результата и отладки"""
+        return {
+            "normalized": self.normalized,
+            "keywords": sorted(self.keywords),
+            "query_type": self.query_type,
+            "service_type": self.service_type,
+            "service_confidence": round(self.service_confidence, 3),
+            "link_category": self.link_category,
+            "voice": self.voice,
+            "location_intent": self.location_intent,
+            "locations": list(self.locations)
+        }
+
+
+class BakaiQueryAnalyzer:
+    """Разбор запросов с классификацией услуги и категории ссылки; результаты кэшируются"""
+
+    def __init__(self, content_manager, link_manager, cache_size: int = None):
+        self.content_manager = content_manager
+        self.link_manager = link_manager
+        self.cache_size = cache_size or RAG_CONFIG.get("query_analysis_cache_size", 512)
+        self._cache: "OrderedDict[str, QueryAnalysis]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def analyze(self, query: str) -> QueryAnalysis:
+        """Разбор запроса (повторный запрос берется из кэша; результат не изменяется)"""
+        with self._lock:
+            analysis = self._cache.get(query)
+            if analysis is not None:
+                self._cache.move_to_end(query)
+                self._hits += 1
+                return analysis
+            self._misses += 1
+
+        analysis = QueryAnalysis(query)
+        analysis.service_type, analysis.service_confidence = self.content_manager.classify_service(query)
+        analysis.link_category = self.link_manager._determine_category(analysis.text)
+
+        with self._lock:
+            self._cache[query] = analysis
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return analysis
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'cached': len(self._cache), 'hits': self._hits, 'misses': self._misses}
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+query_log.py
+Журнал запросов пользователей (JSONL) и выбор самых частых групп запросов
+"""
+
+import os
+import json
+import time
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, List
+from query_analysis import normalize_question
+
+# Поля строки журнала, в которых может лежать текст запроса
+QUERY_FIELDS = ('query', 'question', 'text')
+
+
+def query_cluster_key(query: str) -> str:
+    """Ключ группы запроса: без регистра, пунктуации и лишних пробелов
+
+    Порядок слов сохраняется: разные вопросы из одних слов не должны делить готовый ответ
+    """
+    return ' '.join(normalize_question(query).split())
+
+
+class BakaiQueryLog:
+    """Дозапись обработанных запросов в JSONL-файл: одна строка - один запрос"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, query: str, **fields: Any) -> None:
+        """Запись запроса; ошибки записи не мешают обработке"""
+        record = {'ts': round(time.time(), 3), 'query': query, **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with self._lock, open(self.path, 'a', encoding='utf-8') as log_file:
+                log_file.write(line + '\n')
+        except OSError as e:
+            print(f"⚠️ Не удалось записать запрос в журнал: {e}")
+
+
+def read_query_log(path: str) -> Iterator[str]:
+    """Тексты запросов из JSONL-журнала (битые и пустые строки пропускаются)"""
+    try:
+        log_file = open(path, encoding='utf-8')
+    except OSError as e:
+        print(f"⚠️ Журнал запросов недоступен: {e}")
+        return
+
+    with log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            query = next((record[field] for field in QUERY_FIELDS
+                          if isinstance(record.get(field), str) and record[field].strip()), None)
+            if query:
+                yield query.strip()
+
+
+def top_query_clusters(path: str, limit: int, min_count: int = 1) -> List[Dict[str, Any]]:
+    """Самые частые группы запросов журнала
+
+    Для каждой группы - ключ, число запросов и самая частая формулировка
+    """
+    clusters: Dict[str, Counter] = {}
+    for query in read_query_log(path):
+        key = query_cluster_key(query)
+        if key:
+            clusters.setdefault(key, Counter())[query] += 1
+
+    ranked = sorted(
+        ({'key': key, 'count': sum(variants.values()), 'query': variants.most_common(1)[0][0]}
+         for key, variants in clusters.items()),
+        key=lambda cluster: -cluster['count']
+    )
+    return [cluster for cluster in ranked if cluster['count'] >= min_count][:limit]
@@ -5,13 +5,29 @@ rag_system.py
 Система RAG с точным совпадением для банка Бакай
 """
 
+import os
 import re
-from typing import List, Dict, Optional, Tuple
+import math
+import time
+import queue
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import numpy as np
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.chat_models import ChatOllama
 from langchain.docstore.document import Document
-from config import RAG_CONFIG
+from config import RAG_CONFIG, DEADLINE_CONFIG, SCHEDULER_CONFIG
+from prompt_builder import BakaiPromptBuilder, estimate_tokens
+from request_context import BakaiRequestContext, BakaiStats
+from scheduler import BakaiEmbeddingBatcher, BakaiGenerationLimiter
+from retrieval_planner import BakaiRetrievalPlanner
+from query_analysis import (QueryAnalysis, detect_query_type, generate_query_variants,
+                            normalize_question)
 from difflib import SequenceMatcher
 
 class BakaiRAG:
@@ -23,7 +39,24 @@ class BakaiRAG:
         self.embeddings = None
         self.document_count = 0
         self.faq_database = {}  # Кэш для точных FAQ
-        self._last_search_type = 'no_exact_match'
+        self.faq_question_keys = []  # Ключи FAQ в порядке строк матрицы
+        self.faq_question_matrix = None  # Нормированные эмбеддинги вопросов FAQ
+        self.faq_semantic_threshold = RAG_CONFIG.get("faq_semantic_threshold", 0.92)
+        self.faq_exact_lookup = {}  # Вопрос FAQ без учета регистра -> ключ FAQ
+        self.faq_partitions = {}  # Тип услуги -> ключи FAQ раздела вместе с разделом 'general'
+        self.document_urls = set()  # URL из метаданных документов базы
+        self.prompt_builder = BakaiPromptBuilder()
+        self.llms = {}  # Модели по маршрутам: 'large' / 'small'
+        self._small_model_retry_at = 0.0  # До этого момента малая модель не используется (после сбоя)
+        self.stats = BakaiStats(counters=['faq_candidates', 'faq_candidates_full',
+                                          'vector_probes', 'vector_early_exits',
+                                          'small_model_fallbacks'],
+                                groups=['faq_partitions'])  # Задержки генерации, разделы FAQ, пробы поиска
+        self.generation_limiter = None  # Слоты генерации Ollama (при включенном планировщике)
+        self.retrieval_planner = BakaiRetrievalPlanner()
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=RAG_CONFIG.get("retrieval_workers", 8), thread_name_prefix="bakai-retrieval"
+        )
         self._init_components()
     
     def _init_components(self) -> None:
@@ -32,7 +65,15 @@ class BakaiRAG:
             print("🔍 Инициализация RAG системы...")
             
             # Инициализация эмбеддингов
-            self.embeddings = OllamaEmbeddings(model=RAG_CONFIG["embedding_model"])
+            self.embeddings = OllamaEmbeddings(
+                base_url=RAG_CONFIG.get("ollama_base_url", "http://localhost:11434"),
+                model=RAG_CONFIG["embedding_model"]
+            )
+            
+            # Планировщик: пакетные эмбеддинги запросов и очередь генераций
+            if SCHEDULER_CONFIG.get("enabled", True):
+                self.embeddings = BakaiEmbeddingBatcher(self.embeddings)
+                self.generation_limiter = BakaiGenerationLimiter()
             
             # Инициализация векторного хранилища
             self.vectorstore = Chroma(
@@ -40,14 +81,9 @@ class BakaiRAG:
                 embedding_function=self.embeddings
             )
             
-            # Инициализация LLM
-            self.llm = ChatOllama(
-                model=RAG_CONFIG["llm_model"],
-                temperature=RAG_CONFIG["temperature"],
-                num_predict=RAG_CONFIG["max_tokens"],
-                top_p=RAG_CONFIG["top_p"],
-                repeat_penalty=RAG_CONFIG["repeat_penalty"]
-            )
+            # Инициализация LLM (малая модель создается при первом обращении)
+            self.llm = self._create_llm(RAG_CONFIG["llm_model"])
+            self.llms['large'] = self.llm
             
             print("✅ RAG система инициализирована")
             self._validate_database()
@@ -57,6 +93,44 @@ class BakaiRAG:
             print(f"❌ Ошибка инициализации RAG: {e}")
             raise
     
+    def _create_llm(self, model_name: str, timed: bool = True) -> ChatOllama:
+        """Создание клиента чат-модели Ollama (timed=False - без таймаута бюджета генерации)"""
+        return ChatOllama(
+            base_url=RAG_CONFIG.get("ollama_base_url", "http://localhost:11434"),
+            model=model_name,
+            temperature=RAG_CONFIG["temperature"],
+            num_predict=RAG_CONFIG["max_tokens"],
+            top_p=RAG_CONFIG["top_p"],
+            repeat_penalty=RAG_CONFIG["repeat_penalty"],
+            num_ctx=RAG_CONFIG.get("num_ctx", 2048),
+            keep_alive=RAG_CONFIG.get("keep_alive"),
+            # Ожидание ответа Ollama не дольше бюджета генерации
+            timeout=self._generation_timeout() if timed else None
+        )
+    
+    def _generation_timeout(self) -> Optional[int]:
+        """Таймаут HTTP-запроса к Ollama по бюджету генерации"""
+        if not DEADLINE_CONFIG.get("enabled", False):
+            return None
+        budget = DEADLINE_CONFIG.get("stage_budgets", {}).get("generation")
+        return math.ceil(budget) if budget else None
+    
+    def _get_llm(self, route: str, timed: bool = True) -> ChatOllama:
+        """Модель для маршрута; timed=False - клиент без HTTP-таймаута (служебная обработка)"""
+        if route != 'small' or not RAG_CONFIG.get("small_llm_model"):
+            route = 'large'
+        key = route if timed else f"{route}:untimed"
+        if key not in self.llms:
+            model_name = RAG_CONFIG["small_llm_model"] if route == 'small' else RAG_CONFIG["llm_model"]
+            if route == 'small':
+                print(f"🪶 Инициализация малой модели: {model_name}")
+            self.llms[key] = self._create_llm(model_name, timed)
+        return self.llms[key]
+    
+    def _plan_llm(self, plan: Dict) -> ChatOllama:
+        """Клиент модели маршрута; без бюджета генерации в контексте - без таймаута по бюджету"""
+        return self._get_llm(plan['route'], timed='generation' in plan['ctx'].stage_budgets)
+    
     def _validate_database(self) -> None:
         """Проверка состояния базы данных"""
         try:
@@ -80,6 +154,9 @@ class BakaiRAG:
             metadatas = collection.get('metadatas', [])
             
             for doc, metadata in zip(documents, metadatas):
+                if metadata and metadata.get('url'):
+                    self.document_urls.add(metadata['url'])
+                
                 # Ищем FAQ структуру
                 if 'FAQ:' in doc:
                     # Извлекаем вопрос и ответ
@@ -97,35 +174,210 @@ class BakaiRAG:
                             'full_content': doc,
                             'metadata': metadata
                         }
+                        self.faq_exact_lookup[self._clean_faq_question(question)] = normalized_question
                         
                         print(f"📝 Индексирован FAQ: {question[:50]}...")
             
             print(f"✅ Проиндексировано {len(self.faq_database)} FAQ записей")
+            self._build_faq_partitions()
             
         except Exception as e:
             print(f"⚠️ Не удалось построить индекс FAQ: {e}")
+        
+        self._build_faq_question_embeddings()
+    
+    def _build_faq_question_embeddings(self) -> None:
+        """Построение матрицы эмбеддингов вопросов FAQ для семантического совпадения
+        
+        Вопросы FAQ кодируются тем же путем, что и входящий запрос (embed_query),
+        поэтому и калибровка порога, и сравнение идут по парам одного вида.
+        Матрица сохраняется на диск с хэшем вопросов и модели и пересчитывается
+        только при их изменении
+        """
+        if not RAG_CONFIG.get("faq_semantic_enabled", True) or not self.faq_database:
+            return
+        
+        try:
+            keys = list(self.faq_database.keys())
+            questions = [self.faq_database[key]['original_question'] for key in keys]
+            digest = hashlib.sha1(
+                '\n'.join([RAG_CONFIG["embedding_model"], *questions]).encode('utf-8')
+            ).hexdigest()
+            
+            matrix = self._load_faq_embeddings(digest)
+            if matrix is None:
+                vectors = np.array(self._embed_queries(questions), dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrix = vectors / norms
+                self._save_faq_embeddings(digest, matrix)
+            
+            self.faq_question_keys = keys
+            self.faq_question_matrix = matrix
+            self.faq_semantic_threshold = self._calibrate_semantic_threshold()
+            
+            print(f"🧭 Эмбеддинги вопросов FAQ: {len(keys)} "
+                  f"(порог сходства: {self.faq_semantic_threshold:.3f})")
+            
+        except Exception as e:
+            print(f"⚠️ Не удалось построить эмбеддинги вопросов FAQ: {e}")
+            self.faq_question_keys = []
+            self.faq_question_matrix = None
+    
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги текстов по пути запросов (через пакетировщик - параллельно)"""
+        if isinstance(self.embeddings, BakaiEmbeddingBatcher):
+            return self.embeddings.embed_queries(texts)
+        return [self.embeddings.embed_query(text) for text in texts]
+    
+    def _load_faq_embeddings(self, digest: str) -> Optional[np.ndarray]:
+        """Сохраненная матрица вопросов FAQ, если она построена для тех же вопросов и модели"""
+        path = RAG_CONFIG.get("faq_embeddings_cache_path")
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as cached:
+                if str(cached['digest']) != digest:
+                    return None
+                print("🧭 Эмбеддинги вопросов FAQ загружены с диска")
+                return cached['matrix']
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать эмбеддинги вопросов FAQ: {e}")
+            return None
+    
+    def _save_faq_embeddings(self, digest: str, matrix: np.ndarray) -> None:
+        path = RAG_CONFIG.get("faq_embeddings_cache_path")
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as cache_file:
+                np.savez(cache_file, digest=np.array(digest), matrix=matrix)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить эмбеддинги вопросов FAQ: {e}")
+    
+    def _calibrate_semantic_threshold(self) -> float:
+        """Калибровка порога: сходство с FAQ должно превышать сходство разных FAQ между собой
+        
+        Вопросы FAQ закодированы как запросы, так что пары FAQ-FAQ того же вида, что запрос-FAQ
+        """
+        base_threshold = RAG_CONFIG.get("faq_semantic_threshold", 0.92)
+        matrix = self.faq_question_matrix
+        
+        if matrix is None or len(matrix) < 2:
+            return base_threshold
+        
+        # Для каждого вопроса - сходство с ближайшим ДРУГИМ вопросом
+        similarities = matrix @ matrix.T
+        np.fill_diagonal(similarities, -1.0)
+        nearest = similarities.max(axis=1)
+        
+        quantile = RAG_CONFIG.get("faq_semantic_calibration_quantile", 0.9)
+        calibrated = float(np.quantile(nearest, quantile))
+        
+        return min(max(base_threshold, calibrated), 0.99)
     
     def _normalize_question(self, question: str) -> str:
         """Нормализация вопроса для точного поиска"""
-        # Убираем лишние пробелы, знаки препинания
-        normalized = re.sub(r'\s+', ' ', question.strip())
-        normalized = re.sub(r'[^\w\s]', '', normalized)
+        return normalize_question(question)
+    
+
+    def _retrieval_metadata(self, metadata: Optional[Dict], tier: str, score: float) -> Dict:
+        """Копия метаданных документа с уровнем поиска и оценкой уверенности"""
+        result = dict(metadata or {})
+        result['retrieval_tier'] = tier
+        result['retrieval_score'] = round(float(score), 4)
+        return result
+    
+    def _document_id(self, doc: Document) -> str:
+        """Стабильный идентификатор документа по содержимому"""
+        return hashlib.md5(doc.page_content.encode('utf-8')).hexdigest()[:12]
+    
+    def search_documents(self, query: str, k: int = None,
+                         ctx: Optional[BakaiRequestContext] = None) -> List[Document]:
+        """Поиск документов (совместимость с существующим кодом)
         
-        # Приводим к нижнему регистру
-        normalized = normalized.lower()
+        Тип поиска сохраняется в контексте запроса для generate_answer
+        """
+        documents, _ = self.search_documents_with_type(query, k, ctx)
+        return documents
+    
+    async def asearch_documents_with_type(self, query: str, k: int = None,
+                                          ctx: Optional[BakaiRequestContext] = None) -> Tuple[List[Document], str]:
+        """Асинхронный поиск: Chroma и эмбеддинги синхронные, выполняются в пуле потоков"""
+        return await asyncio.to_thread(self.search_documents_with_type, query, k, ctx)
+    
+    def search_documents_with_type(self, query: str, k: int = None,
+                                   ctx: Optional[BakaiRequestContext] = None) -> Tuple[List[Document], str]:
+        """Поиск с записью типа поиска, найденных документов и времени в контекст запроса"""
+        ctx = ctx or BakaiRequestContext(query)
+        
+        with ctx.stage('retrieval'):
+            documents, search_type = self._search_documents(query, k, ctx)
         
-        return normalized
+        ctx.search_type = search_type
+        ctx.retrieved_ids = [self._document_id(doc) for doc in documents]
+        return documents, search_type
     
-    def search_documents(self, query: str, k: int = None) -> List[Document]:
-        """Поиск документов (совместимость с существующим кодом)"""
-        documents, search_type = self.search_documents_with_type(query, k)
+    def _build_faq_partitions(self) -> None:
+        """Разделы FAQ по типам услуг (по url и parent_id); FAQ может входить в несколько разделов
         
-        # Сохраняем тип поиска для использования в generate_answer
-        self._last_search_type = search_type
+        FAQ, не попавшие ни в один раздел, образуют раздел 'general' и добавляются к каждому
+        """
+        if not RAG_CONFIG.get("faq_partitions_enabled", True):
+            return
         
-        return documents
+        rules = RAG_CONFIG.get("faq_partition_rules", {})
+        partitions = {service_type: [] for service_type in rules}
+        general = []
+        for key, faq_data in self.faq_database.items():
+            metadata = faq_data['metadata'] or {}
+            source = f"{metadata.get('url', '')} {metadata.get('parent_id', '')}".lower()
+            matched = [service_type for service_type, fragments in rules.items()
+                       if any(fragment in source for fragment in fragments)]
+            for service_type in matched:
+                partitions[service_type].append(key)
+            if not matched:
+                general.append(key)
+        
+        self.faq_partitions = {service_type: keys + general for service_type, keys in partitions.items()}
+        sizes = ', '.join(f"{service_type} {len(keys)}" for service_type, keys in partitions.items())
+        print(f"🗂️ Разделы FAQ: {sizes}, general {len(general)}")
+    
+    def _faq_candidates(self, ctx: Optional[BakaiRequestContext] = None) -> List[str]:
+        """Ключи FAQ для нечеткого сравнения: раздел услуги запроса или, при низкой уверенности, все"""
+        keys = None
+        if ctx is not None and ctx.service_type and \
+                ctx.service_confidence >= RAG_CONFIG.get("faq_partition_min_confidence", 0.6):
+            keys = self.faq_partitions.get(ctx.service_type)
+        
+        self.stats.increment('faq_candidates_full', len(self.faq_database))
+        if not keys:
+            self.stats.increment_in('faq_partitions', 'all')
+            self.stats.increment('faq_candidates', len(self.faq_database))
+            return list(self.faq_database)
+        
+        self.stats.increment_in('faq_partitions', ctx.service_type)
+        self.stats.increment('faq_candidates', len(keys))
+        return keys
+    
+    @staticmethod
+    def _clean_faq_question(question: str) -> str:
+        """Вопрос без номера, знака вопроса, лишних пробелов и регистра - для точного сравнения"""
+        question = re.sub(r'^\d+\.\s*', '', question.strip()).rstrip('?').strip()
+        return re.sub(r'\s+', ' ', question).lower()
     
-    def search_documents_with_type(self, query: str, k: int = None) -> Tuple[List[Document], str]:
+    def _query_analysis(self, query: str, ctx: Optional[BakaiRequestContext] = None) -> QueryAnalysis:
+        """Разбор запроса из контекста; без него - разбор на месте (с записью в контекст)"""
+        if ctx is not None and ctx.analysis is not None and ctx.analysis.query == query:
+            return ctx.analysis
+        analysis = QueryAnalysis(query)
+        if ctx is not None:
+            ctx.analysis = analysis
+        return analysis
+    
+    def _search_documents(self, query: str, k: int = None,
+                          ctx: Optional[BakaiRequestContext] = None) -> Tuple[List[Document], str]:
         """Поиск: сначала точное совпадение, иначе - обычный поиск"""
         if k is None:
             k = RAG_CONFIG["search_k"]
@@ -134,75 +386,260 @@ class BakaiRAG:
             print(f"🔍 Поиск для запроса: '{query}'")
             
             # Шаг 1: Проверяем точное совпадение в FAQ
-            exact_match = self._find_exact_faq_match(query)
-            if exact_match:
-                print("✅ Найдено ТОЧНОЕ совпадение в FAQ")
-                doc = Document(
-                    page_content=exact_match['full_content'],
-                    metadata=exact_match['metadata'] or {}
-                )
-                return [doc], 'exact_match'
+            exact_docs = self._exact_tier(query, ctx)
+            if exact_docs:
+                return exact_docs, 'exact_match'
+            
+            # Дальше уровни поиска независимы: какие запускать - решает планировщик
+            analysis = self._query_analysis(query, ctx)
+            plan = self.retrieval_planner.plan(analysis, ctx.service_type if ctx else None)
+            if ctx is not None:
+                ctx.retrieval_plan = plan
+            if RAG_CONFIG.get("parallel_retrieval", True):
+                return self._fan_out_search(query, k, ctx, plan)
+            
+            # Шаг 1б: Семантическое совпадение по эмбеддингам вопросов FAQ
+            if 'semantic' in plan['tiers']:
+                semantic_docs = self._semantic_tier(query)
+                if semantic_docs:
+                    return semantic_docs, 'exact_match'
             
             # Шаг 2: Нет точного совпадения - обычный поиск
             print("🔍 Точного совпадения нет - выполняем обычный поиск...")
             
             # Комбинируем: сначала похожие FAQ, потом векторный поиск
-            all_docs = []
-            
-            # Ищем похожие вопросы с низким порогом
-            similar_matches = self._find_similar_faq_matches(query, threshold=0.6)
-            if similar_matches:
-                print(f"📋 Найдено {len(similar_matches)} похожих FAQ")
-                for match in similar_matches:
-                    doc = Document(
-                        page_content=match['full_content'],
-                        metadata=match['metadata'] or {}
-                    )
-                    all_docs.append(doc)
-            
-            # Добавляем результаты векторного поиска
-            vector_results = self._enhanced_vector_search(query, k)
-            all_docs.extend(vector_results)
+            similar_docs = self._similar_tier(query, ctx) if 'similar' in plan['tiers'] else []
+            vector_results = self._enhanced_vector_search(query, k, ctx, plan)
+            return self._merge_tiers([similar_docs, vector_results], k), 'no_exact_match'
             
-            # Убираем дубликаты
-            unique_docs = []
-            seen_content = set()
-            for doc in all_docs:
+        except Exception as e:
+            print(f"❌ Ошибка поиска документов: {e}")
+            return [], 'error'
+    
+    def find_faq_documents(self, query: str, ctx: Optional[BakaiRequestContext] = None) -> List[Document]:
+        """Только уровни прямого ответа FAQ: точное, затем семантическое совпадение (без векторного поиска)"""
+        return self._exact_tier(query, ctx) or self._semantic_tier(query)
+    
+    def _exact_tier(self, query: str, ctx: Optional[BakaiRequestContext] = None) -> List[Document]:
+        """Уровень точного совпадения с вопросом FAQ (один документ или пусто)"""
+        exact_match = self._find_exact_faq_match(query, ctx)
+        if not exact_match:
+            return []
+        
+        print("✅ Найдено ТОЧНОЕ совпадение в FAQ")
+        return [Document(
+            page_content=exact_match['full_content'],
+            metadata=self._retrieval_metadata(exact_match['metadata'], 'faq_exact', 1.0)
+        )]
+    
+    def _semantic_tier(self, query: str) -> List[Document]:
+        """Уровень семантического совпадения с вопросом FAQ (один документ или пусто)"""
+        semantic_match = self._find_semantic_faq_match(query)
+        if not semantic_match:
+            return []
+        
+        print("✅ Найдено СЕМАНТИЧЕСКОЕ совпадение в FAQ")
+        return [Document(
+            page_content=semantic_match['full_content'],
+            metadata=self._retrieval_metadata(
+                semantic_match['metadata'], 'faq_semantic', semantic_match['similarity']
+            )
+        )]
+    
+    def _similar_tier(self, query: str, ctx: Optional[BakaiRequestContext] = None) -> List[Document]:
+        """Уровень похожих FAQ с низким порогом"""
+        similar_matches = self._find_similar_faq_matches(query, threshold=0.6, ctx=ctx)
+        if similar_matches:
+            print(f"📋 Найдено {len(similar_matches)} похожих FAQ")
+        return [
+            Document(
+                page_content=match['full_content'],
+                metadata=self._retrieval_metadata(match['metadata'], 'faq_similar', match['similarity'])
+            )
+            for match in similar_matches
+        ]
+    
+    def _merge_tiers(self, tiers: List[List[Document]], k: int) -> List[Document]:
+        """Объединение уровней в порядке приоритета без дубликатов"""
+        unique_docs = []
+        seen_content = set()
+        for documents in tiers:
+            for doc in documents:
                 if doc.page_content not in seen_content:
                     unique_docs.append(doc)
                     seen_content.add(doc.page_content)
+        
+        return unique_docs[:k]
+    
+    def _fan_out_search(self, query: str, k: int, ctx: Optional[BakaiRequestContext],
+                        plan: Dict) -> Tuple[List[Document], str]:
+        """Параллельный запуск уровней поиска по плану
+        
+        Уверенный результат отменяет еще не начатую работу менее приоритетных уровней:
+        семантическое совпадение - все остальное, очень похожий FAQ - ключевые слова и векторы,
+        найденные ключевые слова - векторный поиск. Параллельно с ключевыми словами идет
+        только проба по исходному запросу (в режиме staged - и она после их промаха);
+        варианты запроса ищутся после промаха ключевых слов и только если проба
+        не дала явного лидера. По истечении бюджета возвращается уже найденное
+        """
+        executor = self.retrieval_executor
+        analysis = self._query_analysis(query, ctx)
+        tier_calls = {
+            'semantic': (self._semantic_tier, query),
+            'similar': (self._similar_tier, query, ctx),
+            'keyword': (self._keyword_tier, query, k, analysis.keywords)
+        }
+        futures = {
+            executor.submit(self._timed, *tier_calls[tier]): tier
+            for tier in plan['tiers'] if tier in tier_calls
+        }
+        
+        variants = analysis.variants[:plan['variants']]
+        keyword_planned = 'keyword' in plan['tiers']
+        
+        def submit_vector(probe: bool = RAG_CONFIG.get("adaptive_vector_search", True)):
+            if 'vector' in cancelled:
+                return
+            if not probe and keyword_planned and keyword_state['result'] is None:
+                # Несколько эмбеддингов вариантов - только после промаха ключевых слов
+                keyword_state['variants_waiting'] = True
+                return
+            if probe:
+                future = executor.submit(self._timed, self._vector_probe, variants[0], k)
+                futures[future] = 'vector'
+                probe_futures.add(future)
+                pending.add(future)
+                return
+            for index, variant in enumerate(variants):
+                future = executor.submit(self._timed, self._vector_variant_search, variant, k)
+                futures[future] = 'vector'
+                variant_index[future] = index
+                pending.add(future)
+        
+        results = {'similar': [], 'keyword': [], 'vector': []}
+        variant_results: Dict[int, List] = {}
+        variant_index: Dict = {}
+        probe_futures = set()
+        cancelled = set()
+        pending = set(futures)
+        keyword_state = {'result': None, 'variants_waiting': False}
+        if plan['mode'] == 'fan_out' or not keyword_planned:
+            submit_vector()
+        
+        def cancel(*tiers):
+            for future in list(pending):
+                if futures[future] in tiers:
+                    future.cancel()
+                    pending.discard(future)
+            cancelled.update(tiers)
+        
+        while pending:
+            timeout = ctx.stage_remaining('retrieval') if ctx is not None else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Бюджет исчерпан: обходимся уже найденным
+                ctx.degrade('retrieval')
+                break
             
-            return unique_docs[:k], 'no_exact_match'
-            
-        except Exception as e:
-            print(f"❌ Ошибка поиска документов: {e}")
-            return [], 'error'
+            for future in done:
+                tier = futures[future]
+                try:
+                    value, elapsed = future.result()
+                except Exception as e:
+                    print(f"⚠️ Ошибка уровня поиска '{tier}': {e}")
+                    value, elapsed = [], 0.0
+                
+                if tier == 'semantic':
+                    self.retrieval_planner.observe(plan['bucket'], tier, bool(value), elapsed)
+                    if value:
+                        cancel('similar', 'keyword', 'vector')
+                        return value, 'exact_match'
+                elif tier == 'similar':
+                    results['similar'] = value
+                    top_score = (value[0].metadata or {}).get('retrieval_score', 0.0) if value else 0.0
+                    self.retrieval_planner.observe(
+                        plan['bucket'], tier,
+                        top_score >= RAG_CONFIG.get("extractive_answer_threshold", 0.75), elapsed
+                    )
+                    if top_score >= RAG_CONFIG.get("direct_answer_threshold", 0.85):
+                        cancel('keyword', 'vector')
+                elif tier == 'keyword':
+                    if 'keyword' in cancelled:
+                        continue
+                    self.retrieval_planner.observe(plan['bucket'], tier, bool(value), elapsed)
+                    keyword_state['result'] = bool(value)
+                    if value:
+                        print(f"🎯 Найдено {len(value)} документов по ключевым словам")
+                        results['keyword'] = value
+                        cancel('vector')
+                    elif plan['mode'] == 'staged':
+                        submit_vector()
+                    elif keyword_state['variants_waiting']:
+                        submit_vector(probe=False)
+                elif future in probe_futures:
+                    if tier in cancelled:
+                        continue
+                    probe_results, decisive = value or ([], False)
+                    self.retrieval_planner.observe(plan['bucket'], tier, bool(probe_results), elapsed)
+                    results['vector'].extend(probe_results)
+                    if not decisive:
+                        submit_vector(probe=False)
+                elif tier not in cancelled:
+                    self.retrieval_planner.observe(plan['bucket'], tier, bool(value), elapsed)
+                    variant_results[variant_index[future]] = value
+                    results['vector'].extend(value)
+        
+        for future in pending:
+            future.cancel()
+        
+        lexical_or_vector = results['keyword']
+        if not lexical_or_vector:
+            lexical_or_vector = self._merge_vector_results(results['vector'], k)
+            self._observe_variant_gain(plan, variant_results, lexical_or_vector, k)
+        
+        print(f"🔀 Параллельный поиск: похожих FAQ {len(results['similar'])}, "
+              f"ключевых {len(results['keyword'])}, векторных {len(results['vector'])}"
+              f"{', отменено: ' + ', '.join(sorted(cancelled)) if cancelled else ''}")
+        return self._merge_tiers([results['similar'], lexical_or_vector], k), 'no_exact_match'
+    
+    def _timed(self, function: Callable, *args) -> Tuple[Any, float]:
+        """Вызов уровня поиска с замером времени"""
+        start_time = time.perf_counter()
+        return function(*args), time.perf_counter() - start_time
     
-    def _find_exact_faq_match(self, query: str) -> Optional[Dict]:
-        """Поиск ТОЧНОГО совпадения в FAQ"""
+    def _observe_variant_gain(self, plan: Dict, variant_results: Dict[int, List],
+                              merged: List[Document], k: int) -> None:
+        """Учет того, добавили ли дополнительные варианты запроса новые документы в топ"""
+        if len(variant_results) < 2 or 0 not in variant_results:
+            return
+        original_top = {doc.page_content for doc in self._merge_vector_results(variant_results[0], k)}
+        gained = any(doc.page_content not in original_top for doc in merged)
+        self.retrieval_planner.observe(plan['bucket'], 'variants', gained)
+    
+    def _find_exact_faq_match(self, query: str, ctx: Optional[BakaiRequestContext] = None) -> Optional[Dict]:
+        """Поиск ТОЧНОГО совпадения в FAQ (нечеткое - внутри раздела услуги запроса)"""
         
         # Очищаем запрос от номеров и лишних символов
-        clean_query = re.sub(r'^\d+\.\s*', '', query.strip())
-        clean_query = re.sub(r'\s+', ' ', clean_query)
+        clean_query = self._clean_faq_question(query)
         
         print(f"🔍 Ищем точное совпадение для: '{clean_query}'")
         
-        # Проверяем каждый FAQ на точное совпадение
-        for normalized_faq, faq_data in self.faq_database.items():
+        # Точное совпадение (игнорируя регистр) - по всем FAQ через словарь
+        exact_key = self.faq_exact_lookup.get(clean_query)
+        if exact_key is not None:
+            faq_data = self.faq_database[exact_key]
+            print(f"✅ ТОЧНОЕ СОВПАДЕНИЕ найдено!")
+            print(f"   Вопрос: {faq_data['original_question']}")
+            print(f"   Ответ: {faq_data['answer'][:100]}...")
+            return faq_data
+        
+        for normalized_faq in self._faq_candidates(ctx):
+            faq_data = self.faq_database[normalized_faq]
             original_question = faq_data['original_question']
             
-            # Убираем лишние символы из оригинального вопроса
-            clean_original = re.sub(r'\s+', ' ', original_question.strip())
-            
-            # Проверяем точное совпадение (игнорируя регистр)
-            if clean_query.lower() == clean_original.lower():
-                print(f"✅ ТОЧНОЕ СОВПАДЕНИЕ найдено!")
-                print(f"   Вопрос: {original_question}")
-                print(f"   Ответ: {faq_data['answer'][:100]}...")
-                return faq_data
-            
             # Дополнительная проверка: очень высокое сходство (>95%)
-            similarity = SequenceMatcher(None, clean_query.lower(), clean_original.lower()).ratio()
+            clean_original = self._clean_faq_question(original_question)
+            similarity = SequenceMatcher(None, clean_query, clean_original).ratio()
             if similarity > 0.95:
                 print(f"✅ ПРАКТИЧЕСКИ ТОЧНОЕ СОВПАДЕНИЕ найдено (сходство: {similarity:.2f})!")
                 print(f"   Вопрос: {original_question}")
@@ -212,13 +649,46 @@ class BakaiRAG:
         print("❌ Точное совпадение не найдено")
         return None
     
-    def _find_similar_faq_matches(self, query: str, threshold: float = 0.7) -> List[Dict]:
-        """Поиск похожих FAQ с оценкой сходства"""
-        normalized_query = self._normalize_question(query)
+    def _find_semantic_faq_match(self, query: str) -> Optional[Dict]:
+        """Поиск FAQ с семантически тем же вопросом (перефразирование)"""
+        if self.faq_question_matrix is None:
+            return None
+        
+        try:
+            clean_query = re.sub(r'^\d+\.\s*', '', query.strip())
+            query_vector = np.array(self.embeddings.embed_query(clean_query), dtype=np.float32)
+            norm = np.linalg.norm(query_vector)
+            if norm == 0:
+                return None
+            
+            similarities = self.faq_question_matrix @ (query_vector / norm)
+            order = np.argsort(similarities)[::-1]
+            best_similarity = float(similarities[order[0]])
+            second_similarity = float(similarities[order[1]]) if len(order) > 1 else -1.0
+            
+            margin = RAG_CONFIG.get("faq_semantic_margin", 0.02)
+            if best_similarity < self.faq_semantic_threshold or best_similarity - second_similarity < margin:
+                print(f"🧭 Семантическое совпадение не найдено (лучшее сходство: {best_similarity:.3f})")
+                return None
+            
+            faq_data = self.faq_database[self.faq_question_keys[order[0]]]
+            print(f"✅ СЕМАНТИЧЕСКОЕ СОВПАДЕНИЕ (сходство: {best_similarity:.3f})")
+            print(f"   Вопрос: {faq_data['original_question']}")
+            return {**faq_data, 'similarity': best_similarity}
+            
+        except Exception as e:
+            print(f"⚠️ Ошибка семантического поиска FAQ: {e}")
+            return None
+    
+    def _find_similar_faq_matches(self, query: str, threshold: float = 0.7,
+                                  ctx: Optional[BakaiRequestContext] = None) -> List[Dict]:
+        """Поиск похожих FAQ с оценкой сходства (внутри раздела услуги запроса)"""
+        normalized_query = self._query_analysis(query, ctx).normalized
         
         similar_matches = []
         
-        for faq_question, faq_data in self.faq_database.items():
+        for faq_question in self._faq_candidates(ctx):
+            faq_data = self.faq_database[faq_question]
             # Вычисляем сходство
             similarity = SequenceMatcher(None, normalized_query, faq_question).ratio()
             
@@ -237,55 +707,125 @@ class BakaiRAG:
         
         return similar_matches
     
-    def _enhanced_vector_search(self, query: str, k: int) -> List[Document]:
+    def _enhanced_vector_search(self, query: str, k: int, ctx: Optional[BakaiRequestContext] = None,
+                                plan: Optional[Dict] = None) -> List[Document]:
         """Улучшенный векторный поиск с проверкой ключевых слов"""
         try:
+            analysis = self._query_analysis(query, ctx)
+            
             # Сначала пробуем прямой поиск по ключевым словам в документах
-            keyword_results = self._keyword_search_in_documents(query)
-            if keyword_results:
-                print(f"🎯 Найдено {len(keyword_results)} документов по ключевым словам")
-                return keyword_results[:k]
+            if plan is None or 'keyword' in plan['tiers']:
+                keyword_results = self._keyword_tier(query, k, analysis.keywords)
+                if keyword_results:
+                    print(f"🎯 Найдено {len(keyword_results)} документов по ключевым словам")
+                    return keyword_results
             
             # Если не нашли по ключевым словам, используем векторный поиск
-            query_variants = self._generate_query_variants(query)
+            query_variants = analysis.variants
+            if plan is not None:
+                query_variants = query_variants[:plan['variants']]
             
             all_results = []
             
-            for variant in query_variants:
-                try:
-                    results = self.vectorstore.similarity_search_with_score(variant, k=k*2)
-                    all_results.extend(results)
-                    print(f"   🔍 '{variant[:40]}...' → {len(results)} результатов")
-                except Exception as e:
-                    print(f"⚠️ Ошибка векторного поиска для '{variant}': {e}")
-            
-            # Убираем дубликаты и сортируем
-            unique_docs = {}
-            for doc, score in all_results:
-                doc_text = doc.page_content
-                if doc_text not in unique_docs or unique_docs[doc_text][1] > score:
-                    unique_docs[doc_text] = (doc, score)
+            # Проба по исходному запросу с малым k: при явном лидере варианты не нужны
+            if RAG_CONFIG.get("adaptive_vector_search", True):
+                probe_results, decisive = self._vector_probe(query_variants[0], k)
+                if decisive:
+                    return self._merge_vector_results(probe_results, k)
+                all_results.extend(probe_results)
             
-            sorted_results = sorted(unique_docs.values(), key=lambda x: x[1])
-            final_docs = [doc for doc, _ in sorted_results[:k]]
+            for variant in query_variants:
+                # Бюджет поиска исчерпан - обходимся уже найденным
+                if all_results and ctx is not None and ctx.stage_expired('retrieval'):
+                    ctx.degrade('retrieval')
+                    break
+                all_results.extend(self._vector_variant_search(variant, k))
             
-            return final_docs
+            return self._merge_vector_results(all_results, k)
             
         except Exception as e:
             print(f"⚠️ Ошибка расширенного векторного поиска: {e}")
             return []
     
-    def _keyword_search_in_documents(self, query: str) -> List[Document]:
-        """Поиск по ключевым словам в содержимом документов"""
+    def _keyword_tier(self, query: str, k: int, keywords: List[str] = None) -> List[Document]:
+        """Уровень поиска по ключевым словам (первые k документов)"""
+        return self._keyword_search_in_documents(query, keywords)[:k]
+    
+    def _vector_variant_search(self, variant: str, k: int,
+                               fetch_k: int = None) -> List[Tuple[Document, float]]:
+        """Векторный поиск одного варианта запроса (по умолчанию - 2k кандидатов)"""
+        try:
+            results = self.vectorstore.similarity_search_with_score(variant, k=fetch_k or k*2)
+            print(f"   🔍 '{variant[:40]}...' → {len(results)} результатов")
+            return results
+        except Exception as e:
+            print(f"⚠️ Ошибка векторного поиска для '{variant}': {e}")
+            return []
+    
+    def _vector_probe(self, query: str, k: int) -> Tuple[List[Tuple[Document, float]], bool]:
+        """Пробный векторный поиск с малым k; второе значение - найден ли явный лидер"""
+        results = self._vector_variant_search(query, k, fetch_k=RAG_CONFIG.get("adaptive_probe_k", 3))
+        decisive = self._is_clear_winner(results)
+        self.stats.increment('vector_probes')
+        if decisive:
+            self.stats.increment('vector_early_exits')
+            print("⚡ Явный лидер векторного поиска - варианты запроса пропущены")
+        return results, decisive
+    
+    def _is_clear_winner(self, results: List[Tuple[Document, float]]) -> bool:
+        """Правило ранней остановки: лучший результат заметно ближе второго
+        
+        Отрыв считается относительно расстояния второго результата (adaptive_gap_ratio);
+        adaptive_max_distance дополнительно ограничивает расстояние самого лидера
+        """
+        if len(results) < 2:
+            return bool(results)
+        
+        best, second = sorted(score for _, score in results)[:2]
+        max_distance = RAG_CONFIG.get("adaptive_max_distance")
+        if max_distance is not None and best > max_distance:
+            return False
+        if second <= 0:
+            return False
+        return (second - best) / second >= RAG_CONFIG.get("adaptive_gap_ratio", 0.25)
+    
+    def get_vector_search_stats(self) -> Dict[str, Any]:
+        """Доля векторных поисков, завершенных после пробы"""
+        stats = self.stats.snapshot()
+        probes = stats['vector_probes']
+        return {
+            'probes': probes,
+            'early_exits': stats['vector_early_exits'],
+            'early_exit_rate': round(stats['vector_early_exits'] / probes, 3) if probes else 0.0
+        }
+    
+    def _merge_vector_results(self, all_results: List[Tuple[Document, float]], k: int) -> List[Document]:
+        """Дедупликация результатов вариантов и сортировка по расстоянию"""
+        unique_docs = {}
+        for doc, score in all_results:
+            doc_text = doc.page_content
+            if doc_text not in unique_docs or unique_docs[doc_text][1] > score:
+                unique_docs[doc_text] = (doc, score)
+        
+        sorted_results = sorted(unique_docs.values(), key=lambda x: x[1])
+        return [
+            Document(
+                page_content=doc.page_content,
+                metadata=self._retrieval_metadata(doc.metadata, 'vector', -float(score))
+            )
+            for doc, score in sorted_results[:k]
+        ]
+    
+    def _keyword_search_in_documents(self, query: str, keywords: List[str] = None) -> List[Document]:
+        """Поиск по ключевым словам в содержимом документов (ключевые слова - из разбора запроса)"""
         try:
             collection = self.vectorstore._collection.get()
             documents = collection.get('documents', [])
             metadatas = collection.get('metadatas', [])
             
-            query_lower = query.lower()
-            
             # Извлекаем ключевые слова из запроса
-            keywords = self._extract_keywords(query_lower)
+            if keywords is None:
+                keywords = self._extract_keywords(query)
             
             if not keywords:
                 return []
@@ -306,8 +846,12 @@ class BakaiRAG:
                 
                 # Если есть совпадения, добавляем документ
                 if match_score > 0:
+                    coverage = match_score / len(keywords)
                     matches.append({
-                        'document': Document(page_content=doc, metadata=metadata or {}),
+                        'document': Document(
+                            page_content=doc,
+                            metadata=self._retrieval_metadata(metadata, 'keyword', coverage)
+                        ),
                         'score': match_score,
                         'keywords': matched_keywords,
                         'content_preview': doc[:100] + '...'
@@ -330,99 +874,161 @@ class BakaiRAG:
     
     def _extract_keywords(self, query: str) -> List[str]:
         """Извлечение ключевых слов из запроса"""
-        # Удаляем стоп-слова и извлекаем значимые слова
-        stop_words = {
-            'ли', 'предоставляет', 'банк', 'бакай', 'услуги', 'ваш', 'наш', 'это', 'что', 'как',
-            'где', 'когда', 'почему', 'какой', 'какая', 'какие', 'или', 'и', 'в', 'на', 'с', 'для'
-        }
+        return QueryAnalysis(query).keywords
+    
+
+    def _generate_query_variants(self, query: str) -> List[str]:
+        """Генерация вариантов запроса с улучшенными синонимами"""
+        return generate_query_variants(query, query.lower())
+    
+
+    def generate_answer(self, query: str, documents: List[Document], search_type: str = None,
+                        on_token: Optional[Callable[[str], None]] = None,
+                        ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Генерация ответа: прямой ответ при точном совпадении, генерация - при отсутствии
         
-        # Разбиваем на слова и убираем знаки препинания
-        words = re.findall(r'\b\w+\b', query.lower())
+        on_token вызывается для каждого фрагмента ответа LLM (потоковая выдача),
+        ctx - контекст запроса, в который записываются режим ответа и статистика
+        """
+        ctx = ctx or BakaiRequestContext(query)
         
-        # Фильтруем стоп-слова
-        keywords = [word for word in words if word not in stop_words and len(word) > 2]
+        try:
+            answer_mode = self._start_answer(documents, search_type, ctx)
+            if answer_mode != 'generate':
+                return self._answer_without_llm(query, documents, answer_mode, ctx)
+            
+            # Во всех остальных случаях - генерируем ответ на основе найденных данных
+            print("🤖 Нет точного совпадения - генерируем ответ на основе найденных данных")
+            with ctx.stage('generation'):
+                return self._generate_contextual_answer(query, documents, on_token, ctx)
+            
+        except Exception as e:
+            print(f"❌ Ошибка генерации ответа: {e}")
+            ctx.fail('generation')
+            return "Произошла техническая ошибка при формировании ответа. Обратитесь к консультанту."
+    
+    async def agenerate_answer(self, query: str, documents: List[Document], search_type: str = None,
+                               ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Асинхронная генерация ответа (LLM через асинхронный HTTP-клиент Ollama)"""
+        ctx = ctx or BakaiRequestContext(query)
         
-        # Добавляем специальные комбинации
-        special_combinations = {
-            'сейфовых ячеек': ['сейфов', 'ячеек', 'сейфовых', 'депозитных'],
-            'депозитных ячеек': ['депозитных', 'ячеек', 'сейфовых'],
-            'банковских ячеек': ['банковских', 'ячеек', 'сейфовых']
-        }
+        try:
+            answer_mode = self._start_answer(documents, search_type, ctx)
+            if answer_mode != 'generate':
+                return self._answer_without_llm(query, documents, answer_mode, ctx)
+            
+            print("🤖 Нет точного совпадения - генерируем ответ на основе найденных данных")
+            with ctx.stage('generation'):
+                return await self._agenerate_contextual_answer(query, documents, ctx)
+            
+        except Exception as e:
+            print(f"❌ Ошибка генерации ответа: {e}")
+            ctx.fail('generation')
+            return "Произошла техническая ошибка при формировании ответа. Обратитесь к консультанту."
+    
+    def _start_answer(self, documents: List[Document], search_type: Optional[str],
+                      ctx: BakaiRequestContext) -> str:
+        """Выбор способа ответа с записью в контекст запроса"""
+        if not documents:
+            return 'no_documents'
         
-        query_text = query.lower()
-        for phrase, related_words in special_combinations.items():
-            if any(word in query_text for word in phrase.split()):
-                keywords.extend(related_words)
+        # Тип поиска: явный, из контекста или по уровню поиска первого документа
+        if search_type is None:
+            search_type = ctx.search_type or self._infer_search_type(documents)
         
-        return list(set(keywords))  # Убираем дубликаты
+        ctx.answer_mode = self._plan_answer(documents, search_type)
+        return ctx.answer_mode
     
-    def _generate_query_variants(self, query: str) -> List[str]:
-        """Генерация вариантов запроса с улучшенными синонимами"""
-        variants = [query, query.lower()]
-        
-        # Убираем номера вопросов
-        clean_query = re.sub(r'^\d+\.\s*', '', query.strip())
-        variants.append(clean_query)
-        variants.append(clean_query.lower())
-        
-        # Расширенные синонимы
-        replacements = {
-            'сейфовых ячеек': ['депозитных ячеек', 'банковских ячеек', 'сейфов', 'ячеек для хранения'],
-            'аренды': ['аренда', 'прокат', 'предоставление', 'услуг'],
-            'предоставляет': ['предлагает', 'есть', 'имеет', 'оказывает'],
-            'услуги': ['сервис', 'предложения', 'возможности'],
-            'перевести': ['отправить', 'переслать', 'сделать перевод'],
-            'карту': ['карточку', 'пластик'],
-            'SWIFT': ['свифт', 'swift перевод', 'международный перевод'],
-            'как': ['способ', 'каким образом'],
-            'где': ['адрес', 'местоположение'],
-            'документы': ['справки', 'бумаги', 'требования'],
-            'лимиты': ['ограничения', 'пределы', 'максимум'],
-            'валютные': ['валютных', 'обменных', 'currency']
-        }
-        
-        query_lower = query.lower()
-        for original, alternatives in replacements.items():
-            if original in query_lower:
-                for alt in alternatives:
-                    new_variant = query_lower.replace(original, alt)
-                    variants.append(new_variant)
+    def _infer_search_type(self, documents: List[Document]) -> str:
+        """Тип поиска по метаданным найденных документов"""
+        top_tier = (documents[0].metadata or {}).get('retrieval_tier')
+        return 'exact_match' if top_tier in ('faq_exact', 'faq_semantic') else 'no_exact_match'
+    
+    def _answer_without_llm(self, query: str, documents: List[Document], answer_mode: str,
+                            ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Ответ без обращения к LLM"""
+        if answer_mode == 'no_documents':
+            return "К сожалению, не найдено информации по вашему запросу. Обратитесь в офис банка для получения точной информации."
         
-        # Добавляем простые ключевые слова
-        if 'сейф' in query_lower:
-            variants.extend([
-                'сейфовые ячейки',
-                'банковские ячейки',
-                'индивидуальные сейфовые ячейки',
-                'хранение ценностей'
-            ])
+        # Если найдено точное или уверенное совпадение - прямой ответ БЕЗ генерации
+        if answer_mode == 'direct':
+            print("✅ Точное совпадение - возвращаем прямой ответ БЕЗ генерации")
+            return self._extract_direct_answer(documents[0])
         
-        return list(dict.fromkeys(variants))[:8]  # Уникальные варианты
+        # Уверенные результаты поиска - собираем ответ из найденных данных
+        print("📋 Уверенный результат поиска - собираем ответ БЕЗ генерации")
+        return self._build_extractive_answer(query, documents, ctx)
     
-    def generate_answer(self, query: str, documents: List[Document], search_type: str = None) -> str:
-        """Генерация ответа: прямой ответ при точном совпадении, генерация - при отсутствии"""
+    def _plan_answer(self, documents: List[Document], search_type: str) -> str:
+        """Выбор способа ответа по уверенности поиска: direct / extractive / generate"""
+        if search_type == 'exact_match':
+            return 'direct'
         
-        # Если search_type не передан, используем сохраненный тип
-        if search_type is None:
-            search_type = getattr(self, '_last_search_type', 'no_exact_match')
+        if not RAG_CONFIG.get("answer_planner_enabled", True):
+            return 'generate'
         
-        try:
-            if not documents:
-                return "К сожалению, не найдено информации по вашему запросу. Обратитесь в офис банка для получения точной информации."
-            
-            # Если найдено точное совпадение - возвращаем прямой ответ БЕЗ генерации
-            if search_type == 'exact_match':
-                print("✅ Точное совпадение - возвращаем прямой ответ БЕЗ генерации")
-                return self._extract_direct_answer(documents[0])
+        top_metadata = documents[0].metadata or {}
+        top_tier = top_metadata.get('retrieval_tier')
+        top_score = top_metadata.get('retrieval_score', 0.0)
+        
+        # Очень похожий FAQ - отвечаем им напрямую
+        if top_tier == 'faq_similar' and top_score >= RAG_CONFIG.get("direct_answer_threshold", 0.85):
+            print(f"🧮 План ответа: direct (сходство FAQ {top_score:.2f})")
+            return 'direct'
+        
+        # Несколько достаточно похожих FAQ - собираем их ответы
+        extractive_threshold = RAG_CONFIG.get("extractive_answer_threshold", 0.75)
+        if top_tier == 'faq_similar' and top_score >= extractive_threshold:
+            print(f"🧮 План ответа: extractive (сходство FAQ {top_score:.2f})")
+            return 'extractive'
+        
+        # Подавляющее совпадение по ключевым словам
+        if top_tier == 'keyword' and top_score >= RAG_CONFIG.get("keyword_dominance_coverage", 0.8):
+            keyword_scores = [
+                doc.metadata.get('retrieval_score', 0.0) for doc in documents[1:]
+                if doc.metadata and doc.metadata.get('retrieval_tier') == 'keyword'
+            ]
+            runner_up = max(keyword_scores, default=0.0)
+            if top_score >= runner_up * RAG_CONFIG.get("keyword_dominance_ratio", 2.0):
+                print(f"🧮 План ответа: extractive (ключевые слова {top_score:.2f} vs {runner_up:.2f})")
+                return 'extractive'
+        
+        print("🧮 План ответа: generate")
+        return 'generate'
+    
+    def _build_extractive_answer(self, query: str, documents: List[Document],
+                                 ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Извлекающий ответ: лучшие FAQ-ответы или релевантные предложения без LLM"""
+        max_answers = RAG_CONFIG.get("extractive_max_answers", 2)
+        threshold = RAG_CONFIG.get("extractive_answer_threshold", 0.75)
+        stems = {word[:5] for word in self._query_analysis(query, ctx).keywords}
+        
+        parts = []
+        for index, doc in enumerate(documents):
+            metadata = doc.metadata or {}
+            # Первый документ берем всегда, остальные - только уверенные FAQ
+            if index > 0 and not (metadata.get('retrieval_tier') == 'faq_similar'
+                                  and metadata.get('retrieval_score', 0.0) >= threshold):
+                continue
             
-            # Во всех остальных случаях - генерируем ответ на основе найденных данных
+            faq_match = re.search(r'FAQ:\s*(.+?)\?\s*\n?Ответ:\s*(.+)', doc.page_content, re.DOTALL)
+            if faq_match:
+                part = faq_match.group(2).strip()
             else:
-                print("🤖 Нет точного совпадения - генерируем ответ на основе найденных данных")
-                return self._generate_contextual_answer(query, documents)
+                sentences = [
+                    sentence for sentence in self._split_sentences(doc.page_content)
+                    if any(stem in sentence.lower() for stem in stems)
+                ]
+                part = ' '.join(sentences[:2]) or doc.page_content.strip()
             
-        except Exception as e:
-            print(f"❌ Ошибка генерации ответа: {e}")
-            return "Произошла техническая ошибка при формировании ответа. Обратитесь к консультанту."
+            if part and part not in parts:
+                parts.append(part)
+            if len(parts) >= max_answers:
+                break
+        
+        answer = ' '.join(parts)
+        print(f"📋 Извлекающий ответ из {len(parts)} фрагментов: {answer[:50]}...")
+        return answer
     
     def _extract_direct_answer(self, document: Document) -> str:
         """Извлечение прямого ответа из FAQ БЕЗ генерации"""
@@ -438,81 +1044,515 @@ class BakaiRAG:
         # Если нет FAQ структуры, возвращаем весь контент
         return content.strip()
     
-    def _generate_contextual_answer(self, query: str, documents: List[Document]) -> str:
+    def _generate_contextual_answer(self, query: str, documents: List[Document],
+                                    on_token: Optional[Callable[[str], None]] = None,
+                                    ctx: Optional[BakaiRequestContext] = None) -> str:
         """Генерация контекстуального ответа для векторного поиска"""
-        
-        # Определяем тип запроса
-        query_type = self._analyze_query_type(query)
-        
-        # Создаем контекст
-        context = self._build_context(documents)
-        
-        # Создаем промпт
-        prompt = self._create_contextual_prompt(context, query, query_type)
-        
-        print(f"🤖 Генерация контекстуального ответа для типа: {query_type}")
+        plan = self._prepare_generation(query, documents, ctx or BakaiRequestContext(query))
         
         try:
-            response = self.llm.invoke(prompt)
-            answer = response.content.strip()
+            with self._generation_slot(plan['ctx']):
+                start_time = time.perf_counter()
+                answer = self._stream_on_route(plan, on_token)
+                self._finish_generation(plan, time.perf_counter() - start_time)
+            
+            if plan['ctx'].generation_stats.get('stop_reason') == 'deadline':
+                return self._deadline_answer(query, documents, plan, answer)
             
             # Минимальная очистка
             return self._clean_answer(answer)
             
         except Exception as e:
+            if isinstance(e, TimeoutError) or plan['ctx'].stage_expired('generation'):
+                return self._deadline_fallback(query, documents, plan['ctx'])
             print(f"❌ Ошибка генерации: {e}")
+            plan['ctx'].fail('generation')
             return "Не удалось сформировать ответ. Обратитесь к консультанту."
     
+    async def _agenerate_contextual_answer(self, query: str, documents: List[Document],
+                                           ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Асинхронная генерация контекстуального ответа"""
+        plan = self._prepare_generation(query, documents, ctx or BakaiRequestContext(query))
+        
+        try:
+            # Ожидание слота и каждого фрагмента ограничены бюджетом генерации
+            answer = await self._agenerate_in_slot(plan)
+            if plan['ctx'].generation_stats.get('stop_reason') == 'deadline':
+                return self._deadline_answer(query, documents, plan, answer)
+            return self._clean_answer(answer)
+            
+        except Exception as e:
+            if isinstance(e, (TimeoutError, asyncio.TimeoutError)) or plan['ctx'].stage_expired('generation'):
+                return self._deadline_fallback(query, documents, plan['ctx'])
+            print(f"❌ Ошибка генерации: {e}")
+            plan['ctx'].fail('generation')
+            return "Не удалось сформировать ответ. Обратитесь к консультанту."
+    
+    def _generation_slot(self, ctx: BakaiRequestContext):
+        """Слот генерации Ollama (без планировщика - без ограничений)"""
+        if self.generation_limiter is None:
+            return contextlib.nullcontext()
+        return self.generation_limiter.slot(ctx.priority, ctx.stage_remaining('generation'))
+    
+    def _ageneration_slot(self, ctx: BakaiRequestContext):
+        """Асинхронный слот генерации Ollama"""
+        if self.generation_limiter is None:
+            return contextlib.nullcontext()
+        return self.generation_limiter.aslot(ctx.priority, ctx.stage_remaining('generation'))
+    
+    def _deadline_answer(self, query: str, documents: List[Document], plan: Dict, answer: str) -> str:
+        """Срок генерации истек посреди потока
+        
+        Отправленное клиенту не заменяется другим ответом: частичный ответ обрезается
+        до последней законченной фразы. Без отправленного текста и законченных фраз -
+        ответ без LLM
+        """
+        ctx = plan['ctx']
+        partial = self._trim_to_sentence(answer)
+        if not ctx.generation_stats.get('streamed') and not partial:
+            return self._deadline_fallback(query, documents, ctx)
+        
+        ctx.degrade('generation')
+        ctx.generation_stats['partial'] = True
+        return self._clean_answer(partial or answer)
+    
+    @staticmethod
+    def _trim_to_sentence(answer: str) -> str:
+        """Текст до конца последней законченной фразы ('' - законченных фраз нет)"""
+        match = re.match(r'.*[.!?](?=\s|$)', answer, re.S)
+        return match.group(0).strip() if match else ''
+    
+    def _deadline_fallback(self, query: str, documents: List[Document], ctx: BakaiRequestContext) -> str:
+        """Генерация не уложилась в срок: ответ из лучшего FAQ / найденных документов"""
+        ctx.degrade('generation')
+        ctx.answer_mode = 'extractive'
+        ctx.generation_stats['stop_reason'] = 'deadline'
+        return self._build_extractive_answer(query, documents, ctx)
+    
+    async def _agenerate_in_slot(self, plan: Dict) -> str:
+        """Асинхронная генерация в слоте Ollama"""
+        async with self._ageneration_slot(plan['ctx']):
+            start_time = time.perf_counter()
+            answer = await self._astream_on_route(plan)
+            self._finish_generation(plan, time.perf_counter() - start_time)
+        return answer
+    
+    def _stream_on_route(self, plan: Dict, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Генерация на модели маршрута; сбой малой модели до первого фрагмента - повтор на основной"""
+        emitted = []
+        
+        def emit(token: str) -> None:
+            emitted.append(token)
+            on_token(token)
+        
+        try:
+            return self._stream_answer(self._plan_llm(plan), plan, emit if on_token else None)
+        except Exception as e:
+            if emitted or not self._can_fall_back(plan, e):
+                raise
+            return self._stream_answer(self._fall_back_to_large(plan, e), plan, on_token)
+    
+    async def _astream_on_route(self, plan: Dict) -> str:
+        """Асинхронная генерация на модели маршрута с повтором на основной модели"""
+        try:
+            return await self._astream_answer(self._plan_llm(plan), plan)
+        except Exception as e:
+            if not self._can_fall_back(plan, e):
+                raise
+            return await self._astream_answer(self._fall_back_to_large(plan, e), plan)
+    
+    def _can_fall_back(self, plan: Dict, error: Exception) -> bool:
+        """Ошибка малой модели (не срок генерации) - можно повторить на основной"""
+        return (plan['route'] == 'small' and
+                not isinstance(error, (TimeoutError, asyncio.TimeoutError)) and
+                not plan['ctx'].stage_expired('generation'))
+    
+    def _fall_back_to_large(self, plan: Dict, error: Exception) -> ChatOllama:
+        """Малая модель недоступна: ответ основной, маршрут 'small' отключается на время"""
+        retry_after = RAG_CONFIG.get("small_model_retry_after", 300)
+        self._small_model_retry_at = time.monotonic() + retry_after
+        self.stats.increment('small_model_fallbacks')
+        print(f"⚠️ Малая модель недоступна ({error}) - ответ основной моделью, "
+              f"малая отключена на {retry_after} с")
+        plan['route'] = 'large'
+        return self._plan_llm(plan)
+    
+    def _prepare_generation(self, query: str, documents: List[Document], ctx: BakaiRequestContext) -> Dict:
+        """Подготовка генерации: контекст, сообщения, профиль и маршрут модели"""
+        
+        # Определяем тип запроса
+        query_type = self._query_analysis(query, ctx).query_type
+        
+        # Создаем контекст (со сжатием под бюджет токенов)
+        context = self._build_context(documents, query, ctx)
+        
+        # Создаем сообщения: стабильный системный префикс + контекст и вопрос
+        messages, ctx.prompt_stats = self.prompt_builder.build(context, query)
+        
+        print(f"🤖 Генерация контекстуального ответа для типа: {query_type} "
+              f"(промпт ~{ctx.prompt_stats['total_tokens']} токенов)")
+        
+        # Длина, температура и стоп-последовательности по типу запроса
+        return {
+            'ctx': ctx,
+            'query_type': query_type,
+            'messages': messages,
+            'profile': self._generation_profile(query_type),
+            'facts': self._top_document_facts(documents, context),
+            'route': self._route_model(query, query_type, documents, ctx)
+        }
+    
+    def _finish_generation(self, plan: Dict, elapsed: float) -> None:
+        """Учет завершенной генерации"""
+        self.stats.observe('model_routes', plan['route'], elapsed)
+        plan['ctx'].generation_stats['query_type'] = plan['query_type']
+        plan['ctx'].generation_stats['model_route'] = plan['route']
+    
+    def _generation_profile(self, query_type: str) -> Dict:
+        """Параметры генерации для типа запроса"""
+        profiles = RAG_CONFIG.get("generation_profiles", {})
+        profile = profiles.get(query_type) or profiles.get('общий') or {}
+        return {
+            'num_predict': profile.get('num_predict', RAG_CONFIG["max_tokens"]),
+            'temperature': profile.get('temperature', RAG_CONFIG["temperature"]),
+            'stop': profile.get('stop') or None
+        }
+    
+    def _top_document_facts(self, documents: List[Document], context: str) -> List[str]:
+        """Факты лучшего документа, попавшие в контекст: их покрытие завершает генерацию"""
+        if not documents:
+            return []
+        return [fact for fact in self._extract_facts(documents[0].page_content)
+                if self._mentions_fact(context, fact)]
+    
+    def _extract_facts(self, context: str) -> List[str]:
+        """Числовые факты контекста (суммы, проценты, телефоны, сроки)
+        
+        Короткие числа ("3", "5") встречаются в любом ответе и фактами не считаются
+        """
+        text = re.sub(r'Документ \d+:', '', context)
+        min_digits = RAG_CONFIG.get("early_stop_min_fact_digits", 2)
+        facts = re.findall(r'(?<![\d.,])\d+(?:[.,]\d+)?(?:\s?%)?', text)
+        return list(dict.fromkeys(
+            fact.strip() for fact in facts if sum(char.isdigit() for char in fact) >= min_digits
+        ))
+    
+    @staticmethod
+    def _mentions_fact(text: str, fact: str) -> bool:
+        """Факт есть в тексте отдельным числом (30 не совпадает с 300 и 1,300)"""
+        number = re.sub(r'[.,]', '[.,]', fact.replace('%', '').strip())
+        percent = r'\s?%' if fact.endswith('%') else ''
+        return re.search(rf'(?<!\d)(?<!\d[.,]){number}{percent}(?![.,]?\d)', text) is not None
+    
+    def _route_model(self, query: str, query_type: str, documents: List[Document],
+                     ctx: BakaiRequestContext) -> str:
+        """Выбор модели: малая для коротких фактических вопросов, основная для синтеза"""
+        routing = RAG_CONFIG.get("model_routing", "auto")
+        if routing == 'large' or not RAG_CONFIG.get("small_llm_model"):
+            return 'large'
+        if time.monotonic() < self._small_model_retry_at:
+            return 'large'
+        if routing == 'small':
+            return routing
+        
+        top_metadata = (documents[0].metadata or {}) if documents else {}
+        features = {
+            'query_type': query_type,
+            'query_words': len(query.split()),
+            'documents': self._relevant_document_count(documents),
+            'context_tokens': ctx.prompt_stats.get('context_tokens', 0),
+            'confidence': max(top_metadata.get('retrieval_score', 0.0), 0.0)
+        }
+        
+        is_simple = (
+            features['query_type'] in RAG_CONFIG.get("routing_small_query_types", []) and
+            features['query_words'] <= RAG_CONFIG.get("routing_small_max_query_words", 12) and
+            features['documents'] <= RAG_CONFIG.get("routing_small_max_documents", 1) and
+            features['context_tokens'] <= RAG_CONFIG.get("routing_small_max_context_tokens", 350) and
+            features['confidence'] >= RAG_CONFIG.get("routing_small_min_confidence", 0.5)
+        )
+        route = 'small' if is_simple else 'large'
+        print(f"🧭 Маршрут модели: {route} {features}")
+        return route
+    
+    def _relevant_document_count(self, documents: List[Document]) -> int:
+        """Документы с оценкой поиска, сопоставимой с лучшей: источники ответа, а не фон контекста"""
+        scores = [max((doc.metadata or {}).get('retrieval_score', 0.0), 0.0) for doc in documents]
+        top_score = max(scores, default=0.0)
+        if top_score <= 0:
+            return len(documents)
+        ratio = RAG_CONFIG.get("routing_relevant_score_ratio", 0.9)
+        return sum(1 for score in scores if score >= top_score * ratio)
+    
+    def get_routing_stats(self) -> Dict[str, Dict[str, float]]:
+        """Статистика задержек генерации по маршрутам моделей"""
+        return self.stats.latency_snapshot('model_routes')
+    
+    def get_faq_partition_stats(self) -> Dict[str, Any]:
+        """Использование разделов FAQ: сколько кандидатов сравнивалось от полного набора"""
+        stats = self.stats.snapshot()
+        full = stats['faq_candidates_full']
+        return {
+            'partitions_used': stats['faq_partitions'],
+            'candidates': stats['faq_candidates'],
+            'candidates_without_partitions': full,
+            'candidate_ratio': round(stats['faq_candidates'] / full, 3) if full else 1.0
+        }
+    
+    def get_retrieval_planner_stats(self) -> Dict[str, Any]:
+        """Статистика планировщика поиска: решения и попадания уровней"""
+        return self.retrieval_planner.get_stats()
+    
+    def get_scheduler_stats(self) -> Dict[str, Dict]:
+        """Статистика планировщика: пакеты эмбеддингов и очередь генераций"""
+        stats = {}
+        if isinstance(self.embeddings, BakaiEmbeddingBatcher):
+            stats['embeddings'] = self.embeddings.get_stats()
+        if self.generation_limiter is not None:
+            stats['generation'] = self.generation_limiter.get_stats()
+        return stats
+    
+    def _stream_kwargs(self, plan: Dict) -> Dict:
+        """Параметры потоковой генерации из профиля"""
+        profile = plan['profile']
+        return {
+            'stop': profile['stop'],
+            'num_predict': profile['num_predict'],
+            'temperature': profile['temperature']
+        }
+    
+    def _early_stop_reason(self, answer: str, facts: List[str]) -> Optional[str]:
+        """Причина ранней остановки генерации или None"""
+        if not RAG_CONFIG.get("early_stop_enabled", True):
+            return None
+        # Проверяем только на границе предложения
+        if not answer.rstrip().endswith(('.', '!', '?')):
+            return None
+        
+        # Слишком много фактов (списки адресов) - покрытие не проверяем, длину ограничивает num_predict
+        if facts and len(facts) <= RAG_CONFIG.get("early_stop_max_facts", 6):
+            if all(self._mentions_fact(answer, fact) for fact in facts):
+                return 'facts_covered'
+        
+        return None
+    
+    def _stream_answer(self, llm: ChatOllama, plan: Dict,
+                       on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Потоковая генерация с ранней остановкой по границе предложения"""
+        answer = ""
+        streamed = False
+        stop_reason = 'completed'
+        try:
+            for chunk in self._iter_stream(llm, plan):
+                answer += chunk.content
+                if on_token and chunk.content:
+                    on_token(chunk.content)
+                    streamed = True
+                
+                reason = self._early_stop_reason(answer, plan['facts'])
+                if reason:
+                    stop_reason = reason
+                    break
+        except TimeoutError:
+            stop_reason = 'deadline'
+        
+        return self._finish_stream(plan, answer, stop_reason, streamed)
+    
+    def _iter_stream(self, llm: ChatOllama, plan: Dict):
+        """Фрагменты потока модели; ожидание каждого ограничено сроком генерации
+        
+        Поток Ollama читается в отдельном потоке, чтобы зависший ответ не держал запрос
+        до HTTP-таймаута. По истечении срока - TimeoutError; чтение прекращается
+        на следующем фрагменте
+        """
+        ctx = plan['ctx']
+        if ctx.stage_remaining('generation') is None:
+            yield from llm.stream(plan['messages'], **self._stream_kwargs(plan))
+            return
+        
+        chunks = queue.Queue()
+        stopped = threading.Event()
+        
+        def read() -> None:
+            try:
+                for chunk in llm.stream(plan['messages'], **self._stream_kwargs(plan)):
+                    if stopped.is_set():
+                        break
+                    chunks.put(('chunk', chunk))
+                chunks.put(('end', None))
+            except Exception as e:
+                chunks.put(('error', e))
+        
+        threading.Thread(target=read, name="bakai-stream", daemon=True).start()
+        try:
+            while True:
+                remaining = ctx.stage_remaining('generation')
+                if remaining <= 0:
+                    raise TimeoutError("срок генерации истек")
+                try:
+                    kind, value = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError("срок генерации истек")
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    raise value
+                yield value
+        finally:
+            stopped.set()
+    
+    async def _astream_answer(self, llm: ChatOllama, plan: Dict) -> str:
+        """Асинхронная потоковая генерация с ранней остановкой и сроком на каждый фрагмент"""
+        answer = ""
+        stop_reason = 'completed'
+        stream = llm.astream(plan['messages'], **self._stream_kwargs(plan))
+        try:
+            while True:
+                remaining = plan['ctx'].stage_remaining('generation')
+                if remaining is not None and remaining <= 0:
+                    stop_reason = 'deadline'
+                    break
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                except (TimeoutError, asyncio.TimeoutError):
+                    stop_reason = 'deadline'
+                    break
+                answer += chunk.content
+                
+                reason = self._early_stop_reason(answer, plan['facts'])
+                if reason:
+                    stop_reason = reason
+                    break
+        finally:
+            await stream.aclose()
+        
+        return self._finish_stream(plan, answer, stop_reason)
+    
+    def _finish_stream(self, plan: Dict, answer: str, stop_reason: str, streamed: bool = False) -> str:
+        """Статистика потоковой генерации"""
+        plan['ctx'].generation_stats = {
+            'num_predict': plan['profile']['num_predict'],
+            'answer_chars': len(answer),
+            'stop_reason': stop_reason,
+            'streamed': streamed
+        }
+        if stop_reason != 'completed':
+            print(f"⏹️ Ранняя остановка генерации ({stop_reason}) на {len(answer)} символах")
+        
+        return answer.strip()
+    
     def _analyze_query_type(self, query: str) -> str:
         """Анализ типа запроса"""
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ['как', 'каким образом', 'способ', 'процедура']):
-            return 'инструкция'
-        elif any(word in query_lower for word in ['где', 'адрес', 'находится']):
-            return 'адрес'
-        elif any(word in query_lower for word in ['документы', 'требуются', 'нужны']):
-            return 'документы'
-        elif any(word in query_lower for word in ['лимит', 'ограничение', 'максимум']):
-            return 'лимиты'
-        elif any(word in query_lower for word in ['что такое', 'расскажи']):
-            return 'объяснение'
-        else:
-            return 'общий'
-    
-    def _build_context(self, documents: List[Document]) -> str:
+        return detect_query_type(query.lower())
+    
+
+    def _build_context(self, documents: List[Document], query: str = None,
+                       ctx: Optional[BakaiRequestContext] = None) -> str:
         """Построение контекста из документов"""
+        if query and RAG_CONFIG.get("context_compression_enabled", True):
+            return self._compress_context(query, documents, ctx)
+        
         context_parts = []
         
         for i, doc in enumerate(documents, 1):
             content = doc.page_content.strip()
-            
-            metadata_info = ""
-            if hasattr(doc, 'metadata') and doc.metadata:
-                metadata = doc.metadata
-                if 'type' in metadata:
-                    metadata_info = f"[{metadata['type']}] "
-            
-            context_parts.append(f"Документ {i}: {metadata_info}{content}")
+            context_parts.append(f"Документ {i}: {self._metadata_label(doc)}{content}")
         
         return "\n\n".join(context_parts)
     
-    def _create_contextual_prompt(self, context: str, query: str, query_type: str) -> str:
-        """Создание контекстуального промпта"""
-        return f"""Ты - консультант банка Бакай. Отвечай точно на основе предоставленной информации.
-
-ПРАВИЛА:
-- Используй только информацию из контекста
-- Будь конкретным и точным
-- Отвечай на русском языке
-- Если нет информации, честно скажи об этом
-
-КОНТЕКСТ:
-{context}
-
-ВОПРОС: {query}
-
-ОТВЕТ:"""
+    def _metadata_label(self, doc: Document) -> str:
+        """Метка типа документа для контекста"""
+        if hasattr(doc, 'metadata') and doc.metadata and 'type' in doc.metadata:
+            return f"[{doc.metadata['type']}] "
+        return ""
+    
+    def _split_sentences(self, text: str) -> List[str]:
+        """Разбиение текста на предложения"""
+        parts = re.split(r'(?<=[.!?;])\s+|\n+', text.strip())
+        return [part.strip() for part in parts if part and part.strip()]
+    
+    def _compress_context(self, query: str, documents: List[Document],
+                          ctx: Optional[BakaiRequestContext] = None) -> str:
+        """Сжатие контекста: только релевантные запросу предложения в пределах бюджета
+        
+        Контекст, который и так помещается в бюджет, передается целиком
+        """
+        budget = self.prompt_builder.context_budget()
+        full_context = self._build_context(documents)
+        original_tokens = estimate_tokens(full_context)
+        if original_tokens <= budget:
+            if ctx is not None:
+                ctx.compression_stats = {
+                    'original_tokens': original_tokens,
+                    'compressed_tokens': original_tokens,
+                    'documents_kept': len(documents),
+                    'trimmed_ratio': 0.0
+                }
+            return full_context
+        
+        # Основы ключевых слов запроса (устойчиво к падежным окончаниям)
+        stems = self._query_analysis(query, ctx).stems
+        
+        candidates = []
+        for doc_index, doc in enumerate(documents):
+            sentences = self._split_sentences(doc.page_content)
+            
+            for sent_index, sentence in enumerate(sentences):
+                sentence_lower = sentence.lower()
+                hits = sum(1 for stem in stems if stem in sentence_lower)
+                # Совпадения важнее всего, затем ранг документа и позиция в нем
+                score = hits + 1.0 / (doc_index + 2) + (0.5 if sent_index == 0 else 0.0)
+                candidates.append({
+                    'doc_index': doc_index,
+                    'sent_index': sent_index,
+                    'text': sentence,
+                    'hits': hits,
+                    'score': score,
+                    'tokens': estimate_tokens(sentence)
+                })
+        
+        # Сначала предложения с совпадениями (по убыванию оценки), остаток бюджета -
+        # остальные предложения по рангу документа и позиции в нем
+        hits = sorted((c for c in candidates if c['hits'] > 0), key=lambda c: c['score'], reverse=True)
+        rest = [c for c in candidates if c['hits'] == 0]
+        
+        selected = []
+        used_tokens = 0
+        for candidate in hits + rest:
+            if used_tokens + candidate['tokens'] > budget:
+                continue
+            selected.append(candidate)
+            used_tokens += candidate['tokens']
+        
+        # Восстанавливаем исходный порядок внутри документов
+        selected.sort(key=lambda c: (c['doc_index'], c['sent_index']))
+        context_parts = []
+        for doc_index, doc in enumerate(documents):
+            kept = [c['text'] for c in selected if c['doc_index'] == doc_index]
+            if kept:
+                context_parts.append(
+                    f"Документ {len(context_parts) + 1}: {self._metadata_label(doc)}{' '.join(kept)}"
+                )
+        
+        context = "\n\n".join(context_parts)
+        compressed_tokens = estimate_tokens(context)
+        
+        stats = {
+            'original_tokens': original_tokens,
+            'compressed_tokens': compressed_tokens,
+            'sentences_total': len(candidates),
+            'sentences_kept': len(selected),
+            'documents_kept': len(context_parts),
+            'trimmed_ratio': round(1 - compressed_tokens / original_tokens, 3) if original_tokens else 0.0
+        }
+        if ctx is not None:
+            ctx.compression_stats = stats
+        print(f"✂️ Контекст сжат: {original_tokens} → {compressed_tokens} токенов "
+              f"({len(selected)}/{len(candidates)} предложений)")
+        
+        return context
     
     def _clean_answer(self, answer: str) -> str:
         """Очистка ответа"""
@@ -541,6 +1581,10 @@ class BakaiRAG:
             return {
                 'total_documents': len(documents),
                 'faq_count': len(self.faq_database),
+                'faq_embedded_questions': len(self.faq_question_keys),
+                'faq_semantic_threshold': self.faq_semantic_threshold,
+                'faq_partitions': {service_type: len(keys) for service_type, keys in self.faq_partitions.items()},
+                'faq_partition_usage': self.get_faq_partition_stats(),
                 'database_ready': len(documents) > 0
             }
         except Exception as e:
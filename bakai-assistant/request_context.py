@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+request_context.py
+Контекст одного запроса и потокобезопасные счетчики статистики
+"""
+
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from config import DEADLINE_CONFIG
+
+
+class BakaiRequestContext:
+    """Состояние одного запроса: передается через поиск, генерацию, улучшение и TTS"""
+
+    def __init__(self, query: str, priority: Optional[int] = None, deadline: Optional[float] = None,
+                 stage_budgets: Optional[Dict[str, float]] = None):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.priority = priority  # Приоритет в очереди генерации (None - по умолчанию)
+
+        # Поиск
+        self.analysis = None  # QueryAnalysis - общий для всех этапов разбор запроса
+        self.search_type: Optional[str] = None
+        self.retrieved_ids: List[str] = []
+        self.retrieval_plan: Dict[str, Any] = {}
+
+        # Генерация
+        self.answer_mode: Optional[str] = None
+        self.compression_stats: Dict[str, Any] = {}
+        self.prompt_stats: Dict[str, Any] = {}
+        self.generation_stats: Dict[str, Any] = {}
+
+        # Улучшение и озвучивание
+        self.service_type: Optional[str] = None
+        self.service_confidence = 0.0
+        self.voice: Optional[str] = None
+        self.audio_file: Optional[str] = None
+        self.audio_job_id: Optional[str] = None
+        self.audio_job = None  # Future фонового озвучивания ответа
+
+        # Запрос, результат которого получен через объединение одинаковых запросов
+        self.shared_from: Optional[str] = None
+
+        self.timings: Dict[str, float] = {}
+        self._started_at = time.perf_counter()
+        
+        # Сроки: общий (секунд от начала запроса) и бюджеты этапов ({} - без бюджетов этапов)
+        if deadline is None and DEADLINE_CONFIG.get("enabled", False):
+            deadline = DEADLINE_CONFIG.get("total")
+        self.deadline = deadline
+        if stage_budgets is None:
+            stage_budgets = DEADLINE_CONFIG.get("stage_budgets", {}) if DEADLINE_CONFIG.get("enabled", False) else {}
+        self.stage_budgets: Dict[str, float] = dict(stage_budgets)
+        self.degraded_stages: List[str] = []
+        self.failed_stages: List[str] = []  # Этапы, завершившиеся ошибкой (ответ - текст-заглушка)
+        self._stage_started: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замер времени этапа обработки"""
+        start_time = time.perf_counter()
+        self._stage_started.setdefault(name, start_time)
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.timings[name] = round(self.timings.get(name, 0.0) + elapsed, 4)
+
+    def stage_remaining(self, name: str) -> Optional[float]:
+        """Остаток времени этапа с учетом общего срока (None - без ограничений)"""
+        now = time.perf_counter()
+        limits = []
+        if self.deadline is not None:
+            limits.append(self.deadline - (now - self._started_at))
+        if name in self.stage_budgets:
+            started = self._stage_started.get(name, now)
+            limits.append(self.stage_budgets[name] - (now - started))
+        return max(min(limits), 0.0) if limits else None
+
+    def stage_expired(self, name: str) -> bool:
+        """Этап исчерпал свой бюджет или общий срок запроса"""
+        remaining = self.stage_remaining(name)
+        return remaining is not None and remaining <= 0
+
+    def degrade(self, name: str) -> None:
+        """Отметка этапа, выполненного в упрощенном виде из-за нехватки времени"""
+        if name not in self.degraded_stages:
+            self.degraded_stages.append(name)
+            print(f"⏱️ Этап '{name}' не уложился в срок - упрощенный режим")
+
+    def fail(self, name: str) -> None:
+        """Отметка этапа, завершившегося ошибкой: результат запроса не годится для хранения"""
+        if name not in self.failed_stages:
+            self.failed_stages.append(name)
+
+    def adopt(self, other: "BakaiRequestContext") -> None:
+        """Перенос общих результатов поиска и генерации из контекста другого запроса"""
+        self.search_type = other.search_type
+        self.retrieved_ids = list(other.retrieved_ids)
+        self.retrieval_plan = dict(other.retrieval_plan)
+        self.answer_mode = other.answer_mode
+        self.compression_stats = dict(other.compression_stats)
+        self.prompt_stats = dict(other.prompt_stats)
+        self.generation_stats = dict(other.generation_stats)
+        self.service_type = other.service_type
+        self.service_confidence = other.service_confidence
+        self.degraded_stages = list(other.degraded_stages)
+        self.failed_stages = list(other.failed_stages)
+        self.shared_from = other.request_id
+
+    def elapsed(self) -> float:
+        """Время с начала обработки запроса"""
+        return time.perf_counter() - self._started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Сводка контекста для результата и логов"""
+        return {
+            "request_id": self.request_id,
+            "search_type": self.search_type,
+            "retrieved_ids": list(self.retrieved_ids),
+            "retrieval_plan": dict(self.retrieval_plan),
+            "answer_mode": self.answer_mode,
+            "service_type": self.service_type,
+            "voice": self.voice,
+            "audio_job_id": self.audio_job_id,
+            "shared_from": self.shared_from,
+            "degraded_stages": list(self.degraded_stages),
+            "failed_stages": list(self.failed_stages),
+            "timings": dict(self.timings, total=round(self.elapsed(), 4))
+        }
+
+
+class BakaiStats:
+    """Потокобезопасные счетчики: простые, сгруппированные и задержки"""
+
+    def __init__(self, counters: List[str] = None, groups: List[str] = None):
+        self._lock = threading.Lock()
+        self._counter_names = list(counters or [])
+        self._group_names = list(groups or [])
+        self.reset()
+
+    def reset(self) -> None:
+        """Сброс всех счетчиков"""
+        with self._lock:
+            self._counters = {name: 0 for name in self._counter_names}
+            self._groups = {name: {} for name in self._group_names}
+            self._latencies = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Увеличение простого счетчика"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def increment_in(self, group: str, key: str, amount: int = 1) -> None:
+        """Увеличение счетчика внутри группы (например, по типам услуг)"""
+        with self._lock:
+            counts = self._groups.setdefault(group, {})
+            counts[key] = counts.get(key, 0) + amount
+
+    def observe(self, group: str, key: str, seconds: float) -> None:
+        """Учет задержки операции"""
+        with self._lock:
+            stats = self._latencies.setdefault(group, {}).setdefault(
+                key, {'requests': 0, 'total_time': 0.0, 'max_time': 0.0}
+            )
+            stats['requests'] += 1
+            stats['total_time'] += seconds
+            stats['max_time'] = max(stats['max_time'], seconds)
+
+    def latency_snapshot(self, group: str) -> Dict[str, Dict[str, float]]:
+        """Сводка задержек группы: количество, среднее и максимум"""
+        with self._lock:
+            return {
+                key: {
+                    'requests': stats['requests'],
+                    'avg_time': round(stats['total_time'] / stats['requests'], 3) if stats['requests'] else 0.0,
+                    'max_time': round(stats['max_time'], 3)
+                }
+                for key, stats in self._latencies.get(group, {}).items()
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Копия счетчиков и групп"""
+        with self._lock:
+            result = dict(self._counters)
+            result.update({name: dict(counts) for name, counts in self._groups.items()})
+            return result
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+retrieval_planner.py
+Выбор уровней поиска по признакам запроса и накопленной статистике попаданий и времени уровней
+"""
+
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+from config import RAG_CONFIG
+from query_analysis import QueryAnalysis
+
+# Уровни поиска после промаха точного FAQ; векторный - запасной и не отключается
+PLANNED_TIERS = ['semantic', 'similar', 'keyword', 'vector']
+
+# Нижняя граница среднего времени уровня: мгновенные уровни не дают бесконечной выгоды
+MIN_TIER_TIME = 0.001
+
+
+class BakaiRetrievalPlanner:
+    """Планировщик поиска: какие уровни запускать, в каком режиме и сколько вариантов запроса
+
+    Статистика ведется по корзинам признаков (тип услуги, длина, поиск адреса):
+    для каждого уровня - запуски, попадания и время. Решения принимаются по стоимости:
+    ожидаемые попадания на секунду работы уровня и цена задержки против лишней работы.
+    Пока в корзине мало данных, и на каждом N-м запросе для обновления статистики
+    выполняется полный план
+    """
+
+    def __init__(self):
+        self.min_samples = RAG_CONFIG.get("planner_min_samples", 20)
+        self.explore_every = RAG_CONFIG.get("planner_explore_every", 25)
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._buckets: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._decisions = Counter()
+
+    def features(self, analysis: QueryAnalysis, service_type: Optional[str] = None) -> Dict[str, Any]:
+        """Дешевые признаки запроса из его разбора"""
+        words = len(analysis.tokens)
+        return {
+            'service_type': service_type or analysis.service_type or 'general',
+            'length': 'long' if words >= RAG_CONFIG.get("planner_long_query_words", 8) else 'short',
+            'location': analysis.location_intent
+        }
+
+    def bucket(self, features: Dict[str, Any]) -> str:
+        location = 'location' if features['location'] else 'info'
+        return f"{features['service_type']}|{features['length']}|{location}"
+
+    def plan(self, analysis: QueryAnalysis, service_type: Optional[str] = None) -> Dict[str, Any]:
+        """План поиска: уровни, режим (fan_out / staged) и число вариантов векторного запроса"""
+        features = self.features(analysis, service_type)
+        bucket = self.bucket(features)
+        full_plan = {
+            'bucket': bucket,
+            'tiers': list(PLANNED_TIERS),
+            'mode': 'fan_out',
+            'variants': RAG_CONFIG.get("planner_max_variants", 8),
+            'reason': 'full'
+        }
+
+        with self._lock:
+            self._queries += 1
+            explore = self.explore_every and self._queries % self.explore_every == 0
+            stats = {tier: dict(values) for tier, values in self._buckets.get(bucket, {}).items()}
+
+        if not RAG_CONFIG.get("retrieval_planner_enabled", True):
+            return self._record(full_plan)
+        if explore:
+            return self._record({**full_plan, 'reason': 'explore'})
+
+        plan = dict(full_plan, reason='learned')
+        samples = max((values['runs'] for values in stats.values()), default=0)
+        if samples < self.min_samples:
+            return self._record({**full_plan, 'reason': 'warmup'})
+
+        # Уровни, которые в этой корзине редко находят результат или слишком дороги для своей доли
+        # попаданий, пропускаем
+        plan['tiers'] = [
+            tier for tier in PLANNED_TIERS
+            if tier == 'vector' or self._worth_running(stats, tier)
+        ]
+
+        # Ключевые слова обычно находят ответ - векторный поиск только при их промахе,
+        # если сэкономленная работа дороже добавленной задержки
+        if 'keyword' in plan['tiers'] and self._prefer_staged(stats):
+            plan['mode'] = 'staged'
+
+        # Дополнительные варианты запроса редко что-то меняют за время векторного поиска -
+        # ищем только по исходному
+        if not self._worth_running(stats, 'variants', time_tier='vector',
+                                   min_hit_rate=RAG_CONFIG.get("planner_variant_gain_rate", 0.15)):
+            plan['variants'] = 1
+
+        return self._record(plan)
+
+    def _hit_rate(self, stats: Dict[str, Dict[str, float]], tier: str) -> float:
+        """Доля попаданий со сглаживанием (без данных - 0.5)"""
+        tier_stats = stats.get(tier, {})
+        return (tier_stats.get('hits', 0) + 1) / (tier_stats.get('runs', 0) + 2)
+
+    def _avg_time(self, stats: Dict[str, Dict[str, float]], tier: str) -> Optional[float]:
+        """Среднее время уровня (None - уровень еще не запускался)"""
+        tier_stats = stats.get(tier, {})
+        if not tier_stats.get('runs'):
+            return None
+        return max(tier_stats['total_time'] / tier_stats['runs'], MIN_TIER_TIME)
+
+    def _gain_per_second(self, stats: Dict[str, Dict[str, float]], tier: str,
+                         time_tier: Optional[str] = None) -> Optional[float]:
+        """Ожидаемые попадания на секунду работы (time_tier - уровень, чье время тратится)"""
+        avg_time = self._avg_time(stats, time_tier or tier)
+        return None if avg_time is None else self._hit_rate(stats, tier) / avg_time
+
+    def _worth_running(self, stats: Dict[str, Dict[str, float]], tier: str,
+                       time_tier: Optional[str] = None, min_hit_rate: Optional[float] = None) -> bool:
+        """Уровень окупается: достаточно попаданий и попаданий на секунду его работы"""
+        if min_hit_rate is None:
+            min_hit_rate = RAG_CONFIG.get("planner_skip_hit_rate", 0.05)
+        if self._hit_rate(stats, tier) < min_hit_rate:
+            return False
+        gain = self._gain_per_second(stats, tier, time_tier)
+        return gain is None or gain >= RAG_CONFIG.get("planner_min_gain_per_second", 0.2)
+
+    def _prefer_staged(self, stats: Dict[str, Dict[str, float]]) -> bool:
+        """staged выгоднее fan_out по ожидаемой стоимости
+
+        При попадании ключевых слов staged экономит векторный поиск (p * t_vector),
+        при промахе добавляет задержку: векторный поиск начинается после ключевых
+        слов ((1 - p) * min(t_keyword, t_vector)). Секунда задержки стоит
+        planner_latency_weight секунд работы
+        """
+        keyword_time, vector_time = self._avg_time(stats, 'keyword'), self._avg_time(stats, 'vector')
+        if keyword_time is None or vector_time is None:
+            return False
+        hit_rate = self._hit_rate(stats, 'keyword')
+        saved_work = hit_rate * vector_time
+        added_latency = (1 - hit_rate) * min(keyword_time, vector_time)
+        return saved_work > RAG_CONFIG.get("planner_latency_weight", 4.0) * added_latency
+
+    def _record(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        signature = f"{plan['mode']}:{'+'.join(plan['tiers'])}:v{plan['variants']}"
+        with self._lock:
+            self._decisions[signature] += 1
+            self._decisions[f"reason:{plan['reason']}"] += 1
+        print(f"🗺️ План поиска [{plan['bucket']}]: {signature} ({plan['reason']})")
+        return plan
+
+    def observe(self, bucket: str, tier: str, hit: bool, elapsed: float = 0.0) -> None:
+        """Учет результата уровня поиска ('variants' - дали ли варианты запроса новые документы)"""
+        with self._lock:
+            tier_stats = self._buckets.setdefault(bucket, {}).setdefault(
+                tier, {'runs': 0, 'hits': 0, 'total_time': 0.0}
+            )
+            tier_stats['runs'] += 1
+            tier_stats['hits'] += int(hit)
+            tier_stats['total_time'] += elapsed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики планировщика: решения, попадания, время и выгода уровней по корзинам"""
+        with self._lock:
+            buckets = {
+                bucket: {
+                    tier: {
+                        'runs': values['runs'],
+                        'hit_rate': round(values['hits'] / values['runs'], 3) if values['runs'] else 0.0,
+                        'avg_time': round(values['total_time'] / values['runs'], 4) if values['runs'] else 0.0,
+                        'gain_per_second': round(self._gain_per_second(tiers, tier) or 0.0, 3)
+                    }
+                    for tier, values in tiers.items()
+                }
+                for bucket, tiers in self._buckets.items()
+            }
+            return {'queries': self._queries, 'decisions': dict(self._decisions), 'buckets': buckets}
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scheduler.py
+Планировщик обращений к Ollama: пакетирование эмбеддингов и ограничение генераций
+"""
+
+import time
+import heapq
+import queue
+import asyncio
+import itertools
+import threading
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Tuple
+import requests
+from langchain_core.embeddings import Embeddings
+from config import RAG_CONFIG, SCHEDULER_CONFIG
+from request_context import BakaiStats
+
+
+class BakaiEmbeddingBatcher(Embeddings):
+    """Эмбеддинги запросов, собранные за короткое окно, считаются одним пакетом
+
+    Без пакетного API (/api/embed) тексты пакета считаются параллельно -
+    одинаковые тексты окна по-прежнему считаются один раз
+    """
+
+    def __init__(self, embeddings, window_ms: float = None, max_batch: int = None,
+                 use_batch_api: bool = None):
+        self.embeddings = embeddings
+        self.window = (window_ms or SCHEDULER_CONFIG.get("embedding_batch_window_ms", 5)) / 1000
+        self.max_batch = max_batch or SCHEDULER_CONFIG.get("embedding_max_batch", 32)
+        self.use_batch_api = (SCHEDULER_CONFIG.get("embedding_batch_api", False)
+                              if use_batch_api is None else use_batch_api)
+        self.stats = BakaiStats(counters=['requests', 'batches', 'unique_texts'])
+        self._pool = None if self.use_batch_api else ThreadPoolExecutor(
+            max_workers=SCHEDULER_CONFIG.get("embedding_concurrency", 8), thread_name_prefix="bakai-embed"
+        )
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="bakai-embed-batcher", daemon=True)
+        self._worker.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Эмбеддинг запроса через общий пакет"""
+        return self._submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги нескольких текстов как запросов: все сразу уходят в пакеты"""
+        futures = [self._submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Индексация документов идет напрямую: она и так пакетная"""
+        return self.embeddings.embed_documents(texts)
+
+    def _submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self) -> None:
+        """Сбор запросов: пакет уходит по окну или размеру
+
+        Окно ждем только под нагрузкой (в очереди уже есть другие запросы) -
+        одиночный запрос отправляется сразу, без добавочной задержки
+        """
+        while True:
+            batch = [self._queue.get()]
+            if self._queue.empty():
+                self._dispatch(batch)
+                continue
+
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[str, Future]]) -> None:
+        # Одинаковые тексты в окне считаются один раз
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        self.stats.increment('requests', len(batch))
+        self.stats.increment('batches')
+        self.stats.increment('unique_texts', len(unique_texts))
+
+        if self._pool is not None:
+            # Тексты считаются параллельно; сборщик пакетов не ждет ответов
+            waiters: Dict[str, List[Future]] = {}
+            for text, future in batch:
+                waiters.setdefault(text, []).append(future)
+            for text, futures in waiters.items():
+                self._pool.submit(self.embeddings.embed_query, text).add_done_callback(
+                    partial(self._resolve, futures)
+                )
+            return
+
+        try:
+            vectors = dict(zip(unique_texts, self._embed_batch(unique_texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    @staticmethod
+    def _resolve(futures: List[Future], done: Future) -> None:
+        """Результат эмбеддинга текста - всем запросившим его"""
+        error = done.exception()
+        for future in futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(done.result())
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги пакета одним вызовом /api/embed"""
+        # /api/embed возвращает нормированные векторы - включать, только если
+        # коллекция Chroma проиндексирована так же
+        prefix = getattr(self.embeddings, 'query_instruction', '') or ''
+        response = requests.post(
+            f"{RAG_CONFIG.get('ollama_base_url', 'http://localhost:11434')}/api/embed",
+            json={
+                'model': RAG_CONFIG["embedding_model"],
+                'input': [f"{prefix}{text}" for text in texts],
+                'keep_alive': RAG_CONFIG.get("keep_alive")
+            },
+            timeout=SCHEDULER_CONFIG.get("embedding_timeout", 30.0)
+        )
+        response.raise_for_status()
+        return response.json()['embeddings']
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.stats.snapshot()
+        stats['avg_batch_size'] = round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
+
+
+class BakaiGenerationLimiter:
+    """Ограничение одновременных генераций числом слотов Ollama с очередью по приоритетам
+
+    Меньшее значение priority обслуживается раньше; внутри приоритета - по порядку
+    """
+
+    def __init__(self, slots: int = None, queue_timeout: float = None):
+        self.slots = slots or SCHEDULER_CONFIG.get("generation_slots", 1)
+        self.queue_timeout = queue_timeout or SCHEDULER_CONFIG.get("generation_queue_timeout", 30.0)
+        self.stats = BakaiStats(counters=['granted', 'queued', 'timeouts'])
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = []  # (priority, порядковый номер, заявка)
+        self._order = itertools.count()
+
+    def acquire(self, priority: int = None, timeout: float = None) -> float:
+        """Получение слота генерации; возвращает время ожидания в очереди"""
+        priority = SCHEDULER_CONFIG.get("default_priority", 1) if priority is None else priority
+        start_time = time.perf_counter()
+
+        with self._lock:
+            if self._active < self.slots and not self._waiting:
+                self._active += 1
+                self.stats.increment('granted')
+                return 0.0
+            ticket = {'event': threading.Event(), 'cancelled': False}
+            heapq.heappush(self._waiting, (priority, next(self._order), ticket))
+            self.stats.increment('queued')
+
+        wait_limit = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        if not ticket['event'].wait(wait_limit):
+            with self._lock:
+                # Слот мог быть выдан одновременно с истечением таймаута
+                if not ticket['event'].is_set():
+                    ticket['cancelled'] = True
+                    self.stats.increment('timeouts')
+                    raise TimeoutError("очередь генерации переполнена")
+
+        waited = time.perf_counter() - start_time
+        self.stats.increment('granted')
+        self.stats.observe('queue', f"priority_{priority}", waited)
+        return waited
+
+    def release(self) -> None:
+        """Освобождение слота: он сразу передается следующей заявке из очереди"""
+        with self._lock:
+            while self._waiting:
+                _, _, ticket = heapq.heappop(self._waiting)
+                if not ticket['cancelled']:
+                    ticket['event'].set()
+                    return
+            self._active -= 1
+
+    @contextmanager
+    def slot(self, priority: int = None, timeout: float = None):
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = None, timeout: float = None):
+        """Асинхронный слот: ожидание очереди не блокирует цикл событий"""
+        future = asyncio.get_running_loop().run_in_executor(None, self.acquire, priority, timeout)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Слот, выданный уже после отмены, нужно вернуть
+            future.add_done_callback(lambda done: done.exception() is None and self.release())
+            raise
+
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active, waiting = self._active, sum(1 for _, _, t in self._waiting if not t['cancelled'])
+        return {
+            'slots': self.slots,
+            'active': active,
+            'waiting': waiting,
+            **self.stats.snapshot(),
+            'queue_wait': self.stats.latency_snapshot('queue')
+        }
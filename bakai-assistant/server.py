@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+server.py
+Локальный HTTP-сервер голосового помощника банка Бакай
+
+Эндпоинты:
+    GET  /health          - состояние сервера (503, пока идет прогрев кэшей)
+    GET  /audio/<job_id>  - состояние фонового озвучивания ответа
+    POST /query           - JSON {"query": "..."} -> результат process_query
+    POST /query/stream    - то же, но Server-Sent Events: token / result / audio / error
+"""
+
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from config import SERVER_CONFIG, WARMUP_CONFIG
+from warmer import BakaiCacheWarmer
+
+# Маркер завершения потока событий
+_STREAM_END = object()
+
+
+class BakaiServer:
+    """HTTP JSON API поверх BakaiAssistant.process_query"""
+
+    def __init__(self, assistant, host: str = None, port: int = None, workers: int = None,
+                 max_concurrent: int = None, request_timeout: float = None,
+                 warmup: bool = None, warmup_queries: int = None, warmup_budget: float = None):
+        self.assistant = assistant
+        self.host = host or SERVER_CONFIG["host"]
+        self.port = port or SERVER_CONFIG["port"]
+        self.workers = workers or SERVER_CONFIG["workers"]
+        self.max_concurrent = max_concurrent or SERVER_CONFIG["max_concurrent"]
+        self.request_timeout = request_timeout or SERVER_CONFIG["request_timeout"]
+
+        self.assistant.play_audio = SERVER_CONFIG.get("play_audio", False)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakai-worker")
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self.httpd = None
+        
+        # Прогрев идет, пока сервер уже принимает запросы; готовность - после него
+        warmup = WARMUP_CONFIG.get("enabled", True) if warmup is None else warmup
+        self.warmer = BakaiCacheWarmer(assistant, budget=warmup_budget) if warmup else None
+        self.warmup_queries = warmup_queries
+        self.ready = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Запуск сервера до прерывания"""
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        print(f"🌐 Сервер помощника: http://{self.host}:{self.port} "
+              f"(потоков: {self.workers}, лимит запросов: {self.max_concurrent}, "
+              f"таймаут: {self.request_timeout:.0f} с)")
+        if self.warmer is not None:
+            threading.Thread(target=self._warm_up, name="bakai-warmup", daemon=True).start()
+        else:
+            self.ready.set()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.shutdown()
+
+    def _warm_up(self) -> None:
+        """Прогрев кэшей; ошибка прогрева не мешает готовности"""
+        try:
+            self.warmer.run(top_n=self.warmup_queries)
+        except Exception as e:
+            print(f"⚠️ Ошибка прогрева кэшей: {e}")
+        finally:
+            self.ready.set()
+            print("✅ Сервер готов к работе")
+
+    def health(self) -> Dict[str, Any]:
+        """Состояние сервера: готовность и прогресс прогрева"""
+        ready = self.ready.is_set()
+        return {
+            "status": "ok" if ready else "warming_up",
+            "ready": ready,
+            "warmup": self.warmer.get_progress() if self.warmer is not None else None
+        }
+
+    def shutdown(self) -> None:
+        """Остановка сервера и пула обработчиков"""
+        if self.httpd:
+            self.httpd.server_close()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, query: str, on_token=None):
+        """Постановка запроса в пул; None - если превышен лимит одновременных запросов
+
+        Слот занят, пока обработка не завершится; срок обработки - срок ответа клиенту,
+        поэтому после 504 работа не продолжает занимать слот
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        expires_at = time.monotonic() + self.request_timeout
+        future = self.executor.submit(self._process, query, on_token, expires_at)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _process(self, query: str, on_token, expires_at: float) -> Dict[str, Any]:
+        """Обработка запроса в пределах срока ответа (с запасом на отправку результата)"""
+        remaining = expires_at - time.monotonic() - SERVER_CONFIG.get("response_margin", 1.0)
+        if remaining <= 0:
+            raise TimeoutError("срок запроса истек в очереди")
+        return self.assistant.process_query(query, on_token, deadline=remaining)
+
+    def serialize_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Результат process_query в JSON-совместимом виде"""
+        serialized = dict(result)
+        serialized.pop("audio_job", None)  # Future не сериализуется - клиенту отдается audio_job_id
+        serialized["documents"] = [
+            {
+                "content": doc.page_content,
+                "metadata": doc.metadata if hasattr(doc, 'metadata') else {}
+            }
+            for doc in result.get("documents", [])
+        ]
+        return serialized
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BakaiRequestHandler):
+            bakai_server = server
+
+        return Handler
+
+
+class BakaiRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов сервера помощника"""
+
+    bakai_server: Optional[BakaiServer] = None
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            health = self.bakai_server.health()
+            self._send_json(200 if health["ready"] else 503, health)
+        elif self.path.startswith('/audio/'):
+            job_id = self.path[len('/audio/'):]
+            status = self.bakai_server.assistant.tts_queue.job_status(job_id)
+            self._send_json(404 if status["status"] == "unknown" else 200, status)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path not in ('/query', '/query/stream'):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        query = self._read_query()
+        if query is None:
+            return
+
+        if self.path == '/query':
+            self._handle_query(query)
+        else:
+            self._handle_stream(query)
+
+    def _read_query(self) -> Optional[str]:
+        """Чтение поля query из JSON-тела запроса"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            query = str(payload.get('query', '')).strip()
+        except (ValueError, AttributeError):
+            self._send_json(400, {"error": "invalid JSON body"})
+            return None
+
+        if not query:
+            self._send_json(400, {"error": "field 'query' is required"})
+            return None
+        return query
+
+    def _handle_query(self, query: str) -> None:
+        server = self.bakai_server
+        future = server.submit(query)
+        if future is None:
+            self._send_json(503, {"error": "server busy"})
+            return
+
+        try:
+            result = future.result(timeout=server.request_timeout)
+        except FutureTimeoutError:
+            self._send_json(504, {"error": "request timeout"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self._send_json(200, server.serialize_result(result))
+
+    def _handle_stream(self, query: str) -> None:
+        server = self.bakai_server
+        events = queue.Queue()
+        future = server.submit(query, on_token=lambda token: events.put(('token', {"text": token})))
+        if future is None:
+            self._send_json(503, {"error": "server busy"})
+            return
+
+        def finish(done):
+            if done.cancelled() or done.exception() is not None:
+                error = "cancelled" if done.cancelled() else str(done.exception())
+                events.put(('error', {"error": error}))
+                events.put(_STREAM_END)
+                return
+
+            result = done.result()
+            events.put(('result', server.serialize_result(result)))
+            audio_job = result.get('audio_job')
+            if result.get('audio_file') or audio_job is None:
+                if result.get('audio_file'):
+                    events.put(('audio', {"path": result['audio_file']}))
+                events.put(_STREAM_END)
+                return
+
+            # Текст уже отправлен; аудио - отдельным событием, когда будет готово
+            def audio_ready(_):
+                events.put(('audio', server.assistant.tts_queue.job_status(result['audio_job_id'])))
+                events.put(_STREAM_END)
+
+            audio_job.add_done_callback(audio_ready)
+
+        future.add_done_callback(finish)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        deadline = time.monotonic() + server.request_timeout
+        while True:
+            try:
+                event = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._send_event('error', {"error": "request timeout"})
+                break
+            if event is _STREAM_END:
+                break
+            if not self._send_event(*event):
+                break
+
+    def _send_event(self, name: str, data: Dict[str, Any]) -> bool:
+        """Отправка события SSE; False - если клиент отключился"""
+        try:
+            payload = json.dumps(data, ensure_ascii=False, default=str)
+            self.wfile.write(f"event: {name}\ndata: {payload}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+
+    def _send_json(self, status: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        print(f"🌐 {self.address_string()} - {format % args}")
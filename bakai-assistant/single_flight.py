@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+single_flight.py
+Объединение одинаковых запросов в работе: одно вычисление, общий результат
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import SCHEDULER_CONFIG
+from request_context import BakaiStats
+
+
+class BakaiFlightTimeout(TimeoutError):
+    """Одинаковый запрос в работе не завершился за срок ожидающего запроса"""
+
+
+class _Flight:
+    """Вычисление в работе: результат и уже выданные фрагменты ответа"""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.future = Future()
+        self.tokens: List[str] = []
+        self.listeners: List[Callable[[str], None]] = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, on_token: Optional[Callable[[str], None]]) -> None:
+        """Подписка на фрагменты: сначала повтор уже выданных, затем новые"""
+        if on_token is None:
+            return
+        with self.lock:
+            for token in self.tokens:
+                on_token(token)
+            self.listeners.append(on_token)
+
+    def unsubscribe(self, on_token: Optional[Callable[[str], None]]) -> None:
+        with self.lock:
+            if on_token in self.listeners:
+                self.listeners.remove(on_token)
+
+    def publish(self, token: str) -> None:
+        with self.lock:
+            self.tokens.append(token)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(token)
+
+
+class BakaiSingleFlight:
+    """Одинаковые запросы, пришедшие во время вычисления, ждут его и получают тот же результат
+
+    Запрос не присоединяется к вычислению с менее срочным приоритетом (например, к прогреву):
+    он считает сам и становится вычислением для следующих одинаковых запросов.
+    Ожидающий запрос ждет не дольше своего срока
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = BakaiStats(counters=['computed', 'coalesced', 'timeouts'])
+
+    def _join(self, key: str, on_token: Optional[Callable[[str], None]] = None,
+              priority: Optional[int] = None) -> Tuple[_Flight, bool]:
+        """Вычисление по ключу и признак того, что его выполняет вызывающий"""
+        priority = SCHEDULER_CONFIG.get("default_priority", 1) if priority is None else priority
+        with self._lock:
+            flight = self._flights.get(key)
+            # Меньшее значение - срочнее: за фоновым вычислением не ждем
+            is_leader = flight is None or flight.priority > priority
+            if is_leader:
+                flight = self._flights[key] = _Flight(priority)
+
+        flight.subscribe(on_token)
+        self.stats.increment('computed' if is_leader else 'coalesced')
+        return flight, is_leader
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _timed_out(self, flight: _Flight, on_token: Optional[Callable[[str], None]] = None) -> BakaiFlightTimeout:
+        flight.unsubscribe(on_token)
+        self.stats.increment('timeouts')
+        return BakaiFlightTimeout("одинаковый запрос не завершился в срок")
+
+    def run(self, key: str, compute: Callable[[Callable[[str], None]], Any],
+            on_token: Optional[Callable[[str], None]] = None, priority: Optional[int] = None,
+            timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Выполнение compute(publish) один раз на ключ; возвращает (результат, был ли он общим)
+
+        publish передает фрагменты ответа всем ожидающим с их on_token;
+        ожидание дольше timeout - BakaiFlightTimeout
+        """
+        flight, is_leader = self._join(key, on_token, priority)
+        if not is_leader:
+            try:
+                return flight.future.result(timeout=timeout), True
+            except FutureTimeoutError:
+                if flight.future.done():  # Ошибка самого вычисления
+                    raise
+                raise self._timed_out(flight, on_token) from None
+
+        try:
+            result = compute(flight.publish)
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+        finally:
+            self._finish(key, flight)
+        return result, False
+
+    async def arun(self, key: str, compute: Callable[[], Awaitable[Any]], priority: Optional[int] = None,
+                   timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Асинхронный вариант run (общий с синхронными вызовами по ключу)"""
+        flight, is_leader = self._join(key, priority=priority)
+        if not is_leader:
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight.future)), timeout), True
+            except asyncio.TimeoutError:
+                if flight.future.done():
+                    raise
+                raise self._timed_out(flight) from None
+
+        try:
+            result = await compute()
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+        finally:
+            self._finish(key, flight)
+        return result, False
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {**self.stats.snapshot(), 'in_flight': in_flight}
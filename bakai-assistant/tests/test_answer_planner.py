@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик ответа: прямой ответ, извлекающий ответ и генерация по уверенности поиска
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langchain_community")
+
+from langchain.docstore.document import Document
+from prompt_builder import BakaiPromptBuilder
+from rag_system import BakaiRAG
+from request_context import BakaiRequestContext, BakaiStats
+
+
+class Chunk:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class RecordingLLM:
+    """Модель с заданным ответом; запоминает, сколько раз к ней обращались"""
+
+    def __init__(self, answer: str):
+        self.answer = answer
+        self.calls = 0
+
+    def stream(self, messages, **kwargs):
+        self.calls += 1
+        yield Chunk(self.answer)
+
+
+def make_rag(llm) -> BakaiRAG:
+    """RAG без подключения к Chroma и Ollama: генерация идет через переданную модель"""
+    rag = BakaiRAG.__new__(BakaiRAG)
+    rag.prompt_builder = BakaiPromptBuilder()
+    rag.stats = BakaiStats(counters=['small_model_fallbacks'])
+    rag.generation_limiter = None
+    rag.llm = llm
+    rag.llms = {'large': llm, 'large:untimed': llm}
+    rag._small_model_retry_at = float('inf')
+    return rag
+
+
+def faq(question: str, answer: str, tier: str, score: float) -> Document:
+    return Document(page_content=f"FAQ: {question}?\nОтвет: {answer}",
+                    metadata={'retrieval_tier': tier, 'retrieval_score': score})
+
+
+def text(content: str, tier: str, score: float) -> Document:
+    return Document(page_content=content, metadata={'retrieval_tier': tier, 'retrieval_score': score})
+
+
+CARD_FAQ = faq("Как открыть карту", "Обратитесь в любой филиал с паспортом.", 'faq_similar', 0.9)
+LIMIT_FAQ = faq("Какой лимит снятия по карте", "Лимит снятия - 100 000 сом в сутки.", 'faq_similar', 0.8)
+TARIFFS = text("Тарифы на обслуживание карт. Стоимость карты Visa Classic - 500 сом в год.", 'keyword', 0.9)
+DEPOSITS = text("Вклады открываются онлайн. Ставка по вкладу зависит от срока.", 'keyword', 0.3)
+VECTOR_DOC = text("Карта выпускается за 3 дня. Доставка бесплатная.", 'vector', 0.4)
+
+
+@pytest.mark.parametrize("documents, search_type, expected", [
+    ([CARD_FAQ], 'exact_match', 'direct'),
+    ([VECTOR_DOC], 'exact_match', 'direct'),
+    ([CARD_FAQ, LIMIT_FAQ], 'no_exact_match', 'direct'),
+    ([LIMIT_FAQ, CARD_FAQ], 'no_exact_match', 'extractive'),
+    ([TARIFFS, DEPOSITS], 'no_exact_match', 'extractive'),
+    ([TARIFFS, text("Обслуживание карт бесплатно.", 'keyword', 0.8)], 'no_exact_match', 'generate'),
+    ([faq("Как открыть вклад", "Онлайн.", 'faq_similar', 0.6)], 'no_exact_match', 'generate'),
+    ([VECTOR_DOC], 'no_exact_match', 'generate'),
+])
+def test_plan_answer_modes(documents, search_type, expected):
+    assert make_rag(RecordingLLM(""))._plan_answer(documents, search_type) == expected
+
+
+def test_direct_answer_returns_faq_answer_without_llm():
+    llm = RecordingLLM("Сгенерированный ответ.")
+    ctx = BakaiRequestContext("Как открыть карту?", stage_budgets={})
+
+    answer = make_rag(llm).generate_answer(ctx.query, [CARD_FAQ], 'exact_match', ctx=ctx)
+
+    assert answer == "Обратитесь в любой филиал с паспортом."
+    assert ctx.answer_mode == 'direct'
+    assert llm.calls == 0
+
+
+def test_extractive_answer_joins_confident_faq_answers():
+    llm = RecordingLLM("Сгенерированный ответ.")
+    ctx = BakaiRequestContext("Какой лимит по карте?", stage_budgets={})
+    weak_faq = faq("Как закрыть вклад", "Обратитесь в филиал.", 'faq_similar', 0.5)
+
+    answer = make_rag(llm).generate_answer(ctx.query, [LIMIT_FAQ, CARD_FAQ, weak_faq],
+                                           'no_exact_match', ctx=ctx)
+
+    assert answer == "Лимит снятия - 100 000 сом в сутки. Обратитесь в любой филиал с паспортом."
+    assert ctx.answer_mode == 'extractive'
+    assert llm.calls == 0
+
+
+def test_extractive_answer_takes_sentences_with_query_keywords():
+    rag = make_rag(RecordingLLM(""))
+    ctx = BakaiRequestContext("Сколько стоит карта Visa Classic?", stage_budgets={})
+
+    answer = rag._build_extractive_answer(ctx.query, [TARIFFS, DEPOSITS], ctx)
+
+    # Из документа без FAQ берутся только предложения с ключевыми словами запроса,
+    # второй документ не уверенный FAQ и не используется
+    assert answer == "Стоимость карты Visa Classic - 500 сом в год."
+    assert ctx.analysis is not None and ctx.analysis.query == ctx.query
+
+
+def test_generate_mode_calls_llm():
+    llm = RecordingLLM("Карта будет готова через 3 дня.")
+    ctx = BakaiRequestContext("Когда будет готова карта?", stage_budgets={})
+
+    answer = make_rag(llm).generate_answer(ctx.query, [VECTOR_DOC], 'no_exact_match', ctx=ctx)
+
+    assert answer == "Карта будет готова через 3 дня."
+    assert ctx.answer_mode == 'generate'
+    assert llm.calls == 1
+    assert ctx.failed_stages == []
+
+
+def test_planner_disabled_always_generates(monkeypatch):
+    import rag_system
+    monkeypatch.setitem(rag_system.RAG_CONFIG, "answer_planner_enabled", False)
+
+    rag = make_rag(RecordingLLM(""))
+
+    assert rag._plan_answer([CARD_FAQ], 'no_exact_match') == 'generate'
+    assert rag._plan_answer([CARD_FAQ], 'exact_match') == 'direct'
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сжатие контекста: весь контекст в пределах бюджета, предложения без совпадений добирают остаток
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langchain_community")
+
+from langchain.docstore.document import Document
+from prompt_builder import BakaiPromptBuilder, estimate_tokens
+from rag_system import BakaiRAG
+
+CARD_FAQ = ("FAQ: Как открыть карту?\nОтвет: Для оформления карты обратитесь в филиал. "
+            "Потребуется паспорт. Выпуск занимает 3 дня.")
+
+
+def make_rag(budget: int) -> BakaiRAG:
+    """RAG без подключения к Chroma и Ollama: сжатию нужен только построитель промпта"""
+    rag = BakaiRAG.__new__(BakaiRAG)
+    rag.prompt_builder = BakaiPromptBuilder()
+    rag.prompt_builder.context_budget = lambda: budget
+    return rag
+
+
+def test_context_within_budget_is_kept_whole():
+    rag = make_rag(700)
+    documents = [Document(page_content=CARD_FAQ)]
+
+    context = rag._compress_context("Как открыть карту?", documents)
+
+    assert context == rag._build_context(documents)
+    assert "Потребуется паспорт." in context
+    assert "Выпуск занимает 3 дня." in context
+
+
+def test_budget_is_filled_with_non_matching_sentences():
+    documents = [
+        Document(page_content=CARD_FAQ),
+        Document(page_content="Кредит оформляется онлайн. Ставка зависит от срока. " * 20)
+    ]
+    # Бюджет меньше полного контекста, но больше первого документа
+    budget = estimate_tokens(CARD_FAQ) + 20
+    rag = make_rag(budget)
+
+    context = rag._compress_context("Как открыть карту?", documents)
+
+    assert "Потребуется паспорт." in context
+    assert "Выпуск занимает 3 дня." in context
+    assert estimate_tokens(context) <= budget + 10
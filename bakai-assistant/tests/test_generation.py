@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генерация ответа: ошибки модели, срок генерации и ранняя остановка
+"""
+
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langchain_community")
+
+from langchain.docstore.document import Document
+from prompt_builder import BakaiPromptBuilder
+from rag_system import BakaiRAG
+from request_context import BakaiRequestContext, BakaiStats
+
+DOCUMENTS = [Document(page_content="Карта выпускается за 3 дня. Стоимость обслуживания 500 сом.",
+                      metadata={'retrieval_tier': 'vector', 'retrieval_score': 0.4})]
+
+
+class FailingLLM:
+    """Модель, у которой обрывается HTTP-запрос (как ReadTimeout клиента Ollama)"""
+
+    def stream(self, messages, **kwargs):
+        raise ConnectionError("Read timed out")
+        yield
+
+
+class Chunk:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StalledLLM:
+    """Модель, которая отдает начало ответа и зависает"""
+
+    def __init__(self, *parts: str, stall: float = 2.0):
+        self.parts = parts
+        self.stall = stall
+
+    def stream(self, messages, **kwargs):
+        for part in self.parts:
+            yield Chunk(part)
+        time.sleep(self.stall)
+        yield Chunk(" Конец.")
+
+    async def astream(self, messages, **kwargs):
+        for part in self.parts:
+            yield Chunk(part)
+        await asyncio.sleep(self.stall)
+        yield Chunk(" Конец.")
+
+
+def make_rag(llm) -> BakaiRAG:
+    """RAG без подключения к Chroma и Ollama: генерация идет через переданную модель"""
+    rag = BakaiRAG.__new__(BakaiRAG)
+    rag.prompt_builder = BakaiPromptBuilder()
+    rag.stats = BakaiStats(counters=['small_model_fallbacks'])
+    rag.generation_limiter = None
+    rag.llm = llm
+    rag.llms = {'large': llm, 'large:untimed': llm}
+    rag._small_model_retry_at = float('inf')
+    return rag
+
+
+def test_generation_error_marks_context():
+    ctx = BakaiRequestContext("Сколько стоит обслуживание карты?", stage_budgets={})
+
+    answer = make_rag(FailingLLM()).generate_answer(ctx.query, DOCUMENTS, 'no_exact_match', ctx=ctx)
+
+    assert answer
+    assert ctx.failed_stages == ['generation']
+    assert ctx.degraded_stages == []
+
+
+def test_offline_generation_uses_client_without_budget_timeout():
+    rag = make_rag(FailingLLM())
+    timed, untimed = object(), object()
+    rag.llms = {'large': timed, 'large:untimed': untimed}
+
+    offline_plan = {'route': 'large', 'ctx': BakaiRequestContext("q", stage_budgets={})}
+    online_plan = {'route': 'large', 'ctx': BakaiRequestContext("q", stage_budgets={'generation': 6.0})}
+
+    assert rag._plan_llm(offline_plan) is untimed
+    assert rag._plan_llm(online_plan) is timed
+
+
+def test_short_numbers_are_not_facts():
+    rag = make_rag(FailingLLM())
+
+    facts = rag._top_document_facts(DOCUMENTS, DOCUMENTS[0].page_content)
+
+    assert facts == ['500']
+
+
+def test_facts_match_whole_numbers_only():
+    rag = make_rag(FailingLLM())
+
+    assert rag._early_stop_reason("Обслуживание стоит 5000 сом.", ['500']) is None
+    assert rag._early_stop_reason("Звоните 1,500 раз.", ['500']) is None
+    assert rag._early_stop_reason("Обслуживание стоит 500 сом.", ['500']) == 'facts_covered'
+    assert rag._early_stop_reason("Ставка 18 % годовых.", ['18%']) == 'facts_covered'
+    assert rag._early_stop_reason("Ставка 18,5 годовых.", ['18']) is None
+
+
+def test_deadline_after_streamed_tokens_keeps_partial_answer():
+    ctx = BakaiRequestContext("Сколько стоит обслуживание?", stage_budgets={'generation': 0.3})
+    tokens = []
+    start_time = time.perf_counter()
+
+    answer = make_rag(StalledLLM("Обслуживание платное.", " Оплата")) \
+        ._generate_contextual_answer(ctx.query, DOCUMENTS, tokens.append, ctx)
+
+    assert time.perf_counter() - start_time < 1.0
+    assert tokens
+    assert answer == "Обслуживание платное."
+    assert ctx.generation_stats['stop_reason'] == 'deadline'
+    assert ctx.degraded_stages == ['generation']
+    assert ctx.answer_mode != 'extractive'
+
+
+def test_async_deadline_is_checked_while_waiting_for_chunks():
+    ctx = BakaiRequestContext("Сколько стоит обслуживание?", stage_budgets={'generation': 0.3})
+    start_time = time.perf_counter()
+
+    answer = asyncio.run(make_rag(StalledLLM("Обслуживание платное.", " Оплата"))
+                         ._agenerate_contextual_answer(ctx.query, DOCUMENTS, ctx))
+
+    assert time.perf_counter() - start_time < 1.0
+    assert answer == "Обслуживание платное."
+    assert ctx.generation_stats['stop_reason'] == 'deadline'
+
+
+def test_deadline_without_sentence_falls_back_to_extractive_answer():
+    ctx = BakaiRequestContext("Сколько стоит обслуживание?", stage_budgets={'generation': 0.3})
+
+    answer = make_rag(StalledLLM("Обслуживание")) \
+        ._generate_contextual_answer(ctx.query, DOCUMENTS, None, ctx)
+
+    assert ctx.answer_mode == 'extractive'
+    assert "500 сом" in answer
+
+
+def test_small_route_counts_only_documents_close_to_the_top_score():
+    rag = make_rag(FailingLLM())
+    rag._small_model_retry_at = 0.0
+    ctx = BakaiRequestContext("Где ближайший банкомат?", stage_budgets={})
+    documents = [
+        Document(page_content="Банкомат: ул. Токтогула 125.", metadata={'retrieval_score': 0.9}),
+        Document(page_content="Кредиты для бизнеса.", metadata={'retrieval_score': 0.3}),
+        Document(page_content="Вклады до 12%.", metadata={'retrieval_score': 0.2})
+    ]
+    ctx.compression_stats = {'documents_kept': len(documents)}
+    ctx.prompt_stats = {'context_tokens': 120}
+
+    assert rag._relevant_document_count(documents) == 1
+    assert rag._route_model(ctx.query, 'адрес', documents, ctx) == 'small'
+
+    documents[1].metadata['retrieval_score'] = 0.85
+    assert rag._route_model(ctx.query, 'адрес', documents, ctx) == 'large'
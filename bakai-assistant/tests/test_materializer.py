@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Материализация ответов: в хранилище попадают только готовые ответы без ошибок и деградации
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from materializer import BakaiAnswerStore, BakaiMaterializer
+from request_context import BakaiRequestContext
+
+FAILED_ANSWER = "Не удалось сформировать ответ. Обратитесь к консультанту."
+
+
+class FakeAssistant:
+    """Помощник с заданными ответами: запрос -> (ответ, этап с ошибкой или None)"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.rag = SimpleNamespace(faq_database={
+            key: {'original_question': query} for key, query in enumerate(answers)
+        })
+        self.tts = SimpleNamespace(is_initialized=False)
+
+    @contextmanager
+    def offline_mode(self):
+        yield
+
+    def process_query(self, query, deadline=None):
+        answer, failed_stage = self.answers[query]
+        ctx = BakaiRequestContext(query, stage_budgets={})
+        if failed_stage:
+            ctx.fail(failed_stage)
+        return {
+            "raw_answer": answer,
+            "link": "https://bakai.kg",
+            "service_type": None,
+            "documents_found": 1,
+            "query_analysis": {"voice": "baya"},
+            "degraded_stages": list(ctx.degraded_stages),
+            "failed_stages": list(ctx.failed_stages),
+            "processing_success": True
+        }
+
+
+def test_failed_generation_is_not_persisted(tmp_path):
+    store = BakaiAnswerStore(str(tmp_path / "answers.sqlite"))
+    assistant = FakeAssistant({
+        "Как открыть карту?": ("Обратитесь в филиал с паспортом.", None),
+        "Какой лимит по карте?": (FAILED_ANSWER, 'generation')
+    })
+
+    materializer = BakaiMaterializer(assistant, store)
+    summary = materializer.run(query_log=str(tmp_path / "query_log.jsonl"), with_audio=False)
+
+    assert summary['materialized'] == 1
+    assert summary['skipped'] == 1
+    assert store.lookup("какой лимит по карте") is None
+
+    reloaded = BakaiAnswerStore(store.path)
+    reloaded.load()
+    assert "Какой лимит по карте?" not in reloaded
+    assert reloaded.lookup("Как открыть карту?")['answer'] == "Обратитесь в филиал с паспортом."
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Автомат паттернов: те же совпадения, что и прежний поиск подстрокой, но с учетом границ слов
+"""
+
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_manager import BakaiContentManager
+from pattern_engine import SHORT_PATTERN_LENGTH, BakaiPatternEngine
+
+QUERIES = [
+    "Как открыть карту?",
+    "Хочу взять кредит на кредитную карту",
+    "Условия кредитования для ИП",
+    "Типа рассрочка есть?",
+    "Налог на доход по вкладу",
+    "Открыть РС для бизнеса",
+    "Курс доллара и евро",
+    "Автокредит или ипотека?",
+    "Пин-код не подходит, карта заблокирована",
+    "картотека",
+    "",
+]
+
+
+def old_rule_matches(patterns, query):
+    """Прежнее правило (pattern in query.lower()) с границами слов: паттерн начинается
+    с начала слова, а короткий паттерн еще и заканчивается на конце слова"""
+    query_lower = query.lower()
+    matched = set()
+    for category, category_patterns in patterns.items():
+        for pattern in category_patterns:
+            pattern = pattern.lower()
+            if pattern not in query_lower:
+                continue
+            tail = r'(?!\w)' if len(pattern) <= SHORT_PATTERN_LENGTH else ''
+            if re.search(r'(?<!\w)' + re.escape(pattern) + tail, query_lower):
+                matched.add((category, pattern))
+    return matched
+
+
+def old_classify_service(patterns, query):
+    """Прежний classify_service поверх правила с границами слов"""
+    matched = old_rule_matches(patterns, query)
+    scores = {}
+    for category, category_patterns in patterns.items():
+        score = sum(len(pattern.split()) * 2 + 1
+                    for pattern in category_patterns if (category, pattern.lower()) in matched)
+        if score > 0:
+            scores[category] = score
+    if not scores:
+        return None, 0.0
+    best = max(scores, key=scores.get)
+    return best, scores[best] / sum(scores.values())
+
+
+@pytest.fixture
+def manager():
+    return BakaiContentManager(pattern_engine=BakaiPatternEngine())
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_engine_matches_old_substring_rule(manager, query):
+    found = {(match.category, match.pattern) for match in manager.patterns.find(query, ['services'])}
+    assert found == old_rule_matches(manager.service_patterns, query)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_classification_matches_old_rule(manager, query):
+    service, confidence = manager.classify_service(query)
+    expected_service, expected_confidence = old_classify_service(manager.service_patterns, query)
+    assert service == expected_service
+    assert confidence == pytest.approx(expected_confidence)
+
+
+def test_short_patterns_match_whole_words_only():
+    engine = BakaiPatternEngine()
+    engine.add_lexicon('test', {'business': ['ип', 'рс'], 'slang': ['нал']})
+
+    assert [m.pattern for m in engine.find("Счет для ИП")] == ['ип']
+    assert [m.pattern for m in engine.find("РС, пожалуйста")] == ['рс']
+    # Внутри и в начале более длинных слов короткие паттерны не срабатывают
+    assert engine.find("типа ипотека") == []
+    assert engine.find("курс валют") == []
+    assert engine.find("налог и наличные") == []
+
+
+def test_long_patterns_match_word_prefixes():
+    engine = BakaiPatternEngine()
+    engine.add_lexicon('test', {'credits': ['кредит']})
+
+    found = engine.find("Оформить кредитную карту")
+    assert [(m.start, m.end, m.pattern) for m in found] == [(9, 15, 'кредит')]
+    # Только с начала слова: внутри 'автокредит' паттерн не ищется
+    assert engine.find("автокредит") == []
+
+
+def test_whole_word_overrides_length_rule():
+    engine = BakaiPatternEngine()
+    engine.add_lexicon('forbidden', {'forbidden': ['модель']}, whole_word=True)
+
+    assert [m.pattern for m in engine.find("Какая модель?")] == ['модель']
+    assert engine.find("смоделировать модельный ряд") == []
+
+
+def test_match_positions_follow_original_text():
+    engine = BakaiPatternEngine()
+    engine.add_lexicon('test', {'cards': ['карта']}, weight=lambda pattern, _: 3)
+
+    text = "Моя КАРТА"
+    match, = engine.find(text)
+    assert text[match.start:match.end] == "КАРТА"
+    assert (match.lexicon, match.category, match.weight) == ('test', 'cards', 3.0)
+
+
+def test_lexicon_filter_and_scan_cache():
+    engine = BakaiPatternEngine()
+    engine.add_lexicon('services', {'cards': ['карта']})
+    engine.add_lexicon('links', {'cards': ['карта']})
+
+    assert {m.lexicon for m in engine.find("карта")} == {'services', 'links'}
+    assert {m.lexicon for m in engine.find("карта", ['links'])} == {'links'}
+
+    stats = engine.get_stats()
+    assert stats['lexicons'] == 2
+    assert stats['scans'] == 2
+    assert stats['cache_hits'] == 1
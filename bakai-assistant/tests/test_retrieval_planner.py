@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик поиска: решения по попаданиям уровней и их времени
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RAG_CONFIG
+from query_analysis import QueryAnalysis
+from retrieval_planner import BakaiRetrievalPlanner
+
+QUERY = QueryAnalysis("Как открыть карту?")
+
+
+def make_planner(tiers):
+    """Планировщик с накопленной статистикой: уровень -> (доля попаданий, время в секундах)"""
+    planner = BakaiRetrievalPlanner()
+    planner.explore_every = 0
+    bucket = planner.bucket(planner.features(QUERY))
+    runs = RAG_CONFIG.get("planner_min_samples", 20) * 5
+    for tier, (hit_rate, elapsed) in tiers.items():
+        hits = round(runs * hit_rate)
+        for index in range(runs):
+            planner.observe(bucket, tier, index < hits, elapsed)
+    return planner
+
+
+def test_fast_keyword_hits_make_vector_search_staged():
+    planner = make_planner({'keyword': (0.7, 0.01), 'vector': (0.9, 0.4)})
+
+    assert planner.plan(QUERY)['mode'] == 'staged'
+
+
+def test_slow_keyword_search_keeps_fan_out():
+    # Те же попадания, но ожидание медленных ключевых слов дороже сэкономленного векторного поиска
+    planner = make_planner({'keyword': (0.7, 0.5), 'vector': (0.9, 0.4)})
+
+    assert planner.plan(QUERY)['mode'] == 'fan_out'
+
+
+def test_tier_with_few_hits_per_second_is_skipped():
+    planner = make_planner({'similar': (0.1, 2.0), 'keyword': (0.1, 0.01), 'vector': (0.9, 0.1)})
+
+    tiers = planner.plan(QUERY)['tiers']
+
+    assert 'similar' not in tiers
+    assert 'keyword' in tiers
+    assert 'vector' in tiers
+
+
+def test_rare_hits_are_skipped_even_when_fast():
+    planner = make_planner({'semantic': (0.0, 0.001), 'vector': (0.9, 0.1)})
+
+    assert 'semantic' not in planner.plan(QUERY)['tiers']
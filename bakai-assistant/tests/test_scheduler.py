@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик Ollama: пакетирование эмбеддингов и очередь генераций по приоритетам
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("requests")
+pytest.importorskip("langchain_core")
+
+from scheduler import BakaiEmbeddingBatcher, BakaiGenerationLimiter
+
+
+class CountingEmbeddings:
+    """Эмбеддинги с подсчетом вызовов; тексты из failing - с ошибкой"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def embed_query(self, text):
+        with self._lock:
+            self.calls.append(text)
+        if text in self.failing:
+            raise ConnectionError(f"embedding failed: {text}")
+        return [float(len(text)), 1.0]
+
+
+def dispatch(batcher, texts):
+    """Один пакет с заданными текстами; возвращает future каждого запроса"""
+    batch = [(text, Future()) for text in texts]
+    batcher._dispatch(batch)
+    return [future for _, future in batch]
+
+
+def test_batcher_embeds_each_unique_text_once():
+    embeddings = CountingEmbeddings()
+    batcher = BakaiEmbeddingBatcher(embeddings, use_batch_api=False)
+
+    futures = dispatch(batcher, ["карта", "кредит", "карта", "карта"])
+    vectors = [future.result(timeout=5) for future in futures]
+
+    assert sorted(embeddings.calls) == ["карта", "кредит"]
+    assert vectors[0] == vectors[2] == vectors[3] == [5.0, 1.0]
+    assert batcher.get_stats()['unique_texts'] == 2
+
+
+def test_batcher_passes_errors_to_every_waiter_of_the_text():
+    embeddings = CountingEmbeddings(failing=["карта"])
+    batcher = BakaiEmbeddingBatcher(embeddings, use_batch_api=False)
+
+    futures = dispatch(batcher, ["карта", "кредит", "карта"])
+
+    for future in (futures[0], futures[2]):
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+    assert futures[1].result(timeout=5) == [6.0, 1.0]
+    with pytest.raises(ConnectionError):
+        batcher.embed_query("карта")
+
+
+def test_batch_api_error_reaches_the_whole_batch():
+    batcher = BakaiEmbeddingBatcher(CountingEmbeddings(), use_batch_api=True)
+    sent = []
+
+    def failing_batch(texts):
+        sent.append(list(texts))
+        raise ConnectionError("ollama unavailable")
+
+    batcher._embed_batch = failing_batch
+    futures = dispatch(batcher, ["карта", "карта", "кредит"])
+
+    assert sent == [["карта", "кредит"]]
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+
+
+def test_limiter_serves_lower_priority_number_first():
+    limiter = BakaiGenerationLimiter(slots=1, queue_timeout=5.0)
+    limiter.acquire(priority=1)
+    granted = []
+
+    def wait_for_slot(priority):
+        limiter.acquire(priority=priority)
+        granted.append(priority)
+        limiter.release()
+
+    threads = []
+    for priority in (2, 0, 1):
+        thread = threading.Thread(target=wait_for_slot, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)  # Заявки встают в очередь по порядку
+
+    limiter.release()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert granted == [0, 1, 2]
+    assert limiter.get_stats()['active'] == 0
+
+
+def test_limiter_timeout_leaves_no_stale_waiter():
+    limiter = BakaiGenerationLimiter(slots=1, queue_timeout=5.0)
+    limiter.acquire()
+
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+
+    limiter.release()
+    stats = limiter.get_stats()
+    assert stats['active'] == 0
+    assert stats['waiting'] == 0
+    assert stats['timeouts'] == 1
+    assert limiter.acquire(timeout=0.05) == 0.0
+
+
+def test_cancelled_async_waiter_returns_its_slot():
+    limiter = BakaiGenerationLimiter(slots=1, queue_timeout=5.0)
+    limiter.acquire()
+
+    async def scenario():
+        async def generate():
+            async with limiter.aslot():
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(generate())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # Слот уходит отмененной заявке и должен вернуться
+        limiter.release()
+        for _ in range(50):
+            if limiter.get_stats()['active'] == 0:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert limiter.get_stats()['active'] == 0
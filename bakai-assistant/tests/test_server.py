@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP-сервер: срок обработки, освобождение слотов и события SSE
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import http.client
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http.server import ThreadingHTTPServer
+from server import BakaiServer
+
+
+class FakeAssistant:
+    """Помощник, который работает до переданного срока или падает"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.deadlines = []
+        self.play_audio = False
+        self.tts_queue = SimpleNamespace(job_status=lambda job_id: {"status": "unknown"})
+
+    def process_query(self, query, on_token=None, deadline=None):
+        self.deadlines.append(deadline)
+        if on_token:
+            on_token("Ответ")
+        if self.fail:
+            raise RuntimeError("поиск недоступен")
+        time.sleep(deadline)
+        return {"answer": "Ответ", "raw_answer": "Ответ", "documents": [], "processing_success": True}
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def start(assistant, **kwargs):
+        server = BakaiServer(assistant, warmup=False, **kwargs)
+        server.ready.set()
+        server.httpd = ThreadingHTTPServer(('127.0.0.1', 0), server._make_handler())
+        server.httpd.daemon_threads = True
+        threading.Thread(target=server.httpd.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.httpd.shutdown()
+        server.shutdown()
+
+
+def post(server, path, query="Как открыть карту?"):
+    connection = http.client.HTTPConnection('127.0.0.1', server.httpd.server_address[1], timeout=10)
+    connection.request('POST', path, json.dumps({"query": query}), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, response.read().decode('utf-8')
+
+
+def test_work_is_bounded_by_request_timeout_and_frees_its_slot(make_server):
+    assistant = FakeAssistant()
+    server = make_server(assistant, max_concurrent=1, request_timeout=1.5)
+
+    status, _ = post(server, '/query')
+
+    assert status == 200
+    assert 0 < assistant.deadlines[0] <= 1.5
+    time.sleep(0.1)
+    assert server._slots.acquire(blocking=False)
+    server._slots.release()
+
+
+def test_stream_reports_failure_as_error_event(make_server):
+    server = make_server(FakeAssistant(fail=True))
+
+    status, body = post(server, '/query/stream')
+
+    assert status == 200
+    assert "event: token" in body
+    assert "event: error" in body
+    assert "поиск недоступен" in body
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Объединение одинаковых запросов: один ведущий, общий результат, сроки ожидания
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import BakaiFlightTimeout, BakaiSingleFlight
+
+
+def run_concurrently(flight, count, compute, **kwargs):
+    """count одинаковых запросов одновременно; результаты и ошибки по порядку запуска"""
+    results, errors = [None] * count, [None] * count
+
+    def worker(index):
+        try:
+            results[index] = flight.run("как открыть карту", compute, **kwargs)
+        except BaseException as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)  # Первый запрос становится ведущим
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_concurrent_identical_queries_share_one_leader():
+    flight = BakaiSingleFlight()
+    calls = []
+
+    def compute(publish):
+        calls.append(1)
+        publish("Обратитесь")
+        time.sleep(0.2)
+        return "Обратитесь в филиал"
+
+    results, errors = run_concurrently(flight, 4, compute)
+
+    assert errors == [None] * 4
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["Обратитесь в филиал"] * 4
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert flight.get_stats()['coalesced'] == 3
+    assert flight.get_stats()['in_flight'] == 0
+
+
+def test_follower_gets_tokens_already_published():
+    flight = BakaiSingleFlight()
+    tokens = []
+
+    def compute(publish):
+        publish("Обратитесь")
+        time.sleep(0.2)
+        publish(" в филиал")
+        return "Обратитесь в филиал"
+
+    leader = threading.Thread(target=flight.run, args=("карта", compute))
+    leader.start()
+    time.sleep(0.05)
+    result, shared = flight.run("карта", compute, on_token=tokens.append)
+    leader.join(timeout=5)
+
+    assert shared
+    assert result == "Обратитесь в филиал"
+    assert "".join(tokens) == "Обратитесь в филиал"
+
+
+def test_follower_times_out_with_flight_timeout():
+    flight = BakaiSingleFlight()
+
+    def compute(publish):
+        time.sleep(0.5)
+        return "поздний ответ"
+
+    results, errors = run_concurrently(flight, 2, compute, timeout=0.1)
+
+    assert errors[0] is None
+    assert results[0] == ("поздний ответ", False)
+    assert isinstance(errors[1], BakaiFlightTimeout)
+    assert flight.get_stats()['timeouts'] == 1
+
+
+def test_leader_error_reaches_followers():
+    flight = BakaiSingleFlight()
+
+    def compute(publish):
+        time.sleep(0.2)
+        raise ConnectionError("ollama unavailable")
+
+    _, errors = run_concurrently(flight, 3, compute, timeout=2.0)
+
+    assert all(isinstance(error, ConnectionError) for error in errors)
+    assert not any(isinstance(error, BakaiFlightTimeout) for error in errors)
+
+
+def test_leader_timeout_error_is_not_reported_as_follower_timeout():
+    flight = BakaiSingleFlight()
+
+    def compute(publish):
+        time.sleep(0.1)
+        raise TimeoutError("очередь генерации переполнена")
+
+    _, errors = run_concurrently(flight, 2, compute, timeout=2.0)
+
+    assert type(errors[1]) is TimeoutError
+
+
+def test_urgent_query_does_not_wait_for_background_flight():
+    flight = BakaiSingleFlight()
+    calls = []
+
+    def compute(publish):
+        calls.append(1)
+        time.sleep(0.2)
+        return "ответ"
+
+    background = threading.Thread(target=flight.run, args=("карта", compute), kwargs={'priority': 2})
+    background.start()
+    time.sleep(0.05)
+    result, shared = flight.run("карта", compute, priority=0)
+    background.join(timeout=5)
+
+    assert result == "ответ"
+    assert not shared
+    assert len(calls) == 2
+
+
+def test_async_followers_share_leader_and_time_out():
+    flight = BakaiSingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return "ответ"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.arun("карта", compute))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(flight.arun("карта", compute, timeout=2.0))
+        hasty = asyncio.ensure_future(flight.arun("карта", compute, timeout=0.05))
+        with pytest.raises(BakaiFlightTimeout):
+            await hasty
+        return await leader, await follower
+
+    (leader_result, follower_result) = asyncio.run(scenario())
+
+    assert leader_result == ("ответ", False)
+    assert follower_result == ("ответ", True)
+    assert len(calls) == 1
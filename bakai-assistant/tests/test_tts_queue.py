@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь озвучивания: готовые файлы воспроизводятся в общем порядке заданий
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_queue import BakaiTTSQueue
+
+
+class FakeTTS:
+    """TTS, записывающий порядок синтеза и воспроизведения"""
+
+    def __init__(self):
+        self.played = []
+
+    def speak(self, text, voice=None, play_audio=True):
+        time.sleep(0.05)
+        path = f"{text}.wav"
+        if play_audio:
+            self._play_audio_file(path)
+        return path
+
+    def _play_audio_file(self, path):
+        self.played.append(path)
+
+
+def test_ready_file_plays_after_queued_speech():
+    tts = FakeTTS()
+    tts_queue = BakaiTTSQueue(tts, workers=1)
+
+    tts_queue.submit("Ваш вопрос")
+    job_id, job = tts_queue.submit_file("answer.wav")
+
+    assert job.result(timeout=5) == "answer.wav"
+    assert tts.played == ["Ваш вопрос.wav", "answer.wav"]
+    assert tts_queue.job_status(job_id) == {"job_id": job_id, "status": "done", "path": "answer.wav"}
+
+
+def test_ready_file_is_not_played_without_playback():
+    tts = FakeTTS()
+    tts_queue = BakaiTTSQueue(tts, workers=1)
+
+    _, job = tts_queue.submit_file("answer.wav", play_audio=False)
+
+    assert job.result(timeout=5) == "answer.wav"
+    assert tts.played == []
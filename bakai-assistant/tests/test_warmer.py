@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Прогрев кэшей: соблюдение бюджета и готовность сервера только после прогрева
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import http.client
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http.server import ThreadingHTTPServer
+from server import BakaiServer
+from warmer import BakaiCacheWarmer
+
+QUERIES = ["Как открыть карту?", "Какой курс доллара?", "Где ближайший банкомат?",
+           "Как закрыть вклад?", "Сколько стоит перевод?", "Как получить кредит?",
+           "Какая ставка по ипотеке?", "Как сменить пин-код?"]
+
+
+class FakeAssistant:
+    """Помощник с ответами FAQ на все запросы; поиск FAQ ждет события или задержки"""
+
+    def __init__(self, delay: float = 0.0, release: threading.Event = None, stored=()):
+        self.delay = delay
+        self.release = release
+        self.warmed = []
+        self.audio = []
+        self.answer_store = set(stored)
+        self.query_analyzer = SimpleNamespace(
+            analyze=lambda query: SimpleNamespace(service_type=None, voice='baya'))
+        self.rag = SimpleNamespace(find_faq_documents=self._find_faq_documents,
+                                   generate_answer=self._generate_answer)
+        self.content_manager = SimpleNamespace(enhance_response=lambda answer, query, ctx: answer)
+        self.tts_enabled = True
+        self.tts = SimpleNamespace(is_initialized=True)
+        self.tts_queue = SimpleNamespace(submit=self._submit_audio)
+        self.play_audio = False
+
+    def _find_faq_documents(self, query, ctx):
+        if self.release is not None:
+            self.release.wait(5.0)
+        time.sleep(self.delay)
+        return [f"FAQ: {query}"]
+
+    def _generate_answer(self, query, documents, search_type, ctx=None):
+        self.warmed.append(query)
+        return f"Ответ на {query}"
+
+    def _submit_audio(self, text, voice, play_audio=True):
+        self.audio.append((text, play_audio))
+        return 'job', SimpleNamespace(result=lambda: None)
+
+
+def write_query_log(path, queries):
+    with open(path, 'w', encoding='utf-8') as log_file:
+        for query in queries:
+            log_file.write(json.dumps({'ts': 0, 'query': query}, ensure_ascii=False) + '\n')
+    return str(path)
+
+
+def test_warmup_stops_within_budget(tmp_path):
+    query_log = write_query_log(tmp_path / "query_log.jsonl", QUERIES)
+    warmer = BakaiCacheWarmer(FakeAssistant(delay=0.2), concurrency=2, budget=0.3)
+
+    start_time = time.perf_counter()
+    progress = warmer.run(query_log=query_log, top_n=len(QUERIES))
+
+    # Начатые запросы не дожидаются: прогрев возвращается к концу бюджета
+    assert time.perf_counter() - start_time < 0.3 + 0.15
+    assert progress['state'] == 'budget_exhausted'
+    assert progress['total'] == len(QUERIES)
+    assert progress['started'] < len(QUERIES)
+    assert progress['done'] <= progress['started']
+
+
+def test_warmup_completes_and_skips_stored_answers(tmp_path):
+    query_log = write_query_log(tmp_path / "query_log.jsonl", QUERIES[:3])
+    assistant = FakeAssistant(stored=[QUERIES[0]])
+    warmer = BakaiCacheWarmer(assistant, concurrency=2, budget=5.0)
+
+    progress = warmer.run(query_log=query_log, top_n=3)
+
+    assert progress['state'] == 'completed'
+    assert (progress['done'], progress['skipped'], progress['failed']) == (2, 1, 0)
+    assert sorted(assistant.warmed) == sorted(QUERIES[1:3])
+    # Озвучка прогревается без воспроизведения
+    assert sorted(assistant.audio) == sorted((f"Ответ на {query}", False) for query in QUERIES[1:3])
+
+
+def get_health(server):
+    connection = http.client.HTTPConnection('127.0.0.1', server.httpd.server_address[1], timeout=5)
+    try:
+        connection.request('GET', '/health')
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_health_is_unavailable_until_warmup_finishes(tmp_path, monkeypatch):
+    import warmer
+    query_log = write_query_log(tmp_path / "query_log.jsonl", QUERIES[:2])
+    monkeypatch.setitem(warmer.MATERIALIZE_CONFIG, "query_log_path", query_log)
+
+    release = threading.Event()
+    server = BakaiServer(FakeAssistant(release=release), warmup=True, warmup_budget=5.0)
+    server.httpd = ThreadingHTTPServer(('127.0.0.1', 0), server._make_handler())
+    server.httpd.daemon_threads = True
+    threading.Thread(target=server.httpd.serve_forever, daemon=True).start()
+    try:
+        threading.Thread(target=server._warm_up, daemon=True).start()
+        deadline = time.perf_counter() + 5.0
+        while server.warmer.get_progress()['started'] == 0 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+        status, health = get_health(server)
+        assert status == 503
+        assert health['status'] == 'warming_up'
+        assert health['warmup']['state'] == 'running'
+
+        release.set()
+        assert server.ready.wait(5.0)
+
+        status, health = get_health(server)
+        assert status == 200
+        assert health['status'] == 'ok'
+        assert health['warmup']['state'] == 'completed'
+        assert health['warmup']['done'] == 2
+    finally:
+        release.set()
+        server.httpd.shutdown()
+        server.shutdown()
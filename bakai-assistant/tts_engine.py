@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tts_engine.py
+Многопроцессный синтез речи: предложения распределяются по пулу процессов Silero
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from config import TTS_CONFIG
+from tts_system import split_for_synthesis
+
+# Модель рабочего процесса: загружается один раз при старте процесса
+_worker_model = None
+
+
+def _init_worker(cache_dir: str, language: str, model_name: str, threads: int) -> None:
+    """Инициализация рабочего процесса: потоки torch и загрузка модели"""
+    global _worker_model
+    from tts_system import configure_torch_threads, load_silero_model
+
+    configure_torch_threads(threads)
+    # Параллелизм обеспечивают процессы - межоперационные потоки только мешают
+    torch.set_num_interop_threads(1)
+    _worker_model = load_silero_model(cache_dir, language, model_name)
+
+
+def _synthesize_in_worker(text: str, speaker: str, sample_rate: int):
+    """Синтез одного фрагмента в рабочем процессе"""
+    audio = _worker_model.apply_tts(text=text, speaker=speaker, sample_rate=sample_rate)
+    return audio.numpy()
+
+
+class BakaiSynthesisEngine:
+    """Пул процессов Silero TTS: каждый процесс держит свою копию модели"""
+
+    def __init__(self, workers: int = None, threads_per_worker: int = None, cache_dir: str = None):
+        self.workers = workers or TTS_CONFIG.get("synthesis_workers", 0) or 1
+        self.threads_per_worker = threads_per_worker or TTS_CONFIG.get("synthesis_threads_per_worker", 1)
+        self.sample_rate = TTS_CONFIG["sample_rate"]
+
+        print(f"🔊 Пул синтеза речи: процессов {self.workers}, потоков torch на процесс {self.threads_per_worker}")
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # spawn: fork процесса с уже инициализированным torch может зависнуть
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                cache_dir or TTS_CONFIG["cache_dir"],
+                TTS_CONFIG["language"],
+                TTS_CONFIG["model_name"],
+                self.threads_per_worker
+            )
+        )
+
+    def synthesize(self, text: str, voice: str) -> torch.Tensor:
+        """Синтез текста: фрагменты параллельно, аудио собирается в исходном порядке"""
+        chunks = split_for_synthesis(text) or [text]
+        futures = [
+            self.executor.submit(_synthesize_in_worker, chunk, voice, self.sample_rate)
+            for chunk in chunks
+        ]
+        return torch.cat([torch.from_numpy(future.result()) for future in futures])
+
+    def shutdown(self) -> None:
+        """Остановка рабочих процессов"""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tts_queue.py
+Фоновая очередь озвучивания: синтез речи не задерживает текстовый ответ
+"""
+
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from config import TTS_CONFIG
+
+
+class BakaiTTSQueue:
+    """Очередь заданий озвучивания с пулом рабочих потоков"""
+
+    def __init__(self, tts, workers: int = None, max_jobs: int = None):
+        self.tts = tts
+        # Модель Silero не потокобезопасна: по умолчанию один поток,
+        # он же сохраняет порядок "вопрос -> ответ" при воспроизведении
+        self.workers = workers or TTS_CONFIG.get("queue_workers", 1)
+        self.max_jobs = max_jobs or TTS_CONFIG.get("queue_max_jobs", 256)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakai-tts")
+        self._jobs: "OrderedDict[str, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, text: str, voice: str = None, play_audio: bool = True) -> Tuple[str, Future]:
+        """Постановка текста в очередь; возвращает id задания и future с путем к аудио"""
+        job_id = uuid.uuid4().hex[:12]
+        future = self.executor.submit(self.tts.speak, text, voice=voice, play_audio=play_audio)
+        self._track(job_id, future)
+        return job_id, future
+
+    def submit_many(self, texts: List[str], voice: str = None,
+                    play_audio: bool = False) -> Tuple[str, Future]:
+        """Постановка нескольких текстов одним пакетным заданием; future - со списком путей"""
+        job_id = uuid.uuid4().hex[:12]
+        future = self.executor.submit(self.tts.speak_many, texts, voice=voice, play_audio=play_audio)
+        self._track(job_id, future)
+        return job_id, future
+
+    def submit_file(self, path: str, play_audio: bool = True) -> Tuple[str, Future]:
+        """Постановка готового аудиофайла: воспроизведение - в общем порядке очереди"""
+        job_id = uuid.uuid4().hex[:12]
+        future = self.executor.submit(self._play_file, path, play_audio)
+        self._track(job_id, future)
+        return job_id, future
+
+    def _play_file(self, path: str, play_audio: bool) -> str:
+        if play_audio:
+            self.tts._play_audio_file(path)
+        return path
+
+    def speak(self, text: str, voice: str = None, play_audio: bool = True) -> Optional[str]:
+        """Синхронное озвучивание через очередь (ожидание результата)"""
+        _, future = self.submit(text, voice=voice, play_audio=play_audio)
+        return future.result()
+
+    def _track(self, job_id: str, future: Future) -> None:
+        """Регистрация задания для запросов статуса"""
+        with self._lock:
+            self._jobs[job_id] = future
+            # Храним только последние задания, чтобы не копить завершенные
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get_job(self, job_id: str) -> Optional[Future]:
+        """Future задания по id (None - если задание неизвестно или вытеснено)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        """Состояние задания озвучивания в JSON-совместимом виде"""
+        future = self.get_job(job_id)
+        if future is None:
+            return {"job_id": job_id, "status": "unknown"}
+        if not future.done():
+            return {"job_id": job_id, "status": "pending"}
+        if future.exception() is not None:
+            return {"job_id": job_id, "status": "failed", "error": str(future.exception())}
+
+        path = future.result()
+        if isinstance(path, list):
+            return {"job_id": job_id, "status": "done" if any(path) else "failed", "paths": path}
+        return {"job_id": job_id, "status": "done" if path else "failed", "path": path}
+
+    def pending_count(self) -> int:
+        """Количество незавершенных заданий"""
+        with self._lock:
+            return sum(1 for future in self._jobs.values() if not future.done())
+
+    def get_stats(self) -> Dict[str, int]:
+        """Сводка очереди для статуса системы"""
+        return {"workers": self.workers, "pending": self.pending_count(), "tracked_jobs": len(self._jobs)}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Остановка очереди (по умолчанию - после озвучивания оставшихся заданий)"""
+        self.executor.shutdown(wait=wait)
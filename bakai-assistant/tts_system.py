@@ -8,11 +8,89 @@ import os
 import re
 import ssl
 import time
+import hashlib
+import threading
 import subprocess
-from typing import Optional, List
+from collections import OrderedDict
+from typing import Dict, Optional, List
 import torch
 import torchaudio
 from config import TTS_CONFIG, CONTENT_CONFIG
+from query_analysis import select_voice
+
+
+def configure_torch_threads(threads: Optional[int]) -> None:
+    """Ограничение потоков torch (None - оставить значение по умолчанию)"""
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def load_silero_model(cache_dir: str, language: str, model_name: str):
+    """Загрузка модели Silero TTS из кэша torch.hub"""
+    # Настройка SSL для загрузки модели
+    ssl._create_default_https_context = ssl._create_unverified_context
+    
+    # Создаем директорию кэша
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.hub.set_dir(cache_dir)
+    
+    # Загружаем русскую модель Silero
+    loaded = torch.hub.load(
+        repo_or_dir='snakers4/silero-models',
+        model='silero_tts',
+        language=language,
+        speaker=model_name,
+        force_reload=False,
+        trust_repo=True
+    )
+    
+    # jit-модели (*_16khz) возвращают утилиты, включая пакетный apply_tts
+    if len(loaded) == 5:
+        model, symbols, sample_rate, _, apply_tts = loaded
+        return SileroJitModel(model, symbols, sample_rate, apply_tts, model_name)
+    
+    model, _ = loaded
+    return model
+
+
+def split_for_synthesis(text: str, min_chars: int = None) -> List[str]:
+    """Разбиение текста на фрагменты по предложениям, короткие склеиваются с соседними"""
+    min_chars = min_chars or TTS_CONFIG.get("synthesis_min_chunk_chars", 40)
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+
+    chunks = []
+    for sentence in sentences:
+        if chunks and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+class SileroJitModel:
+    """jit-модель Silero с интерфейсом package-модели и пакетным синтезом"""
+    
+    def __init__(self, model, symbols: str, sample_rate: int, apply_tts, speaker: str):
+        self.model = model
+        self.symbols = symbols
+        self.native_sample_rate = sample_rate
+        self.speakers = [speaker]  # Голос зашит в модель
+        self._apply_tts = apply_tts
+    
+    def apply_tts(self, text: str, speaker: str = None, sample_rate: int = None):
+        """Синтез одного текста"""
+        return self.apply_tts_batch([text])[0]
+    
+    def apply_tts_batch(self, texts: List[str]) -> List:
+        """Один проход модели по списку текстов (дополнение и сортировка - в tts_utils)"""
+        return self._apply_tts(
+            texts=texts,
+            model=self.model,
+            sample_rate=self.native_sample_rate,
+            symbols=self.symbols,
+            device=torch.device('cpu')
+        )
+
 
 class BakaiTTS:
     """Система озвучивания для банка Бакай на основе Silero TTS"""
@@ -20,10 +98,14 @@ class BakaiTTS:
     def __init__(self, cache_dir: str = None):
         self.cache_dir = cache_dir or TTS_CONFIG["cache_dir"]
         self.model = None
+        self.engine = None
         self.sample_rate = TTS_CONFIG["sample_rate"]
         self.language = TTS_CONFIG["language"]
         self.model_name = TTS_CONFIG["model_name"]
         self.is_initialized = False
+        # (голос, текст) -> путь к уже синтезированному аудио
+        self._audio_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._audio_cache_lock = threading.Lock()
         self._init_model()
     
     def _init_model(self) -> None:
@@ -31,22 +113,14 @@ class BakaiTTS:
         try:
             print("🔊 Инициализация системы озвучивания Silero TTS...")
             
-            # Настройка SSL для загрузки модели
-            ssl._create_default_https_context = ssl._create_unverified_context
-            
-            # Создаем директорию кэша
-            os.makedirs(self.cache_dir, exist_ok=True)
-            torch.hub.set_dir(self.cache_dir)
+            configure_torch_threads(TTS_CONFIG.get("torch_threads"))
+            self.model = load_silero_model(self.cache_dir, self.language, self.model_name)
+            self.sample_rate = getattr(self.model, 'native_sample_rate', self.sample_rate)
             
-            # Загружаем русскую модель Silero
-            self.model, _ = torch.hub.load(
-                repo_or_dir='snakers4/silero-models',
-                model='silero_tts',
-                language=self.language,
-                speaker=self.model_name,
-                force_reload=False,
-                trust_repo=True
-            )
+            # Пул процессов синтеза: длинные ответы и параллельные запросы - на несколько ядер
+            if TTS_CONFIG.get("synthesis_workers", 0) > 0:
+                from tts_engine import BakaiSynthesisEngine
+                self.engine = BakaiSynthesisEngine(cache_dir=self.cache_dir)
             
             self.is_initialized = True
             print("✅ Система озвучивания готова!")
@@ -84,32 +158,165 @@ class BakaiTTS:
             if not voice:
                 voice = TTS_CONFIG["default_voice"]
             
-            print(f"🔊 Озвучивание голосом '{voice}': {clean_text[:50]}...")
-            
-            # Генерируем аудио
-            audio_tensor = self.model.apply_tts(
-                text=clean_text,
-                speaker=voice,
-                sample_rate=self.sample_rate
-            )
+            # Тот же текст тем же голосом уже озвучен - используем готовый файл
+            cached_file = self._cached_audio(voice, clean_text) if save_file else None
+            if cached_file:
+                print(f"♻️ Аудио из кэша: {cached_file}")
+                if play_audio:
+                    self._play_audio_file(cached_file)
+                return cached_file
             
-            # Сохраняем файл
-            filename = None
-            if save_file:
-                timestamp = int(time.time())
-                filename = f"/Users/zarinamacbook/rag_system/bakai-assistant/voices/bakai_speech_{timestamp}_{voice}.wav"
-                torchaudio.save(filename, audio_tensor.unsqueeze(0), self.sample_rate)
-            
-            # Воспроизводим
-            if play_audio and filename:
-                self._play_audio_file(filename)
+            print(f"🔊 Озвучивание голосом '{voice}': {clean_text[:50]}...")
             
+            # Генерируем аудио (хэш текста в имени файла - чтобы файл кэша не перезаписался)
+            audio_tensor = self.synthesize(clean_text, voice)
+            filename = self._save_audio(audio_tensor, voice, save_file, play_audio,
+                                        suffix=self._audio_suffix(clean_text))
+            self._remember_audio(voice, clean_text, filename)
             return filename
             
         except Exception as e:
             print(f"❌ Ошибка озвучивания: {e}")
             return None
     
+    @staticmethod
+    def _audio_suffix(text: str) -> str:
+        """Суффикс имени аудиофайла по хэшу текста: разные тексты не перезаписывают друг друга"""
+        return f"_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:10]}"
+    
+    def _cached_audio(self, voice: str, text: str) -> Optional[str]:
+        """Путь к ранее синтезированному аудио, если файл еще существует"""
+        with self._audio_cache_lock:
+            filename = self._audio_cache.get((voice, text))
+            if filename is None:
+                return None
+            if not os.path.exists(filename):
+                del self._audio_cache[(voice, text)]
+                return None
+            self._audio_cache.move_to_end((voice, text))
+            return filename
+    
+    def _remember_audio(self, voice: str, text: str, filename: Optional[str]) -> None:
+        cache_size = TTS_CONFIG.get("audio_cache_size", 256)
+        if not filename or cache_size <= 0:
+            return
+        with self._audio_cache_lock:
+            self._audio_cache[(voice, text)] = filename
+            while len(self._audio_cache) > cache_size:
+                self._audio_cache.popitem(last=False)
+    
+    def speak_many(self, texts: List[str], voice: str = None, save_file: bool = True,
+                   play_audio: bool = False) -> List[Optional[str]]:
+        """
+        Озвучивание нескольких текстов одним вызовом (пакетный синтез)
+        
+        Returns:
+            Пути к аудиофайлам в порядке текстов (None - для пустых и неудачных)
+        """
+        if not self.is_initialized or not self.model:
+            print("⚠️ TTS недоступен")
+            return [None] * len(texts)
+        
+        voice = voice or TTS_CONFIG["default_voice"]
+        clean_texts = [self._prepare_text_for_speech(text) for text in texts]
+        results: List[Optional[str]] = [None] * len(texts)
+        
+        # Уже озвученные тексты берем из кэша, одинаковые тексты синтезируем один раз
+        pending: Dict[str, List[int]] = {}
+        for index, text in enumerate(clean_texts):
+            if not text.strip():
+                continue
+            cached_file = self._cached_audio(voice, text) if save_file else None
+            if cached_file:
+                results[index] = cached_file
+                if play_audio:
+                    self._play_audio_file(cached_file)
+            else:
+                pending.setdefault(text, []).append(index)
+        
+        if not pending:
+            return results
+        
+        try:
+            print(f"🔊 Пакетное озвучивание голосом '{voice}': {len(pending)} текстов "
+                  f"(из кэша: {sum(1 for result in results if result)})")
+            audios = self.synthesize_many(list(pending), voice)
+        except Exception as e:
+            print(f"❌ Ошибка пакетного озвучивания: {e}")
+            return results
+        
+        for (text, indexes), audio in zip(pending.items(), audios):
+            filename = self._save_audio(audio, voice, save_file, play_audio, suffix=self._audio_suffix(text))
+            self._remember_audio(voice, text, filename)
+            for index in indexes:
+                results[index] = filename
+        return results
+    
+    def synthesize_many(self, texts: List[str], voice: str) -> List:
+        """Синтез списка текстов пакетами; без пакетного пути модели - по одному"""
+        if self.engine is not None or not hasattr(self.model, 'apply_tts_batch'):
+            return [self.synthesize(text, voice) for text in texts]
+        
+        audios: Dict[int, object] = {}
+        for batch in self._make_batches(texts):
+            outputs = self.model.apply_tts_batch([texts[index] for index in batch])
+            audios.update(zip(batch, outputs))
+        return [audios[index] for index in range(len(texts))]
+    
+    def _make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Группировка индексов текстов в пакеты, ограниченные числом и суммарной длиной
+        
+        Тексты близкой длины попадают в один пакет - меньше дополнения до самого длинного
+        """
+        max_items = TTS_CONFIG.get("batch_max_items", 8)
+        max_chars = TTS_CONFIG.get("batch_max_chars", 1000)
+        
+        batches, current, current_chars = [], [], 0
+        for index in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+            length = len(texts[index])
+            if current and (len(current) >= max_items or current_chars + length > max_chars):
+                batches.append(current)
+                current, current_chars = [], 0
+            current.append(index)
+            current_chars += length
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _save_audio(self, audio_tensor, voice: str, save_file: bool, play_audio: bool,
+                    suffix: str = "") -> Optional[str]:
+        """Сохранение и воспроизведение синтезированного аудио"""
+        filename = None
+        if save_file:
+            timestamp = int(time.time())
+            filename = f"/Users/zarinamacbook/rag_system/bakai-assistant/voices/bakai_speech_{timestamp}_{voice}{suffix}.wav"
+            torchaudio.save(filename, audio_tensor.unsqueeze(0), self.sample_rate)
+        
+        # Воспроизводим
+        if play_audio and filename:
+            self._play_audio_file(filename)
+        
+        return filename
+    
+    def synthesize(self, text: str, voice: str):
+        """Синтез подготовленного текста: в пуле процессов, если он включен"""
+        if self.engine is not None:
+            return self.engine.synthesize(text, voice)
+        
+        # Модель с пакетным путем: предложения длинного ответа - одним проходом
+        if hasattr(self.model, 'apply_tts_batch'):
+            chunks = split_for_synthesis(text)
+            if len(chunks) > 1:
+                return torch.cat(self.synthesize_many(chunks, voice))
+        
+        return self.model.apply_tts(text=text, speaker=voice, sample_rate=self.sample_rate)
+    
+    def shutdown(self) -> None:
+        """Остановка пула процессов синтеза"""
+        if self.engine is not None:
+            self.engine.shutdown()
+    
     def _prepare_text_for_speech(self, text: str) -> str:
         """Подготовка текста для качественного озвучивания"""
         # Убираем URL и технические метки
@@ -213,13 +420,4 @@ class BakaiTTS:
     
     def select_voice_for_query(self, query: str) -> str:
         """Автоматический выбор голоса в зависимости от типа запроса"""
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ['где', 'адрес', 'находится', 'расположен']):
-            return 'aidar'  # Мужской голос для адресов
-        elif any(word in query_lower for word in ['как', 'способ', 'инструкция', 'оформить']):
-            return 'baya'   # Женский голос для инструкций
-        elif any(word in query_lower for word in ['важно', 'внимание', 'срочно']):
-            return 'xenia'  # Четкий голос для важной информации
-        else:
-            return 'kseniya'  # Мягкий женский голос по умолчанию
\ No newline at end of file
+        return select_voice(query.lower())
\ No newline at end of file
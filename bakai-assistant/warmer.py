@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+warmer.py
+Прогрев кэшей после запуска: ответы FAQ на самые частые запросы журнала и их озвучка
+"""
+
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict
+from config import MATERIALIZE_CONFIG, WARMUP_CONFIG
+from query_log import top_query_clusters
+from request_context import BakaiRequestContext
+
+
+class BakaiCacheWarmer:
+    """Прогрев слоев с состоянием частыми запросами журнала: разбор запроса, улучшенный ответ FAQ
+    и его озвучка
+
+    Генерация LLM не запускается: ее ответы не кэшируются, поэтому запросы без ответа
+    из FAQ и уже материализованные пропускаются. Озвучка ждет завершения внутри прогрева,
+    чтобы очередь TTS была свободна к моменту готовности. После исчерпания бюджета новые
+    запросы не запускаются, а начатые завершаются в фоне
+    """
+
+    def __init__(self, assistant, concurrency: int = None, budget: float = None, with_audio: bool = None):
+        self.assistant = assistant
+        self.concurrency = concurrency or WARMUP_CONFIG.get("concurrency", 2)
+        self.budget = budget or WARMUP_CONFIG.get("budget", 120.0)
+        self.with_audio = WARMUP_CONFIG.get("with_audio", True) if with_audio is None else with_audio
+
+        self._lock = threading.Lock()
+        self._progress = {'state': 'idle', 'total': 0, 'started': 0, 'done': 0, 'skipped': 0,
+                          'failed': 0, 'elapsed': 0.0}
+
+    def run(self, query_log: str = None, top_n: int = None) -> Dict[str, Any]:
+        """Прогрев; возвращает итоговый прогресс"""
+        clusters = top_query_clusters(
+            query_log or MATERIALIZE_CONFIG.get("query_log_path"),
+            top_n or WARMUP_CONFIG.get("top_queries", 50)
+        )
+        queries = [cluster['query'] for cluster in clusters]
+        self._update(state='running', total=len(queries))
+        print(f"🔥 Прогрев кэшей: {len(queries)} частых запросов "
+              f"(параллельно: {self.concurrency}, бюджет: {self.budget:.0f} с)")
+
+        start_time = time.perf_counter()
+        deadline = start_time + self.budget
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bakai-warmup")
+        pending = set()
+        remaining = iter(queries)
+        try:
+            while True:
+                # Новые запросы - только пока есть свободные места и бюджет
+                while len(pending) < self.concurrency and time.perf_counter() < deadline:
+                    query = next(remaining, None)
+                    if query is None:
+                        break
+                    pending.add(executor.submit(self._warm_query, query))
+                    self._increment('started')
+
+                time_left = deadline - time.perf_counter()
+                if not pending or time_left <= 0:
+                    break
+
+                done, pending = wait(pending, timeout=time_left, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        self._increment('failed')
+                    else:
+                        self._increment('done' if future.result() else 'skipped')
+                    self._print_progress(start_time)
+        finally:
+            executor.shutdown(wait=False)
+
+        state = 'completed' if not pending and self.get_progress()['started'] == len(queries) else 'budget_exhausted'
+        self._update(state=state, elapsed=round(time.perf_counter() - start_time, 1))
+        progress = self.get_progress()
+        print(f"{'✅' if state == 'completed' else '⏱️'} Прогрев завершен: {progress['done']}/{progress['total']} "
+              f"запросов за {progress['elapsed']} с (без ответа FAQ: {progress['skipped']})"
+              + ("" if state == 'completed' else f" (бюджет исчерпан, не запущено: {len(queries) - progress['started']})"))
+        return progress
+
+    def _warm_query(self, query: str) -> bool:
+        """Один запрос; False - прогревать нечего (нет ответа FAQ или ответ уже готов)"""
+        assistant = self.assistant
+        if assistant.answer_store is not None and query in assistant.answer_store:
+            return False
+
+        # Разбор и ключи - как в конвейере помощника, чтобы запрос пользователя попал в те же кэши
+        ctx = BakaiRequestContext(query, stage_budgets={})
+        ctx.analysis = assistant.query_analyzer.analyze(query)
+        ctx.service_type = ctx.analysis.service_type
+        documents = assistant.rag.find_faq_documents(query, ctx)
+        if not documents:
+            return False
+
+        ctx.search_type = 'exact_match'
+        raw_answer = assistant.rag.generate_answer(query, documents, ctx.search_type, ctx=ctx)
+        answer = assistant.content_manager.enhance_response(raw_answer, query, ctx)
+
+        if self.with_audio and assistant.tts_enabled and assistant.tts.is_initialized:
+            _, audio_job = assistant.tts_queue.submit(answer, ctx.analysis.voice, play_audio=False)
+            audio_job.result()
+        return True
+
+    def _print_progress(self, start_time: float) -> None:
+        progress = self.get_progress()
+        finished = progress['done'] + progress['skipped'] + progress['failed']
+        print(f"   🔥 [{finished}/{progress['total']}] готово: {progress['done']}, "
+              f"пропущено: {progress['skipped']}, ошибок: {progress['failed']}, "
+              f"{time.perf_counter() - start_time:.1f} с")
+
+    def _update(self, **values: Any) -> None:
+        with self._lock:
+            self._progress.update(values)
+
+    def _increment(self, name: str) -> None:
+        with self._lock:
+            self._progress[name] += 1
+
+    def get_progress(self) -> Dict[str, Any]:
+        """Состояние прогрева (idle / running / completed / budget_exhausted) и счетчики"""
+        with self._lock:
+            return dict(self._progress)